@@ -3,22 +3,43 @@ Flask Backend API for Prescription Management System
 Handles CSV file operations for authentication, info, prescription, progress, etc.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import csv
-import os
+import base64
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+from drug_interactions import InteractionIndex
+from drug_search import DrugSearchIndex
+from http_cache import (MIN_COMPRESS_BYTES, ResponseCache, compress, encoded_etag,
+                        etag_matches, make_etag, matched_etag, supported_encodings)
+from metrics import CONTENT_TYPE, Profiler, Registry, family
+from reminders import ReminderScheduler
+from table_cache import TableCache, TableEntry, csv_row, widened
+from table_changes import ChangeFeed
+from table_import import ImportFormatError, merge_records, stream_tables
+from table_index import DuplicateKeyError, build_index_columns
+from table_locks import TableLocks
+from table_query import Query, QueryError, run_query
+from table_log import LogCompactor, delete_entry, insert_entry, log_path, remove_log, update_entry
+from table_storage import CsvStorage, SqliteStorage
+
 app = Flask(__name__)
-CORS(app)  # Enable CORS for frontend requests
+CORS(app, expose_headers=['ETag', 'X-Next-Cursor'])  # Enable CORS for frontend requests
 
-# Base paths
+# Base paths; PRESCRIPCARE_DATABASE_DIR points the backend at another
+# database directory, such as one written by database/generate_data.py
 BASE_DIR = Path(__file__).parent.parent
-DATABASE_DIR = BASE_DIR / 'database'
+DATABASE_DIR = Path(os.environ.get('PRESCRIPCARE_DATABASE_DIR', BASE_DIR / 'database'))
 CORE_TABLES_DIR = DATABASE_DIR / 'core_tables'
 MASTER_DATA_DIR = DATABASE_DIR / 'master_data'
+ANALYTICS_DIR = DATABASE_DIR / 'analytics'
+CONFIG_DIR = DATABASE_DIR / 'config'
 
 # Table paths mapping
 TABLE_PATHS = {
@@ -28,94 +49,555 @@ TABLE_PATHS = {
     'progress': CORE_TABLES_DIR / 'progress.csv',
     'lifestyle': CORE_TABLES_DIR / 'lifestyle.csv',
     'drugs': MASTER_DATA_DIR / 'drugs.csv',
+    'drugs_master': MASTER_DATA_DIR / 'drugs_master.csv',
+    'drug_interactions': MASTER_DATA_DIR / 'drug_interactions.csv',
+    # Materialized by database_utils.py adherence (database/adherence.py)
+    'adherence_summaries': ANALYTICS_DIR / 'adherence_summaries.csv',
+    'medication_adherence': ANALYTICS_DIR / 'medication_adherence.csv',
+    'adherence_daily': ANALYTICS_DIR / 'adherence_daily.csv',
+    'adherence_weekly': ANALYTICS_DIR / 'adherence_weekly.csv',
 }
 
+# Largest page GET /api/tables/<table_name> returns for ?limit=
+MAX_PAGE_SIZE = 1000
+
+# One row per user; its relationships in table_schemas.json name the
+# per-user tables GET /api/users/<user_id>/dashboard brings together
+USER_TABLE = 'authentication'
+
+# Columns the user endpoints never send back
+HIDDEN_COLUMNS = {'authentication': {'password'}}
+
+# Most results GET /api/drugs/search returns for ?limit=
+MAX_SEARCH_RESULTS = 100
+
+
+def load_config_file(file_name):
+    """Load a JSON file from the database config directory"""
+    try:
+        with open(CONFIG_DIR / file_name, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error loading {file_name}: {e}")
+        return {}
+
+
+DB_CONFIG = load_config_file('database_config.json')
+TABLE_SCHEMAS = load_config_file('table_schemas.json').get('table_schemas', {})
+PERFORMANCE_SETTINGS = DB_CONFIG.get('performance_settings', {})
+STORAGE_SETTINGS = DB_CONFIG.get('storage_settings', {})
+REMINDER_SETTINGS = DB_CONFIG.get('reminder_settings', {})
+METRICS_SETTINGS = DB_CONFIG.get('metrics_settings', {})
+
+# Tables /api/import-from-localstorage writes at the same time
+IMPORT_WORKERS = PERFORMANCE_SETTINGS.get('import_workers', 4)
+
+# "csv" keeps each table in its file under TABLE_PATHS, "sqlite" keeps them
+# all in one SQLite database (see table_storage)
+STORAGE_ENGINE = STORAGE_SETTINGS.get('engine', 'csv')
+SQLITE_PATH = DATABASE_DIR / STORAGE_SETTINGS.get('sqlite_path', 'prescripcare.sqlite3')
+
+# "direct" writes each change into the CSV files, "wal" appends it to a
+# per-table write-ahead log that is compacted into the CSV in the background
+USE_WRITE_AHEAD_LOG = STORAGE_ENGINE == 'csv' and STORAGE_SETTINGS.get('mode', 'direct') == 'wal'
+
+# Single-row changes are written as log entries (see log_mutation) rather
+# than by rewriting the table: logged in "wal" mode, a transaction in SQLite
+LOGGED_WRITES = USE_WRITE_AHEAD_LOG or STORAGE_ENGINE == 'sqlite'
+
+if STORAGE_ENGINE == 'sqlite':
+    storage = SqliteStorage(SQLITE_PATH, TABLE_PATHS, TABLE_SCHEMAS)
+elif STORAGE_ENGINE == 'csv':
+    storage = CsvStorage(TABLE_PATHS, use_logs=USE_WRITE_AHEAD_LOG)
+else:
+    raise ValueError(f"Unknown storage engine: {STORAGE_ENGINE}")
+
+# Parallel readers / one writer per table, shared with other processes
+table_locks = TableLocks(TABLE_PATHS)
+
+# Parsed tables shared by all requests, refreshed when the storage changes
+table_cache = TableCache(
+    storage,
+    build_index_columns(TABLE_SCHEMAS, PERFORMANCE_SETTINGS.get('index_columns', True)),
+    locks=table_locks,
+)
+
+# Versioned change journal per table for /api/tables/<table_name>/changes
+change_feeds = {
+    table_name: ChangeFeed(
+        file_path,
+        TABLE_SCHEMAS.get(table_name, {}).get('primary_key', 'user_id'),
+        max_entries=STORAGE_SETTINGS.get('change_feed_max_entries', 10000),
+    )
+    for table_name, file_path in TABLE_PATHS.items()
+}
+
+# Serialized (and compressed) table reads per table version
+response_cache = ResponseCache()
+
+# Search index over drugs_master, refreshed from the cached table
+drug_search = DrugSearchIndex(TABLE_SCHEMAS.get('drugs_master', {}).get('primary_key', 'drug_id'))
+
+# Unordered drug pair -> drug_interactions rows, rebuilt when the table changes
+interaction_index = InteractionIndex()
+
+log_compactor = None
+log_compactor_lock = threading.Lock()
+
+# Started by the first client that subscribes to reminders
+reminder_scheduler = None
+reminder_scheduler_lock = threading.Lock()
+
+# Served at /api/metrics; the collectors below add the components' stats()
+metrics = Registry(prefix='prescripcare_')
+request_count = metrics.counter(
+    'http_requests_total', 'Requests served', ('method', 'endpoint', 'status'))
+request_latency = metrics.histogram(
+    'http_request_duration_seconds', 'Time to produce a response, streamed bodies excluded',
+    ('method', 'endpoint'))
+encode_latency = metrics.histogram(
+    'response_encode_seconds', 'Time to serialize (stage=json) and compress table responses',
+    ('table', 'stage'))
+
+# cProfile of requests sending the profile header, saved when slow (opt-in)
+profiler = Profiler(
+    DATABASE_DIR / METRICS_SETTINGS.get('profile_dir', 'logs/profiles'),
+    enabled=METRICS_SETTINGS.get('profiling', False),
+    header=METRICS_SETTINGS.get('profile_header', 'X-Profile'),
+    slow_seconds=METRICS_SETTINGS.get('profile_slow_ms', 500) / 1000,
+    sample_rate=METRICS_SETTINGS.get('profile_sample_rate', 0.0),
+)
+
+
+def primary_key_for(table_name):
+    """Primary key column of a table as declared in table_schemas.json"""
+    return TABLE_SCHEMAS.get(table_name, {}).get('primary_key', 'user_id')
+
+
+def check_unique_columns(table_name, entry, record, removed=()):
+    """Raise DuplicateKeyError if record repeats a value in a unique index
+
+    Values are compared as they will be stored, so {"user_id": 5} collides
+    with the "5" already in the table. Rows at the positions in removed
+    (deleted, but not yet dropped from the entry) do not count.
+    """
+    for column, unique in entry.index_spec.items():
+        if not unique or column not in record:
+            continue
+        value = csv_row((column,), record)[column]
+        if any(position not in removed for position in entry.index(column).lookup(value)):
+            raise DuplicateKeyError(table_name, column, value)
+
+
+def record_changes(table_name):
+    """Version whatever changed in a table since its change feed last looked
+
+    Called with the table's write lock held, after each write.
+    """
+    return change_feeds[table_name].refresh(table_cache.get(table_name))
+
 
 def read_csv(table_name):
-    """Read data from CSV file"""
-    file_path = TABLE_PATHS.get(table_name)
-    if not file_path or not file_path.exists():
-        return []
-    
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            data.append(row)
-    return data
-
-
-def write_csv(table_name, data):
-    """Write data to CSV file"""
-    file_path = TABLE_PATHS.get(table_name)
-    if not file_path:
+    """Read a table's records (served from the table cache while unchanged)
+
+    The returned list is a copy, but the row dicts are shared with the
+    cache and must not be modified in place.
+    """
+    with table_locks.read(table_name):
+        entry = table_cache.get(table_name)
+        if entry is None:
+            return []
+        return list(entry.rows)
+
+
+def write_csv(table_name, data, headers=None):
+    """Write a whole table, replacing its records
+
+    See the storage engine's replace(): a CSV is written to a temporary
+    file that then replaces it, folding in any write-ahead log; a SQLite
+    table is recreated in one transaction.
+    """
+    if table_name not in TABLE_PATHS:
         return False
     
-    if not data:
+    if not data and not headers:
         return True
     
-    # Get headers from first row
-    headers = list(data[0].keys())
+    # Get headers from first row unless given
+    if headers is None:
+        headers = list(data[0].keys())
     
-    with open(file_path, 'w', encoding='utf-8', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=headers)
-        writer.writeheader()
-        writer.writerows(data)
+    with table_locks.write(table_name):
+        storage.replace(table_name, headers, data)
+        table_cache.put(table_name, headers, [csv_row(headers, record) for record in data])
+        record_changes(table_name)
+    return True
+
+
+def log_mutation(table_name, log_entries, cached=False):
+    """Write changes as log entries (see table_log) and mirror them in the cache
+
+    All entries go out in one write: appended to the table's write-ahead
+    log with one fsync, or applied in one SQLite transaction. cached=True
+    means the caller has already applied them to the table's current
+    cache entry.
+    """
+    if USE_WRITE_AHEAD_LOG:
+        start_log_compactor()
     
+    def mirror(entry):
+        if not cached:
+            for log_entry in log_entries:
+                entry.apply(log_entry)
+        else:
+            entry.log_entries += len(log_entries)
+    
+    with table_locks.write(table_name):
+        before = table_cache.file_state(table_name)
+        storage.bulk(table_name, log_entries)
+        after = table_cache.file_state(table_name)
+        table_cache.applied(table_name, mirror, before, after)
+        record_changes(table_name)
     return True
 
 
+def compact_table(table_name, cache=None):
+    """Fold a table's write-ahead log into a fresh CSV file"""
+    cache = cache or table_cache
+    file_path = TABLE_PATHS[table_name]
+    
+    with table_locks.write(table_name):
+        if not log_path(file_path).exists():
+            return False
+        entry = cache.get(table_name)
+        if entry is None:
+            return False
+        if not entry.log_entries:
+            remove_log(file_path)
+            return False
+        return write_csv(table_name, entry.rows, entry.fieldnames)
+
+
+def pending_log_entries(table_name):
+    """Number of entries in a table's write-ahead log"""
+    entry = table_cache.get(table_name)
+    return entry.log_entries if entry else 0
+
+
+def recover_table_logs():
+    """Fold write-ahead logs left behind by a previous run into their tables
+
+    Logs are replayed whatever the current storage mode, so switching back
+    to "direct" after a crash in "wal" mode loses nothing. With the sqlite
+    engine they stay with their CSV files, for "table_storage.py import"
+    or a later run on CSV storage to fold in.
+    """
+    if STORAGE_ENGINE != 'csv':
+        return
+    recovery_cache = TableCache(CsvStorage(TABLE_PATHS, use_logs=True), locks=table_locks)
+    for table_name, file_path in TABLE_PATHS.items():
+        if log_path(file_path).exists():
+            compact_table(table_name, recovery_cache)
+
+
+def start_log_compactor():
+    """Start the background log compactor on the first logged write"""
+    global log_compactor
+    if log_compactor is not None:
+        return
+    with log_compactor_lock:
+        if log_compactor is None:
+            log_compactor = LogCompactor(
+                TABLE_PATHS,
+                compact_table,
+                pending_log_entries,
+                max_entries=STORAGE_SETTINGS.get('log_max_entries', 1000),
+                max_bytes=STORAGE_SETTINGS.get('log_max_bytes', 4 * 1024 * 1024),
+                interval=STORAGE_SETTINGS.get('compaction_interval_seconds', 5),
+            )
+            log_compactor.start()
+
+
 def append_to_csv(table_name, record):
-    """Append a single record to CSV file"""
-    file_path = TABLE_PATHS.get(table_name)
-    if not file_path:
+    """Append a single record to a table
+
+    Only the new row is written, in the column order of the existing header
+    (or logged, in "wal" mode, or inserted, in SQLite). Columns the record
+    lacks are left empty. Columns the table does not have yet widen it; in
+    "direct" mode that is the one case that rewrites the table.
+    """
+    if table_name not in TABLE_PATHS:
         return False
     
-    # Read existing data
-    data = read_csv(table_name)
-    
-    # Add timestamps if not present
-    if 'created_at' not in record:
-        record['created_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    if 'updated_at' not in record:
-        record['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # Unique checks and the write must see the same version of the table
+    with table_locks.write(table_name):
+        entry = table_cache.get(table_name)
+        if entry:
+            check_unique_columns(table_name, entry, record)
+        
+        # Add timestamps if not present
+        if 'created_at' not in record:
+            record['created_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if 'updated_at' not in record:
+            record['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        # New or empty file: the header comes from the record
+        headers = entry.fieldnames if entry else []
+        if not headers:
+            return write_csv(table_name, [record])
+        
+        if LOGGED_WRITES:
+            return log_mutation(table_name, [insert_entry(csv_row(widened(headers, record), record))])
+        
+        new_columns = [key for key in record if key not in headers]
+        if new_columns:
+            return write_csv(table_name, list(entry.rows) + [record], headers + new_columns)
+        
+        before = table_cache.file_state(table_name)
+        storage.insert(table_name, headers, record)
+        after = table_cache.file_state(table_name)
+        
+        row = csv_row(headers, record)
+        table_cache.applied(table_name, lambda entry: entry.append(row), before, after)
+        record_changes(table_name)
+    return True
+
+
+@app.before_request
+def start_request():
+    """Time the request, and profile it if the profiler picks it"""
+    g.request_started = time.perf_counter()
+    g.profile = profiler.start(request.headers)
+
+
+@app.after_request
+def record_request(response):
+    """Count the request and its latency under its URL rule"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_count.inc(request.method, endpoint, str(response.status_code))
+    request_latency.observe(seconds, request.method, endpoint)
     
-    # Append new record
-    data.append(record)
+    profile = g.pop('profile', None)
+    if profile is not None:
+        saved = profiler.finish(profile, seconds, request.method, endpoint)
+        if saved:
+            response.headers['X-Profile-File'] = os.path.basename(saved)
+    return response
+
+
+@app.teardown_request
+def stop_profile(error=None):
+    """Discard the profile of a request that ended without a response"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile, 0, request.method, '')
+
+
+def encode_cursor(key):
+    """Opaque pagination cursor for the last primary key on a page"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Primary key a cursor from encode_cursor() points after"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+
+
+def parse_fields(fieldnames):
+    """Columns requested with ?fields=a,b (None for all)"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in fieldnames]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def project(rows, fields):
+    """Rows restricted to the given columns"""
+    if fields is None:
+        return rows
+    return [{field: row.get(field) for field in fields} for row in rows]
+
+
+def ndjson_response(rows, fields, next_cursor=None):
+    """Stream rows as newline-delimited JSON"""
+    def generate():
+        for row in rows:
+            if fields is not None:
+                row = {field: row.get(field) for field in fields}
+            yield json.dumps(row) + '\n'
     
-    # Write back
-    return write_csv(table_name, data)
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+def with_etag(response, etag):
+    """Mark a table read response as revalidatable under etag"""
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+
+def not_modified(etag):
+    """304 answer to an If-None-Match that still matches
+
+    It carries the tag the client holds, which for a compressed body is
+    the encoded_etag of etag.
+    """
+    held = matched_etag(request.headers.get('If-None-Match'), etag)
+    return with_etag(Response(status=304), held or etag)
+
+
+def response_encoding():
+    """Best content coding the client accepts, or None for identity"""
+    return request.accept_encodings.best_match(supported_encodings())
+
+
+def cached_response(table_name, state, etag):
+    """Response for etag from response_cache, or None on a miss"""
+    cached = response_cache.get(table_name, state, (etag, response_encoding()))
+    if cached is None:
+        return None
+    return encoded_response(*cached, etag)
+
+
+def cache_response(table_name, state, etag, result):
+    """Serialize (and compress) a JSON result, keep it in response_cache and return it"""
+    encoding = response_encoding()
+    started = time.perf_counter()
+    body = app.json.response(result).get_data()
+    encode_latency.observe(time.perf_counter() - started, table_name, 'json')
+    applied = None
+    if encoding and len(body) >= MIN_COMPRESS_BYTES:
+        started = time.perf_counter()
+        body = compress(body, encoding)
+        encode_latency.observe(time.perf_counter() - started, table_name, encoding)
+        applied = encoding
+    response_cache.put(table_name, state, (etag, encoding), body, applied)
+    return encoded_response(body, applied, etag)
+
+
+def encoded_response(body, encoding, etag):
+    response = Response(body, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return with_etag(response, encoded_etag(etag, encoding))
 
 
 @app.route('/api/tables/<table_name>', methods=['GET'])
 def get_table(table_name):
-    """Get all records from a table"""
+    """Get records from a table
+
+    Query parameters:
+        limit   page size; pages are ordered by the primary key
+        cursor  next_cursor of the previous page
+        fields  comma-separated columns to return
+
+    With "Accept: application/x-ndjson" rows are streamed one JSON object
+    per line; a page's next cursor is then sent in the X-Next-Cursor header.
+    """
     try:
-        data = read_csv(table_name)
-        return jsonify({'success': True, 'data': data})
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        if limit is not None and limit < 1:
+            return jsonify({'success': False, 'error': 'limit must be positive'}), 400
+        paginate = limit is not None or cursor is not None
+        stream = request.accept_mimetypes.best_match(
+            ['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+        
+        variant = ('ndjson' if stream else 'json', limit, cursor, request.args.get('fields'))
+        
+        # A full-table stream of a table that isn't cached (and has no
+        # write-ahead log to merge) is read straight from storage
+        if stream and not paginate and table_name in TABLE_PATHS \
+                and not table_cache.is_cached(table_name):
+            state = table_cache.file_state(table_name)
+            streamed = storage.stream(table_name)
+            if streamed is not None:
+                etag = make_etag(table_name, state, *variant)
+                if etag_matches(request.headers.get('If-None-Match'), etag):
+                    return not_modified(etag)
+                fieldnames, rows = streamed
+                return with_etag(ndjson_response(rows, parse_fields(fieldnames)), etag)
+        
+        with table_locks.read(table_name):
+            entry = table_cache.get(table_name)
+            if entry is None:
+                return ndjson_response([], None) if stream else jsonify({'success': True, 'data': []})
+            
+            state = entry.state
+            etag = make_etag(table_name, state, *variant)
+            if etag_matches(request.headers.get('If-None-Match'), etag):
+                return not_modified(etag)
+            if not stream:
+                cached = cached_response(table_name, state, etag)
+                if cached is not None:
+                    return cached
+            
+            fields = parse_fields(entry.fieldnames)
+            next_cursor = None
+            if paginate:
+                index = entry.sorted_index(primary_key_for(table_name))
+                after = decode_cursor(cursor) if cursor else None
+                positions, last_key = index.page_after(after, min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE))
+                rows = [entry.rows[i] for i in positions]
+                next_cursor = encode_cursor(last_key) if last_key is not None else None
+            else:
+                # Snapshot of the row list; rows themselves are never modified
+                rows = list(entry.rows)
+        
+        if stream:
+            return with_etag(ndjson_response(rows, fields, next_cursor=next_cursor), etag)
+        
+        result = {'success': True, 'data': project(rows, fields)}
+        if paginate:
+            result['next_cursor'] = next_cursor
+        return cache_response(table_name, state, etag, result)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
 @app.route('/api/tables/<table_name>/find', methods=['POST'])
 def find_records(table_name):
-    """Find records matching criteria"""
+    """Find records matching a query (see table_query for the format)"""
     try:
-        criteria = request.json
-        data = read_csv(table_name)
-        
-        # Filter data based on criteria
-        filtered_data = []
-        for record in data:
-            match = True
-            for key, value in criteria.items():
-                if record.get(key) != value:
-                    match = False
-                    break
-            if match:
-                filtered_data.append(record)
-        
-        return jsonify({'success': True, 'data': filtered_data})
+        columns = TABLE_SCHEMAS.get(table_name, {}).get('columns', {})
+        query = Query.parse(request.json, columns)
+        with table_locks.read(table_name):
+            entry = table_cache.get(table_name)
+            if entry is None:
+                return jsonify({'success': True, 'data': [], 'plan': None})
+            
+            state = entry.state
+            etag = make_etag(table_name, state, 'find', json.dumps(request.json, sort_keys=True))
+            if etag_matches(request.headers.get('If-None-Match'), etag):
+                return not_modified(etag)
+            cached = cached_response(table_name, state, etag)
+            if cached is not None:
+                return cached
+            
+            # Filter data based on criteria
+            filtered_data, plan = run_query(entry, query, columns)
+        
+        return cache_response(table_name, state, etag,
+                              {'success': True, 'data': filtered_data, 'plan': plan})
+    except QueryError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -131,6 +613,8 @@ def add_record(table_name):
             return jsonify({'success': True, 'data': record})
         else:
             return jsonify({'success': False, 'error': 'Failed to add record'}), 500
+    except DuplicateKeyError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -140,25 +624,29 @@ def update_record(table_name, user_id):
     """Update a record in table"""
     try:
         updates = request.json
-        data = read_csv(table_name)
-        
-        # Find and update record
-        updated = False
-        for i, record in enumerate(data):
-            if record.get('user_id') == user_id:
-                # Update fields
-                for key, value in updates.items():
-                    record[key] = value
+        # Hold the write lock across read-modify-write so no update is lost
+        with table_locks.write(table_name):
+            entry = table_cache.get(table_name)
+            positions = entry.positions(primary_key_for(table_name), user_id) if entry else []
+            
+            # Update the first record with this key
+            if positions:
+                i = positions[0]
+                # Update fields on a copy so the cached row stays untouched
+                record = {**entry.rows[i], **updates}
                 record['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                data[i] = record
-                updated = True
-                break
-        
-        if updated:
-            write_csv(table_name, data)
-            return jsonify({'success': True, 'data': data})
-        else:
-            return jsonify({'success': False, 'error': 'Record not found'}), 404
+                headers = widened(entry.fieldnames, record)
+            
+                if LOGGED_WRITES:
+                    key_column = primary_key_for(table_name)
+                    log_mutation(table_name, [update_entry(key_column, user_id, csv_row(headers, record))])
+                else:
+                    data = list(entry.rows)
+                    data[i] = record
+                    write_csv(table_name, data, headers)
+                return jsonify({'success': True, 'data': read_csv(table_name)})
+            else:
+                return jsonify({'success': False, 'error': 'Record not found'}), 404
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -167,66 +655,651 @@ def update_record(table_name, user_id):
 def delete_record(table_name, user_id):
     """Delete a record from table"""
     try:
-        data = read_csv(table_name)
+        with table_locks.write(table_name):
+            entry = table_cache.get(table_name)
+            positions = set(entry.positions(primary_key_for(table_name), user_id)) if entry else set()
+            
+            # Filter out the records to delete
+            if positions:
+                if LOGGED_WRITES:
+                    log_mutation(table_name, [delete_entry(primary_key_for(table_name), user_id)])
+                else:
+                    new_data = [record for i, record in enumerate(entry.rows) if i not in positions]
+                    write_csv(table_name, new_data, entry.fieldnames)
+                return jsonify({'success': True})
+            else:
+                return jsonify({'success': False, 'error': 'Record not found'}), 404
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+def apply_batch(table_name, entry, operations):
+    """Apply batch operations to a table entry in memory
+
+    Each operation is {"op": "insert" | "update" | "upsert" | "delete",
+    "key": <primary key>, "record": {...}}; the key may also be given in
+    the record. Returns a result per operation and the write-ahead log
+    entries for the operations that changed the table.
+    """
+    key_column = primary_key_for(table_name)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    results = []
+    log_entries = []
+    # Removing shifts positions and drops the indexes, so deleted rows are
+    # only marked here and go in one pass at the end
+    removed = set()
+    
+    for i, operation in enumerate(operations):
+        result = {'index': i, 'op': None, 'key': None}
+        results.append(result)
+        if not isinstance(operation, dict):
+            result.update(status='error', error='Invalid operation')
+            continue
+        
+        op = result['op'] = operation.get('op')
+        record = operation.get('record') or {}
+        if not isinstance(record, dict):
+            result.update(status='error', error='Invalid operation')
+            continue
         
-        # Filter out the record to delete
-        new_data = [record for record in data if record.get('user_id') != user_id]
+        key = operation.get('key', record.get(key_column))
+        if key is not None:
+            # Keys are matched as stored: 5 finds the row keyed "5"
+            key = csv_row((key_column,), {key_column: key})[key_column]
+        result['key'] = key
+        if op not in ('insert', 'update', 'upsert', 'delete'):
+            result.update(status='error', error='Invalid operation')
+            continue
         
-        if len(new_data) < len(data):
-            write_csv(table_name, new_data)
-            return jsonify({'success': True})
+        positions = entry.positions(key_column, key) if key is not None else []
+        positions = [position for position in positions if position not in removed]
+        if op == 'upsert':
+            op = 'update' if positions else 'insert'
+        
+        if op == 'insert':
+            if key is not None:
+                record = {**record, key_column: key}
+            try:
+                check_unique_columns(table_name, entry, record, removed)
+            except DuplicateKeyError as e:
+                result.update(status='error', error=str(e))
+                continue
+            record = {'created_at': now, 'updated_at': now, **record}
+            row = csv_row(widened(entry.fieldnames, record), record)
+            entry.append(row)
+            log_entries.append(insert_entry(row))
+            result['status'] = 'inserted'
+        elif not positions:
+            result.update(status='error', error='Record not found')
+        elif op == 'update':
+            record = {**entry.rows[positions[0]], **record, 'updated_at': now}
+            row = csv_row(widened(entry.fieldnames, record), record)
+            entry.replace(positions[0], row)
+            log_entries.append(update_entry(key_column, key, row))
+            result['status'] = 'updated'
         else:
-            return jsonify({'success': False, 'error': 'Record not found'}), 404
+            removed.update(positions)
+            log_entries.append(delete_entry(key_column, key))
+            result['status'] = 'deleted'
+    
+    entry.remove(removed)
+    return results, log_entries
+
+
+def save_entry(table_name, entry, log_entries):
+    """Persist changes already applied to a table's cached entry
+
+    Called with the table's write lock held. In "wal" mode and in SQLite
+    only the log entries are written; otherwise, or while the table does
+    not exist yet, the whole table is rewritten from the entry.
+    """
+    if LOGGED_WRITES and entry.state is not None and entry.fieldnames:
+        return log_mutation(table_name, log_entries, cached=True)
+    return write_csv(table_name, entry.rows, entry.fieldnames)
+
+
+@app.route('/api/tables/<table_name>/batch', methods=['POST'])
+def batch_records(table_name):
+    """Apply many inserts/updates/upserts/deletes with a single table write
+
+    Body: {"operations": [...]} or a bare list of operations (see
+    apply_batch). Operations are applied in order; one that fails is
+    reported in its result and does not stop the others.
+    """
+    if table_name not in TABLE_PATHS:
+        return jsonify({'success': False, 'error': f"Unknown table '{table_name}'"}), 404
+    
+    try:
+        payload = request.json
+        operations = payload.get('operations') if isinstance(payload, dict) else payload
+        if not isinstance(operations, list):
+            return jsonify({'success': False, 'error': 'Expected a list of operations'}), 400
+        
+        with table_locks.write(table_name):
+            entry = table_cache.get(table_name)
+            if entry is None:
+                entry = TableEntry([], [], None, table_cache.index_columns.get(table_name))
+            
+            try:
+                results, log_entries = apply_batch(table_name, entry, operations)
+                if log_entries:
+                    save_entry(table_name, entry, log_entries)
+            except Exception:
+                # The cached entry may hold changes that never reached disk
+                table_cache.invalidate(table_name)
+                raise
+        
+        failed = sum(1 for result in results if result['status'] == 'error')
+        return jsonify({
+            'success': not failed,
+            'applied': len(results) - failed,
+            'failed': failed,
+            'writes': 1 if log_entries else 0,
+            'results': results,
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/tables/<table_name>/changes', methods=['GET'])
+def get_changes(table_name):
+    """Rows inserted, updated or deleted since a table version
+
+    ?since= is the version the client last synced to (0 or omitted for
+    none) and ?limit= caps the number of keys returned, up to MAX_PAGE_SIZE;
+    with has_more set, ask again from the returned version for the rest.
+    Deletes come back as tombstones. When the changes after since are no
+    longer all known, reset is set and data holds the whole table instead.
+    """
+    if table_name not in TABLE_PATHS:
+        return jsonify({'success': False, 'error': f"Unknown table '{table_name}'"}), 404
+    
+    try:
+        since = request.args.get('since', default=0, type=int)
+        limit = request.args.get('limit', default=MAX_PAGE_SIZE, type=int)
+        if since < 0:
+            return jsonify({'success': False, 'error': 'since must not be negative'}), 400
+        if limit < 1:
+            return jsonify({'success': False, 'error': 'limit must be positive'}), 400
+        limit = min(limit, MAX_PAGE_SIZE)
+        
+        feed = change_feeds[table_name]
+        with table_locks.read(table_name):
+            entry = table_cache.get(table_name)
+            current = entry is None or feed.is_current(entry.state)
+        if not current:
+            with table_locks.write(table_name):
+                record_changes(table_name)
+        
+        with table_locks.read(table_name):
+            changes, next_since = feed.changes_since(since, limit)
+            if changes is None:
+                version, rows = feed.snapshot()
+            else:
+                version = feed.version if next_since is None else next_since
+        
+        result = {
+            'success': True,
+            'table': table_name,
+            'key': primary_key_for(table_name),
+            'since': since,
+            'version': version,
+            'reset': changes is None,
+            'has_more': next_since is not None,
+        }
+        result['data'] = rows if changes is None else changes
+        return jsonify(result)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def import_table(table_name, records, mode='merge'):
+    """Import one table's records from a localStorage snapshot
+
+    "merge" diffs them against the table (see table_import.merge_records)
+    and writes only if something changed; "replace" overwrites the table.
+    """
+    if mode == 'replace':
+        success = write_csv(table_name, records)
+        return {'status': 'success' if success else 'failed', 'rows': len(records)}
+    
+    with table_locks.write(table_name):
+        entry = table_cache.get(table_name)
+        if entry is None:
+            entry = TableEntry([], [], None, table_cache.index_columns.get(table_name))
+        
+        try:
+            counts, conflicts, log_entries = merge_records(entry, primary_key_for(table_name), records)
+            if log_entries:
+                save_entry(table_name, entry, log_entries)
+        except Exception:
+            # The cached entry may hold changes that never reached disk
+            table_cache.invalidate(table_name)
+            raise
+    
+    return {'status': 'success', **counts, 'conflicting_keys': conflicts,
+            'writes': 1 if log_entries else 0}
+
+
 @app.route('/api/import-from-localstorage', methods=['POST'])
 def import_from_localstorage():
-    """Import data from localStorage (sent from frontend)"""
+    """Import data from localStorage (sent from frontend)
+
+    Body: {"csv_<table>": [records], ...}, parsed while it is read. Records
+    are merged into each table by primary key with updated_at deciding
+    conflicts; ?mode=replace overwrites the tables instead. Tables are
+    imported in parallel, each as soon as its records have arrived.
+    
+    A body that turns out malformed part way gets a 400, whose results
+    still list the tables imported before the error.
+    """
+    mode = request.args.get('mode', 'merge')
+    if mode not in ('merge', 'replace'):
+        return jsonify({'success': False, 'error': "mode must be 'merge' or 'replace'"}), 400
+    
     try:
-        data = request.json
+        futures = {}
+        format_error = None
+        with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as executor:
+            try:
+                for table_name, records in stream_tables(request.stream):
+                    # Remove 'csv_' prefix if present
+                    table_name = table_name.replace('csv_', '')
+                    
+                    if table_name in TABLE_PATHS and isinstance(records, list) and records:
+                        futures[table_name] = executor.submit(import_table, table_name, records, mode)
+            except ImportFormatError as e:
+                # Tables already submitted are imported all the same
+                format_error = str(e)
+        
         results = {}
+        for table_name, future in futures.items():
+            try:
+                results[table_name] = future.result()
+            except Exception as e:
+                results[table_name] = {'status': 'failed', 'error': str(e)}
         
-        for table_name, records in data.items():
-            # Remove 'csv_' prefix if present
-            table_name = table_name.replace('csv_', '')
-            
-            if table_name in TABLE_PATHS and records:
-                # Write all records to CSV
-                success = write_csv(table_name, records)
-                results[table_name] = 'success' if success else 'failed'
+        if format_error:
+            return jsonify({'success': False, 'error': format_error, 'mode': mode, 'results': results}), 400
+        return jsonify({'success': True, 'mode': mode, 'results': results})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+def refresh_drug_search():
+    """Bring drug_search up to date with drugs_master; False if there is no table"""
+    with table_locks.read('drugs_master'):
+        entry = table_cache.get('drugs_master')
+        if entry is not None:
+            drug_search.refresh(entry)
+    return entry is not None
+
+
+def user_rows(table_name, column, user_id):
+    """(rows, file state) of a table whose column equals user_id, by index lookup"""
+    with table_locks.read(table_name):
+        entry = table_cache.get(table_name)
+        if entry is None:
+            return [], None
+        return [entry.rows[i] for i in entry.positions(column, user_id)], entry.state
+
+
+def active_prescriptions(rows, today):
+    """Prescriptions that have not ended, with their drug_id and drugs_master row"""
+    prescriptions = []
+    for row in rows:
+        end_date = (row.get('end_date') or '').strip()
+        if end_date and end_date < today:
+            continue
+        drug_id = drug_search.resolve(row.get('medicine_name'))
+        prescriptions.append({
+            **row,
+            'drug_id': drug_id,
+            'drug_details': drug_search.row(drug_id) if drug_id else None,
+        })
+    return prescriptions
+
+
+def current_medications(user_id):
+    """A user's prescriptions that have not ended, with their drug_id
+
+    Prescriptions name the medicine as typed, so it is matched against
+    drug, generic and brand names; drug_id is None when nothing matches.
+    """
+    rows, _ = user_rows('prescription', 'user_id', user_id)
+    today = datetime.now().strftime('%Y-%m-%d')
+    return [
+        {'medicine_name': prescription.get('medicine_name'), 'drug_id': prescription['drug_id']}
+        for prescription in active_prescriptions(rows, today)
+    ]
+
+
+@app.route('/api/drugs/search', methods=['GET'])
+def search_drugs():
+    """Ranked drug search by name, generic name, brand name and class
+
+    Query string: q (the search text) and limit (default 20, at most
+    MAX_SEARCH_RESULTS). Matches are exact, prefix or typo-tolerant.
+    """
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), MAX_SEARCH_RESULTS)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid limit'}), 400
+    
+    try:
+        started = time.perf_counter()
+        matches = drug_search.search(query, limit) if refresh_drug_search() else []
+        data = [drug_search.row(key) for _, key, _ in matches]
+        return jsonify({
+            'success': True,
+            'data': data,
+            'matches': [{'drug_id': key, 'score': score, 'term': term} for score, key, term in matches],
+            'took_ms': round((time.perf_counter() - started) * 1000, 3),
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/users/<user_id>/interactions', methods=['GET'])
+def check_user_interactions(user_id):
+    """Drug interactions among a user's current medications
+
+    Repeat ?candidate=<drug_id or name> to also check drugs that are not
+    prescribed yet against the current ones and each other. Only pairs
+    with a recorded interaction are returned, most severe first.
+    """
+    try:
+        refresh_drug_search()
+        with table_locks.read('drug_interactions'):
+            interaction_index.refresh(table_cache.get('drug_interactions'))
         
-        return jsonify({'success': True, 'results': results})
+        medications = current_medications(user_id)
+        candidate_ids, unresolved = [], []
+        for candidate in request.args.getlist('candidate'):
+            drug_id = candidate if drug_search.row(candidate) else drug_search.resolve(candidate)
+            if drug_id:
+                candidate_ids.append(drug_id)
+            else:
+                unresolved.append(candidate)
+        unresolved += [m['medicine_name'] for m in medications if not m['drug_id']]
+        
+        hits, pairs_checked = interaction_index.check(
+            [m['drug_id'] for m in medications if m['drug_id']], candidate_ids)
+        
+        def drug_name(drug_id):
+            return (drug_search.row(drug_id) or {}).get('drug_name', 'Unknown')
+        
+        data = [
+            {
+                **row,
+                'drug1_id': drug1_id,
+                'drug1_name': drug_name(drug1_id),
+                'drug2_id': drug2_id,
+                'drug2_name': drug_name(drug2_id),
+                'involves_candidate': involves_candidate,
+            }
+            for drug1_id, drug2_id, row, involves_candidate in hits
+        ]
+        return jsonify({
+            'success': True,
+            'data': data,
+            'medications': medications,
+            'candidates': candidate_ids,
+            'unresolved': unresolved,
+            'pairs_checked': pairs_checked,
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/users/<user_id>/dashboard', methods=['GET'])
+def user_dashboard(user_id):
+    """A user's profile, active prescriptions, progress, lifestyle and adherence in one response
+
+    The tables are USER_TABLE and those its relationships list, each read
+    with one index lookup on its foreign key: a one_to_one relation gives
+    a row (or null) and a one_to_many relation a list. Prescriptions carry
+    the drugs_master row of their medicine as drug_details.
+    """
+    try:
+        relationships = TABLE_SCHEMAS.get(USER_TABLE, {}).get('relationships', {})
+        tables = [(USER_TABLE, primary_key_for(USER_TABLE), 'one_to_one')] + [
+            (table_name, relation.get('foreign_key', 'user_id'), relation.get('type'))
+            for table_name, relation in relationships.items()
+            if table_name in TABLE_PATHS
+        ]
+        
+        refresh_drug_search()
+        today = datetime.now().strftime('%Y-%m-%d')
+        data, states = {}, []
+        for table_name, column, relation_type in tables:
+            rows, state = user_rows(table_name, column, user_id)
+            states.append(state)
+            hidden = HIDDEN_COLUMNS.get(table_name, ())
+            rows = [{k: v for k, v in row.items() if k not in hidden} for row in rows]
+            if table_name == 'prescription':
+                rows = active_prescriptions(rows, today)
+            data[table_name] = rows if relation_type == 'one_to_many' else (rows[0] if rows else None)
+        
+        if not any(data.values()):
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+        
+        etag = make_etag('dashboard', states, user_id, today, table_cache.file_state('drugs_master'))
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return not_modified(etag)
+        return with_etag(jsonify({'success': True, 'data': data}), etag)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+def load_prescriptions(last_state):
+    """Prescription rows for the reminder scheduler, or None if unchanged"""
+    with table_locks.read('prescription'):
+        entry = table_cache.get('prescription')
+        if entry is None:
+            return None, []
+        if entry.state == last_state:
+            return last_state, None
+        return entry.state, list(entry.rows)
+
+
+def start_reminder_scheduler():
+    """Start the reminder scheduler when the first client subscribes"""
+    global reminder_scheduler
+    if reminder_scheduler is not None:
+        return reminder_scheduler
+    with reminder_scheduler_lock:
+        if reminder_scheduler is None:
+            scheduler = ReminderScheduler(
+                load_prescriptions,
+                check_interval=REMINDER_SETTINGS.get('check_interval_seconds', 5),
+                history_size=REMINDER_SETTINGS.get('history_size', 50),
+            )
+            scheduler.refresh()
+            scheduler.start()
+            reminder_scheduler = scheduler
+    return reminder_scheduler
+
+
+@app.route('/api/users/<user_id>/reminders', methods=['GET'])
+def poll_reminders(user_id):
+    """Long-poll for dose reminders
+
+    Returns reminders with an id above ?after= (default 0, i.e. the recent
+    history), waiting up to ?timeout= seconds for one to be delivered.
+    """
+    try:
+        after_id = int(request.args.get('after', 0))
+        timeout = float(request.args.get('timeout', REMINDER_SETTINGS.get('long_poll_max_seconds', 30)))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid after or timeout'}), 400
+    timeout = min(max(timeout, 0), REMINDER_SETTINGS.get('long_poll_max_seconds', 30))
+    
+    scheduler = start_reminder_scheduler()
+    reminders = scheduler.wait(user_id, after_id, timeout)
+    last_id = reminders[-1]['id'] if reminders else after_id
+    return jsonify({'success': True, 'data': reminders, 'last_id': last_id})
+
+
+@app.route('/api/users/<user_id>/reminders/stream', methods=['GET'])
+def stream_reminders(user_id):
+    """Push dose reminders as Server-Sent Events
+
+    Only reminders delivered after the client connects are sent, unless it
+    reconnects with a Last-Event-ID. A comment line is sent every
+    keepalive_seconds so proxies keep the connection open.
+    """
+    scheduler = start_reminder_scheduler()
+    keepalive = REMINDER_SETTINGS.get('keepalive_seconds', 15)
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    after_id = int(last_event_id) if last_event_id.isdigit() else scheduler.last_id(user_id)
+    
+    def generate(after_id):
+        yield 'retry: 5000\n\n'
+        while True:
+            reminders = scheduler.wait(user_id, after_id, keepalive)
+            if not reminders:
+                yield ': keepalive\n\n'
+            for reminder in reminders:
+                after_id = reminder['id']
+                yield f"id: {after_id}\nevent: reminder\ndata: {json.dumps(reminder)}\n\n"
+    
+    return Response(
+        stream_with_context(generate(after_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Table cache hit/miss counters"""
+    stats = table_cache.stats()
+    stats['responses'] = response_cache.stats()
+    stats['drug_search'] = drug_search.stats()
+    stats['drug_interactions'] = interaction_index.stats()
+    stats['changes'] = {name: feed.stats() for name, feed in change_feeds.items()}
+    if reminder_scheduler is not None:
+        stats['reminders'] = reminder_scheduler.stats()
+    return jsonify({'success': True, 'data': stats})
+
+
+@metrics.collector
+def collect_metrics(prefix):
+    """Metric families of the storage engine, locks and caches"""
+    lines = []
+    
+    def add(name, kind, help, samples, labelnames=('table',)):
+        lines.extend(family(prefix + name, kind, help, samples, labelnames))
+    
+    lines.extend(family(prefix + 'storage_engine_info', 'gauge', 'Storage engine in use',
+                        [((storage.name,), 1)], ('engine',)))
+    io_stats = sorted(storage.stats().items())
+    add('storage_loads_total', 'counter', 'Tables loaded (read and parsed) from storage',
+        [((name,), c['loads']) for name, c in io_stats])
+    add('storage_load_seconds_total', 'counter', 'Time spent loading tables, parsing included',
+        [((name,), c['load_seconds']) for name, c in io_stats])
+    add('storage_streams_total', 'counter', 'Tables streamed from storage without loading',
+        [((name,), c['streams']) for name, c in io_stats])
+    add('storage_rows_read_total', 'counter', 'Rows read from storage',
+        [((name,), c['rows_read']) for name, c in io_stats])
+    add('storage_bytes_read_total', 'counter', 'Bytes of table files read (CSV engine)',
+        [((name,), c['bytes_read']) for name, c in io_stats])
+    add('storage_writes_total', 'counter', 'Writes by kind: append, log, transaction or rewrite',
+        [((name, kind), count) for name, c in io_stats for kind, count in sorted(c['writes'].items())],
+        ('table', 'kind'))
+    add('storage_write_seconds_total', 'counter', 'Time spent writing tables',
+        [((name,), c['write_seconds']) for name, c in io_stats])
+    add('storage_rows_written_total', 'counter', 'Rows written (all of them for a rewrite)',
+        [((name,), c['rows_written']) for name, c in io_stats])
+    add('storage_bytes_written_total', 'counter', 'Bytes of table files and logs written (CSV engine)',
+        [((name,), c['bytes_written']) for name, c in io_stats])
+    
+    waits = sorted(table_locks.stats().items())
+    add('lock_acquisitions_total', 'counter', 'Table lock acquisitions',
+        [((name, mode), w['acquisitions']) for name, modes in waits for mode, w in modes.items()],
+        ('table', 'mode'))
+    add('lock_wait_seconds_total', 'counter', 'Time spent waiting for table locks',
+        [((name, mode), w['wait_seconds']) for name, modes in waits for mode, w in modes.items()],
+        ('table', 'mode'))
+    
+    cache = table_cache.stats()
+    responses = response_cache.stats()
+    add('table_cache_lookups_total', 'counter', 'Table cache lookups by result',
+        [(('hit',), cache['hits']), (('miss',), cache['misses'])], ('result',))
+    tables = sorted(cache['tables'].items())
+    add('table_cache_reloads_total', 'counter', 'Tables reloaded into the cache',
+        [((name,), t['reloads']) for name, t in tables])
+    add('table_cache_rows', 'gauge', 'Rows of each cached table',
+        [((name,), t['rows']) for name, t in tables])
+    add('table_log_entries', 'gauge', 'Write-ahead log entries not yet compacted',
+        [((name,), t['log_entries']) for name, t in tables])
+    add('response_cache_lookups_total', 'counter', 'Response cache lookups by result',
+        [(('hit',), responses['hits']), (('miss',), responses['misses'])], ('result',))
+    add('response_cache_bytes', 'gauge', 'Bytes of cached response bodies',
+        [((), responses['bytes'])], ())
+    add('change_feed_version', 'gauge', 'Latest change version of each table',
+        [((name,), feed.stats()['version']) for name, feed in sorted(change_feeds.items())])
+    
+    profiles = profiler.stats()
+    add('profiled_requests_total', 'counter', 'Requests profiled', [((), profiles['profiled'])], ())
+    add('saved_profiles_total', 'counter', 'Profiles of slow requests saved', [((), profiles['saved'])], ())
+    return lines
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request, storage, lock and cache metrics in the Prometheus text format"""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
 
+# Crash recovery: replay logs an interrupted run left behind
+recover_table_logs()
+
+
 if __name__ == '__main__':
     # Ensure directories exist
     CORE_TABLES_DIR.mkdir(parents=True, exist_ok=True)
     MASTER_DATA_DIR.mkdir(parents=True, exist_ok=True)
     
+    # Build the drug search index before the first search needs it
+    drugs = table_cache.get('drugs_master')
+    if drugs is not None:
+        drug_search.refresh(drugs)
+    
     print("=" * 60)
     print("🚀 Prescription Management System - Backend API")
     print("=" * 60)
     print(f"📁 Database Directory: {DATABASE_DIR}")
     print(f"📊 Core Tables: {CORE_TABLES_DIR}")
     print(f"📚 Master Data: {MASTER_DATA_DIR}")
+    if STORAGE_ENGINE == 'sqlite':
+        print(f"💾 Storage: SQLite database {SQLITE_PATH}")
+    else:
+        print(f"💾 Storage Mode: {'wal' if USE_WRITE_AHEAD_LOG else 'direct'}")
     print("=" * 60)
     print("🌐 API Endpoints:")
-    print("   GET    /api/tables/<table_name>")
+    print("   GET    /api/tables/<table_name>[?limit=&cursor=&fields=]")
     print("   POST   /api/tables/<table_name>/find")
     print("   POST   /api/tables/<table_name>")
     print("   PUT    /api/tables/<table_name>/<user_id>")
     print("   DELETE /api/tables/<table_name>/<user_id>")
-    print("   POST   /api/import-from-localstorage")
+    print("   POST   /api/tables/<table_name>/batch")
+    print("   GET    /api/tables/<table_name>/changes?since=<version>")
+    print("   POST   /api/import-from-localstorage[?mode=merge|replace]")
+    print("   GET    /api/drugs/search?q=<text>")
+    print("   GET    /api/users/<user_id>/dashboard")
+    print("   GET    /api/users/<user_id>/interactions")
+    print("   GET    /api/users/<user_id>/reminders[/stream]")
+    print("   GET    /api/cache/stats")
+    print("   GET    /api/metrics")
     print("   GET    /api/health")
     print("=" * 60)
     print("🔥 Starting server on http://localhost:5000")
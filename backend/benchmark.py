@@ -0,0 +1,360 @@
+"""
+Load benchmark of the backend API (and the database CLIs).
+
+Drives every endpoint through Flask's test client, or through a running
+server with --url, from --concurrency threads at once, and reports each
+scenario's throughput and p50/p95/p99 latency. Results are saved as JSON
+(--output) so runs can be compared across commits (--compare):
+
+    python ../database/generate_data.py --output ../bench_db --users 100000
+    python benchmark.py --db ../bench_db --requests 500 --concurrency 8 --output after.json
+    python benchmark.py --compare before.json after.json
+
+The write scenarios change the database, so they only run against a
+database other than the repository's own (or not at all, with
+--read-only). With --cli, database/benchmark_cli.py also times the
+database CLIs' operations in a separate process. The reminders SSE
+stream never ends and is left out.
+"""
+
+import argparse
+import csv
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+
+BASE_DIR = Path(__file__).parent.parent
+DEFAULT_DATABASE_DIR = BASE_DIR / 'database'
+PERCENTILES = (50, 95, 99)
+
+
+class Request:
+    """One API request of a scenario"""
+
+    def __init__(self, method, path, body=None, headers=None):
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = headers or {}
+
+
+class Scenario:
+    """An endpoint exercised with make(context, i) -> Request for request i"""
+
+    def __init__(self, name, make, writes=False):
+        self.name = name
+        self.make = make
+        self.writes = writes
+
+
+class Context:
+    """Ids sampled from the database the requests are about"""
+
+    def __init__(self, db_path, seed):
+        self.rng = random.Random(seed)
+        self.user_ids = _column(db_path / 'core_tables' / 'authentication.csv', 'user_id')
+        self.drug_names = _column(db_path / 'master_data' / 'drugs_master.csv', 'drug_name')
+        # Keys of rows the add scenario inserts and the delete scenario removes
+        self.run_id = f"bench-{seed}-{int(time.time())}"
+
+    def user(self, i):
+        return self.user_ids[(i * 7919) % len(self.user_ids)] if self.user_ids else 'demo'
+
+    def drug_prefix(self, i):
+        name = self.drug_names[i % len(self.drug_names)] if self.drug_names else 'para'
+        return name[:4]
+
+
+def _column(file_path, column):
+    """Values of a column of a CSV table, [] if there is no table"""
+    if not file_path.exists():
+        return []
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        return [row.get(column) for row in csv.DictReader(f)]
+
+
+NDJSON = {'Accept': 'application/x-ndjson'}
+
+SCENARIOS = [
+    Scenario('health', lambda c, i: Request('GET', '/api/health')),
+    Scenario('table_page', lambda c, i: Request('GET', '/api/tables/info?limit=100')),
+    Scenario('table_full', lambda c, i: Request('GET', '/api/tables/progress')),
+    Scenario('table_stream', lambda c, i: Request('GET', '/api/tables/info', headers=NDJSON)),
+    Scenario('find', lambda c, i: Request('POST', '/api/tables/prescription/find',
+                                          {'where': {'user_id': c.user(i)}})),
+    Scenario('find_range', lambda c, i: Request(
+        'POST', '/api/tables/prescription/find',
+        {'where': {'start_date': {'gte': '2024-06-01'}}, 'order_by': 'start_date', 'limit': 20})),
+    Scenario('changes', lambda c, i: Request('GET', '/api/tables/progress/changes?since=0&limit=100')),
+    Scenario('drug_search', lambda c, i: Request('GET', f"/api/drugs/search?q={c.drug_prefix(i)}")),
+    Scenario('dashboard', lambda c, i: Request('GET', f"/api/users/{c.user(i)}/dashboard")),
+    Scenario('interactions', lambda c, i: Request('GET', f"/api/users/{c.user(i)}/interactions")),
+    Scenario('reminders_poll', lambda c, i: Request('GET', f"/api/users/{c.user(i)}/reminders?timeout=0")),
+    Scenario('cache_stats', lambda c, i: Request('GET', '/api/cache/stats')),
+    Scenario('add', lambda c, i: Request('POST', '/api/tables/prescription', {
+        'user_id': f"{c.run_id}-{i}", 'medicine_name': 'Metformin', 'frequency': 'Once daily',
+        'start_date': '2025-01-01', 'dose': '500mg', 'doctor_name': 'Dr Bench'}), writes=True),
+    Scenario('update', lambda c, i: Request('PUT', f"/api/tables/progress/{c.user(i)}",
+                                            {'completed_dose': str(i)}), writes=True),
+    Scenario('batch', lambda c, i: Request('POST', '/api/tables/progress/batch', [
+        {'op': 'upsert', 'key': c.user(i * 10 + j), 'record': {'upcoming_dose': str(j)}}
+        for j in range(10)]), writes=True),
+    Scenario('import', lambda c, i: Request('POST', '/api/import-from-localstorage', {
+        'csv_progress': [{'user_id': c.user(i), 'pending_dose': str(i),
+                          'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]}),
+             writes=True),
+    Scenario('delete', lambda c, i: Request('DELETE', f"/api/tables/prescription/{c.run_id}-{i}"),
+             writes=True),
+]
+
+
+class TestClientTransport:
+    """Requests through Flask's test client, one client per thread"""
+
+    name = 'test_client'
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._local = threading.local()
+
+    def __call__(self, request):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(request.path, method=request.method, json=request.body,
+                               headers=request.headers)
+        response.get_data()  # streamed bodies are produced while read
+        response.close()
+        return response.status_code
+
+
+class HttpTransport:
+    """Requests to a running server, one connection per thread"""
+
+    name = 'http'
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._local = threading.local()
+
+    def __call__(self, request):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=60)
+        body, headers = None, dict(request.headers)
+        if request.body is not None:
+            body = json.dumps(request.body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            connection.request(request.method, request.path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            raise
+        return response.status
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies, seconds, errors=0, concurrency=1):
+    """Throughput and latency statistics (ms) of one scenario's requests"""
+    ordered = sorted(latencies)
+    milliseconds = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(len(latencies) / seconds, 1) if seconds else None,
+        'latency_ms': {
+            'mean': milliseconds(sum(ordered) / len(ordered)) if ordered else None,
+            'min': milliseconds(ordered[0]) if ordered else None,
+            **{f"p{p}": milliseconds(percentile(ordered, p)) for p in PERCENTILES},
+            'max': milliseconds(ordered[-1]) if ordered else None,
+        },
+    }
+
+
+def run_scenario(transport, scenario, context, requests, concurrency, warmup):
+    """Send warmup then requests requests from concurrency threads; returns summarize()"""
+    for i in range(warmup):
+        transport(scenario.make(context, requests + i))
+
+    latencies = [None] * requests
+    failures = []
+
+    def send(i):
+        request = scenario.make(context, i)
+        started = time.perf_counter()
+        try:
+            status = transport(request)
+        except Exception as e:
+            status = repr(e)
+        latencies[i] = time.perf_counter() - started
+        if not isinstance(status, int) or status >= 400:
+            failures.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(requests)))
+    stats = summarize(latencies, time.perf_counter() - started, len(failures), concurrency)
+    if failures:
+        stats['failures'] = sorted({str(status) for status in failures})
+    return stats
+
+
+def run_cli(db_path, table_name, repeat):
+    """Timings of database/benchmark_cli.py, summarized per operation"""
+    database_dir = BASE_DIR / 'database'
+    # Its own process: the CLIs import database/ modules whose names backend/ shares
+    output = subprocess.run(
+        [sys.executable, 'benchmark_cli.py', '--db-path', str(db_path), '--table', table_name,
+         '--repeat', str(repeat)],
+        cwd=database_dir, capture_output=True, text=True, check=True).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    return {name: summarize(values, sum(values)) for name, values in timings.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def table_sizes(db_path):
+    """Size in bytes of each CSV table of a database directory"""
+    return {path.stem: path.stat().st_size for path in sorted(db_path.glob('*/*.csv'))}
+
+
+def compare(old, new):
+    """Lines comparing the scenarios two result files have in common"""
+    lines = [f"{'scenario':<32}{'p50 ms':>26}{'p95 ms':>26}{'req/s':>26}"]
+    for group in ('scenarios', 'cli'):
+        for name, stats in new.get(group, {}).items():
+            before = old.get(group, {}).get(name)
+            if before is None:
+                continue
+            cells = []
+            for key in ('p50', 'p95', 'throughput_rps'):
+                a = before['latency_ms'][key] if key != 'throughput_rps' else before[key]
+                b = stats['latency_ms'][key] if key != 'throughput_rps' else stats[key]
+                change = f" ({(b - a) / a:+.0%})" if a and b is not None else ''
+                cells.append(f"{a} -> {b}{change}")
+            lines.append(f"{name:<32}" + ''.join(f"{cell:>26}" for cell in cells))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the backend API endpoints')
+    parser.add_argument('--db', default=str(DEFAULT_DATABASE_DIR),
+                        help='Database directory to serve and sample ids from')
+    parser.add_argument('--url', help='Benchmark a running server instead of the test client')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='Threads sending requests')
+    parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per scenario')
+    parser.add_argument('--scenarios', help='Comma-separated scenarios to run (default: all)')
+    parser.add_argument('--read-only', action='store_true', help='Skip the scenarios that write')
+    parser.add_argument('--cli', action='store_true', help='Also time the database CLIs')
+    parser.add_argument('--cli-table', default='prescription', help='Table the CLI timings use')
+    parser.add_argument('--cli-repeat', type=int, default=3, help='Runs of each CLI operation')
+    parser.add_argument('--seed', type=int, default=1, help='Seed picking ids for the requests')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='Compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        results = []
+        for path in args.compare:
+            with open(path, 'r', encoding='utf-8') as f:
+                results.append(json.load(f))
+        print('\n'.join(compare(*results)))
+        return
+
+    db_path = Path(args.db).resolve()
+    scenarios = SCENARIOS
+    if args.scenarios:
+        wanted = [name.strip() for name in args.scenarios.split(',')]
+        unknown = set(wanted) - {scenario.name for scenario in SCENARIOS}
+        if unknown:
+            parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        scenarios = [scenario for scenario in SCENARIOS if scenario.name in wanted]
+    if args.read_only:
+        scenarios = [scenario for scenario in scenarios if not scenario.writes]
+    elif any(scenario.writes for scenario in scenarios) \
+            and db_path == DEFAULT_DATABASE_DIR.resolve() and not args.url:
+        parser.error('write scenarios change the database: point --db at a generated '
+                     'one (database/generate_data.py) or pass --read-only')
+
+    if args.url:
+        transport = HttpTransport(args.url)
+    else:
+        # The backend reads its database directory when imported
+        os.environ['PRESCRIPCARE_DATABASE_DIR'] = str(db_path)
+        import app
+        transport = TestClientTransport(app.app)
+
+    context = Context(db_path, args.seed)
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'transport': transport.name,
+            'url': args.url,
+            'db': str(db_path),
+            'table_bytes': table_sizes(db_path),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'warmup': args.warmup,
+            'seed': args.seed,
+        },
+        'scenarios': {},
+    }
+
+    print(f"{'scenario':<20}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for scenario in scenarios:
+        stats = run_scenario(transport, scenario, context, args.requests, args.concurrency,
+                             args.warmup)
+        results['scenarios'][scenario.name] = stats
+        latency = stats['latency_ms']
+        print(f"{scenario.name:<20}{stats['throughput_rps']:>10}{latency['p50']:>10}"
+              f"{latency['p95']:>10}{latency['p99']:>10}{stats['errors']:>8}")
+
+    if args.cli:
+        results['cli'] = run_cli(db_path, args.cli_table, args.cli_repeat)
+        for name, stats in results['cli'].items():
+            print(f"{name:<32} p50 {stats['latency_ms']['p50']} ms  max {stats['latency_ms']['max']} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Drug-drug interaction lookups for /api/users/<user_id>/interactions.
+
+InteractionIndex maps each unordered pair of drug ids to the
+drug_interactions rows recorded for it, so checking a pair is one dict
+lookup instead of a scan of the table. The map is rebuilt from the cached
+table whenever the table's files change.
+"""
+
+import threading
+from itertools import combinations
+
+# Most serious first; unknown levels sort after these
+SEVERITY_ORDER = ('contraindicated', 'major', 'moderate', 'minor')
+
+
+def pair_key(drug1_id, drug2_id):
+    """The same key for (a, b) and (b, a)"""
+    return (drug1_id, drug2_id) if drug1_id <= drug2_id else (drug2_id, drug1_id)
+
+
+def severity_rank(severity):
+    severity = (severity or '').strip().lower()
+    return SEVERITY_ORDER.index(severity) if severity in SEVERITY_ORDER else len(SEVERITY_ORDER)
+
+
+class InteractionIndex:
+    """Interaction rows keyed by unordered drug-id pair"""
+
+    def __init__(self, drug1_column='drug1_id', drug2_column='drug2_id'):
+        self.drug1_column = drug1_column
+        self.drug2_column = drug2_column
+        self._lock = threading.Lock()
+        self._pairs = {}
+        self._state = None
+        self.rebuilds = 0
+
+    def __len__(self):
+        return len(self._pairs)
+
+    def refresh(self, entry):
+        """Rebuild the pair map if the drug_interactions entry has changed
+
+        entry may be None when the table has no file, which empties the map.
+        """
+        state = entry.state if entry is not None else None
+        with self._lock:
+            if state is not None and state == self._state:
+                return False
+
+            pairs = {}
+            for row in entry.rows if entry is not None else ():
+                drug1_id = row.get(self.drug1_column)
+                drug2_id = row.get(self.drug2_column)
+                if drug1_id and drug2_id and drug1_id != drug2_id:
+                    pairs.setdefault(pair_key(drug1_id, drug2_id), []).append(row)
+
+            self._pairs = pairs
+            self._state = state
+            self.rebuilds += 1
+            return True
+
+    def lookup(self, drug1_id, drug2_id):
+        """Interaction rows recorded for a pair of drugs, in either order"""
+        return list(self._pairs.get(pair_key(drug1_id, drug2_id), ()))
+
+    def check(self, drug_ids, candidate_ids=()):
+        """Interactions among drug_ids, and between them and candidate_ids
+
+        Candidates are drugs not taken yet (a prescription being written),
+        so pairs are checked candidate-to-current and candidate-to-candidate.
+        Returns (hits, pairs_checked); each hit is (drug1_id, drug2_id, row,
+        involves_candidate), most severe first.
+        """
+        current = list(dict.fromkeys(drug_ids))
+        candidates = [drug_id for drug_id in dict.fromkeys(candidate_ids) if drug_id not in current]
+
+        pairs = [(a, b, False) for a, b in combinations(current, 2)]
+        pairs += [(a, b, True) for a in candidates for b in current]
+        pairs += [(a, b, True) for a, b in combinations(candidates, 2)]
+
+        hits = []
+        pair_map = self._pairs
+        for drug1_id, drug2_id, involves_candidate in pairs:
+            for row in pair_map.get(pair_key(drug1_id, drug2_id), ()):
+                hits.append((drug1_id, drug2_id, row, involves_candidate))
+
+        hits.sort(key=lambda hit: severity_rank(hit[2].get('severity_level')))
+        return hits, len(pairs)
+
+    def stats(self):
+        """Index size counters for /api/cache/stats"""
+        return {'pairs': len(self._pairs), 'rebuilds': self.rebuilds}
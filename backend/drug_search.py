@@ -0,0 +1,334 @@
+"""
+Search index over the drugs_master catalogue for /api/drugs/search.
+
+Each drug contributes terms from drug_name, generic_name, brand_names (a
+JSON list) and drug_class: the whole lower-cased value and each of its
+words. A query is matched against the terms in three ways, best first:
+
+- exact: the query equals a term
+- prefix: a term starts with the query (a sorted term list and bisect)
+- fuzzy: the query and a term share enough trigrams, which tolerates typos
+
+Scores are weighted by field, so a hit on the drug name ranks above the
+same hit on its class. The index is built from the cached table once and
+then refreshed by diffing rows on drug_id, so a change to drugs_master.csv
+only re-indexes the drugs that changed.
+"""
+
+import bisect
+import heapq
+import json
+import re
+import threading
+
+SEARCH_FIELDS = {
+    'drug_name': 1.0,
+    'generic_name': 0.9,
+    'brand_names': 0.85,
+    'drug_class': 0.5,
+}
+
+# Fields holding a name a drug can be prescribed under
+NAME_FIELDS = ('drug_name', 'generic_name', 'brand_names')
+
+# Share of a term's score kept when only one of its words matched
+WORD_MATCH = 0.9
+MIN_SIMILARITY = 0.3
+
+_NON_WORD = re.compile(r'[^\w]+')
+_TERM_END = '\U0010ffff'
+
+
+def normalize(text):
+    """Lower-case text with punctuation collapsed to single spaces"""
+    return _NON_WORD.sub(' ', str(text).casefold()).strip()
+
+
+def trigrams(term):
+    """Trigrams of a term padded like pg_trgm, so short terms still have some"""
+    padded = f'  {term} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def field_values(field, value):
+    """Searchable strings in a cell; brand_names holds a JSON list"""
+    if not value:
+        return []
+    if field == 'brand_names':
+        try:
+            names = json.loads(value)
+        except ValueError:
+            names = value.split(',')
+        if isinstance(names, list):
+            return [str(name) for name in names if name]
+    return [value]
+
+
+def drug_terms(row):
+    """{term: weight} for one drug row"""
+    terms = {}
+    for field, weight in SEARCH_FIELDS.items():
+        for value in field_values(field, row.get(field)):
+            phrase = normalize(value)
+            if not phrase:
+                continue
+            terms[phrase] = max(terms.get(phrase, 0), weight)
+            for word in phrase.split():
+                if word != phrase:
+                    terms[word] = max(terms.get(word, 0), weight * WORD_MATCH)
+    return terms
+
+
+def _discard_sorted(items, item):
+    """Remove item from a sorted list if it is there"""
+    i = bisect.bisect_left(items, item)
+    if i < len(items) and items[i] == item:
+        del items[i]
+
+
+def drug_names(row):
+    """{normalized name: field weight} for one drug row"""
+    names = {}
+    for field in NAME_FIELDS:
+        for value in field_values(field, row.get(field)):
+            name = normalize(value)
+            if name:
+                names[name] = max(names.get(name, 0), SEARCH_FIELDS[field])
+    return names
+
+
+class DrugSearchIndex:
+    """Prefix and trigram index over the searchable drug fields"""
+
+    def __init__(self, key_column='drug_id'):
+        self.key_column = key_column
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._doc_terms = {}
+        # normalized drug, generic or brand name -> {drug_id: field weight}
+        self._names = {}
+        self._term_docs = {}
+        # term -> {field weight: number of drugs}, for the term's best weight
+        self._term_weights = {}
+        self._sorted_terms = []
+        # first character -> [(len(term), term)], for one-letter queries
+        self._initials = {}
+        self._trigrams = {}
+        self._term_trigrams = {}
+        self._state = None
+        self.refreshes = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def refresh(self, entry):
+        """Bring the index in line with a TableEntry of drugs_master
+
+        Only drugs whose row was added, changed or removed since the last
+        refresh are re-indexed. Returns the number of drugs touched.
+        """
+        with self._lock:
+            if entry.state is not None and entry.state == self._state:
+                return 0
+
+            rows = {}
+            for row in entry.rows:
+                key = row.get(self.key_column)
+                if key:
+                    rows[key] = row
+
+            touched = 0
+            added, removed = set(), set()
+            for key in list(self._rows):
+                if key not in rows:
+                    removed.update(self._remove(key))
+                    touched += 1
+            for key, row in rows.items():
+                old_row = self._rows.get(key)
+                if old_row is row or old_row == row:
+                    continue
+                if old_row is not None:
+                    removed.update(self._remove(key))
+                added.update(self._add(key, row))
+                touched += 1
+
+            self._update_sorted_terms(added - removed, removed - added)
+            self._rows = rows
+            self._state = entry.state
+            self.refreshes += 1
+            return touched
+
+    def search(self, query, limit=20):
+        """Best matching drugs as [(score, drug_id, matched_term)], best first"""
+        query = normalize(query)
+        if not query:
+            return []
+
+        with self._lock:
+            scores = {}
+            if len(query) == 1:
+                completions = (term for _, term in self._initials.get(query, ()))
+            else:
+                start = bisect.bisect_left(self._sorted_terms, query)
+                stop = bisect.bisect_right(self._sorted_terms, query + _TERM_END)
+                completions = sorted(self._sorted_terms[start:stop], key=len)
+            # Shorter completions rank first: "metf" -> "metformin"
+            self._score_terms(
+                ((1.0 if len(term) == len(query) else 0.7 + 0.2 * len(query) / len(term), term)
+                 for term in completions),
+                scores, limit,
+            )
+
+            if len(scores) < limit:
+                similar = sorted(self._similar_terms(query), key=lambda item: -item[1])
+                self._score_terms(((0.6 * similarity, term) for term, similarity in similar),
+                                  scores, limit)
+
+            ranked = heapq.nsmallest(
+                limit,
+                ((value, key, term) for key, (value, term) in scores.items()),
+                key=lambda item: (-item[0], self._rows[item[1]].get('drug_name', ''), item[1]),
+            )
+            return [(round(value, 4), key, term) for value, key, term in ranked]
+
+    def resolve(self, name):
+        """drug_id of the drug called name (drug, generic or brand name), or None
+
+        A drug-name match wins over a generic or brand one; remaining ties
+        go to the smallest drug_id.
+        """
+        with self._lock:
+            drugs = self._names.get(normalize(name or ''))
+            if not drugs:
+                return None
+            return min(drugs.items(), key=lambda item: (-item[1], item[0]))[0]
+
+    def row(self, key):
+        """Indexed row of a drug"""
+        return self._rows.get(key)
+
+    def _score_terms(self, matched, scores, limit):
+        """Score the drugs of matched terms into scores
+
+        matched yields (term_score, term) with term_score never increasing,
+        and a drug scores term_score times its field weight (at most 1).
+        Once limit drugs score more than the current term_score, the rest
+        of the terms cannot change the top results and are not read.
+        """
+        previous = None
+        kth = 0.0
+        for term_score, term in matched:
+            if term_score != previous:
+                previous = term_score
+                if len(scores) >= limit:
+                    kth = heapq.nlargest(limit, (value for value, _ in scores.values()))[-1]
+                    if kth > term_score:
+                        return
+            if term_score * max(self._term_weights[term]) < kth:
+                continue
+            for key, weight in self._term_docs[term].items():
+                value = term_score * weight
+                best = scores.get(key)
+                if best is None or value > best[0]:
+                    scores[key] = (value, term)
+
+    def _similar_terms(self, query):
+        """Terms whose trigram similarity to query is at least MIN_SIMILARITY
+
+        Similarity is shared / all distinct trigrams, which is at most
+        shared / len(query trigrams). A match therefore shares at least
+        needed of the query's trigrams and must contain one of its
+        len - needed + 1 rarest trigrams; only those postings are read.
+        """
+        query_trigrams = trigrams(query)
+        needed = max(1, int(MIN_SIMILARITY * len(query_trigrams) + 0.999))
+        rarest = sorted(query_trigrams, key=lambda gram: len(self._trigrams.get(gram, ())))
+        candidates = set()
+        for gram in rarest[:len(query_trigrams) - needed + 1]:
+            candidates.update(self._trigrams.get(gram, ()))
+
+        similar = []
+        for term in candidates:
+            term_trigrams = self._term_trigrams[term]
+            shared = len(query_trigrams & term_trigrams)
+            similarity = shared / (len(query_trigrams) + len(term_trigrams) - shared)
+            if similarity >= MIN_SIMILARITY:
+                similar.append((term, similarity))
+        return similar
+
+    def _update_sorted_terms(self, added, removed):
+        """Apply term additions and removals to the sorted term lists"""
+        if len(added) + len(removed) > 64:
+            self._sorted_terms = sorted(self._term_docs)
+            self._initials = {}
+            for term in sorted(self._term_docs, key=lambda term: (len(term), term)):
+                self._initials.setdefault(term[0], []).append((len(term), term))
+            return
+        for term in removed:
+            _discard_sorted(self._sorted_terms, term)
+            _discard_sorted(self._initials.get(term[0], []), (len(term), term))
+        for term in added:
+            bisect.insort(self._sorted_terms, term)
+            bisect.insort(self._initials.setdefault(term[0], []), (len(term), term))
+
+    def _add(self, key, row):
+        """Index one drug; returns the terms that are new to the index"""
+        new_terms = []
+        terms = drug_terms(row)
+        self._doc_terms[key] = terms
+        for name, weight in drug_names(row).items():
+            self._names.setdefault(name, {})[key] = weight
+        for term, weight in terms.items():
+            docs = self._term_docs.get(term)
+            if docs is None:
+                docs = self._term_docs[term] = {}
+                new_terms.append(term)
+                grams = self._term_trigrams[term] = trigrams(term)
+                for gram in grams:
+                    self._trigrams.setdefault(gram, set()).add(term)
+            docs[key] = weight
+            weights = self._term_weights.setdefault(term, {})
+            weights[weight] = weights.get(weight, 0) + 1
+        return new_terms
+
+    def _remove(self, key):
+        """Drop one drug; returns the terms no longer held by any drug"""
+        dropped = []
+        for name in drug_names(self._rows[key]):
+            drugs = self._names.get(name)
+            if drugs is not None:
+                drugs.pop(key, None)
+                if not drugs:
+                    del self._names[name]
+        for term in self._doc_terms.pop(key, {}):
+            docs = self._term_docs.get(term)
+            if docs is None:
+                continue
+            weight = docs.pop(key, None)
+            weights = self._term_weights[term]
+            weights[weight] -= 1
+            if not weights[weight]:
+                del weights[weight]
+            if docs:
+                continue
+            del self._term_docs[term]
+            del self._term_weights[term]
+            dropped.append(term)
+            for gram in self._term_trigrams.pop(term, ()):
+                terms = self._trigrams.get(gram)
+                if terms is not None:
+                    terms.discard(term)
+                    if not terms:
+                        del self._trigrams[gram]
+        return dropped
+
+    def stats(self):
+        """Index size counters for /api/cache/stats"""
+        with self._lock:
+            return {
+                'drugs': len(self._rows),
+                'terms': len(self._term_docs),
+                'trigrams': len(self._trigrams),
+                'refreshes': self.refreshes,
+            }
+
@@ -0,0 +1,128 @@
+"""
+Conditional and compressed responses for table reads.
+
+A response's ETag is derived from the file state of the table it was built
+from (the same (mtime_ns, size) pairs the table cache uses) and from what
+was asked for, so every process serving the same files hands out the same
+tag and a client holding it gets 304 Not Modified until the table changes.
+A compressed body's tag carries its coding as a suffix (encoded_etag).
+
+Encoded response bodies are kept in a ResponseCache keyed by table and file
+state: repeating a read of an unchanged table costs neither serialization
+nor compression. Brotli is used when the optional brotli package is
+installed and the client accepts it, gzip otherwise.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_BYTES = 1024
+
+
+def make_etag(table_name, state, *variant):
+    """Strong ETag for a view of a table at a given file state"""
+    key = json.dumps([table_name, state, variant], default=str)
+    return '"%s"' % hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+def encoded_etag(etag, encoding):
+    """ETag of a body sent with a content coding: "<tag>-gzip", "<tag>-br"
+
+    Strong validators must differ between representations, so a compressed
+    body does not share the tag of the identity one.
+    """
+    return '%s-%s"' % (etag[:-1], encoding) if encoding else etag
+
+
+def matched_etag(if_none_match, etag):
+    """The tag of an If-None-Match header that matches etag, or None
+
+    A tag matches as etag itself or as any encoded_etag of it, and is
+    returned as the client got it, without a W/ prefix (etag for "*").
+    """
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == '*':
+        return etag
+    accepted = [etag] + [encoded_etag(etag, encoding) for encoding in ('br', 'gzip')]
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        # If-None-Match uses the weak comparison, so a W/ prefix is ignored
+        tag = tag[2:] if tag.startswith('W/') else tag
+        if tag in accepted:
+            return tag
+    return None
+
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header against an ETag (or an encoded_etag of it)"""
+    return matched_etag(if_none_match, etag) is not None
+
+
+def supported_encodings():
+    """Content codings this process can produce, best first"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(body, encoding):
+    """Encode a response body with 'br' or 'gzip'"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class ResponseCache:
+    """Encoded response bodies per table, kept while the table is unchanged
+
+    Each table holds bodies for one file state only; the first request after
+    the table changes drops the old ones. At most max_variants bodies are
+    kept per table, the least recently used going first.
+    """
+
+    def __init__(self, max_variants=32):
+        self.max_variants = max_variants
+        self._tables = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, table_name, state, key):
+        """(body, encoding) stored for key at this state, or None"""
+        with self._lock:
+            cached = self._tables.get(table_name)
+            if cached is None or cached[0] != state or key not in cached[1]:
+                self.misses += 1
+                return None
+            cached[1].move_to_end(key)
+            self.hits += 1
+            return cached[1][key]
+
+    def put(self, table_name, state, key, body, encoding):
+        with self._lock:
+            cached = self._tables.get(table_name)
+            if cached is None or cached[0] != state:
+                cached = self._tables[table_name] = (state, OrderedDict())
+            cached[1][key] = (body, encoding)
+            cached[1].move_to_end(key)
+            while len(cached[1]) > self.max_variants:
+                cached[1].popitem(last=False)
+
+    def stats(self):
+        """Hit/miss counters and cached bytes for /api/cache/stats"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bodies': sum(len(bodies) for _, bodies in self._tables.values()),
+                'bytes': sum(len(body) for _, bodies in self._tables.values()
+                             for body, _ in bodies.values()),
+            }
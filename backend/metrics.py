@@ -0,0 +1,222 @@
+"""
+Metrics for GET /api/metrics, in the Prometheus text exposition format.
+
+A Registry holds counters and histograms updated as requests are served
+(request counts and latencies per endpoint, response encoding times) and
+collectors: functions called at scrape time that turn the stats() of the
+table cache, storage engine, locks and indexes into metric families. The
+format is written here, standard library only, rather than through the
+prometheus_client package.
+
+Profiler samples requests with cProfile: one that sends the profile
+header (or is picked at the configured sample rate) is profiled, and its
+pstats output is saved when it turns out slow. Only one request is
+profiled at a time.
+"""
+
+import cProfile
+import io
+import math
+import os
+import pstats
+import random
+import re
+import threading
+from bisect import bisect_left
+from datetime import datetime
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values):
+    """{name="value",...} for a sample, '' without labels"""
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def family(name, kind, help, samples, labelnames=()):
+    """Lines of one metric family: samples are (label values, value) pairs"""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for values, value in samples:
+        if value is not None:
+            lines.append(f"{name}{_labels(labelnames, values)} {_number(value)}")
+    return lines
+
+
+class Counter:
+    """Monotonic counter per combination of label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            samples = sorted(self._values.items())
+        return family(self.name, self.kind, self.help, samples, self.labelnames)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per combination of label values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # A count per bucket plus +Inf, then the sum of observed values
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[slot] += 1
+            counts[-1] += value
+
+    def render(self):
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        names = self.labelnames + ('le',)
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                total += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (_number(bound),))} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {total}")
+        return lines
+
+
+class Registry:
+    """Named metrics plus collectors, rendered together by render()"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(self.prefix + name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self.prefix + name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, function):
+        """Register function(prefix) -> lines of metric families, called per scrape"""
+        self._collectors.append(function)
+        return function
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            lines.extend(collect(self.prefix))
+        return '\n'.join(lines) + '\n'
+
+
+class Profiler:
+    """cProfile of sampled requests, saved to output_dir when slow
+
+    A request is profiled when it carries the header (any value but "0")
+    or, at sample_rate, at random; only while enabled. Its profile is
+    written as <time>_<method>_<endpoint>.prof (load it with pstats or
+    snakeviz) and .txt, the top functions by cumulative time, if it took
+    at least slow_seconds.
+    """
+
+    def __init__(self, output_dir, enabled=False, header='X-Profile', slow_seconds=0.5,
+                 sample_rate=0.0, top=40):
+        self.output_dir = output_dir
+        self.enabled = enabled
+        self.header = header
+        self.slow_seconds = slow_seconds
+        self.sample_rate = sample_rate
+        self.top = top
+        self._busy = threading.Lock()
+        self.profiled = 0
+        self.saved = 0
+
+    def start(self, headers):
+        """A running cProfile.Profile for this request, or None"""
+        if not self.enabled:
+            return None
+        requested = headers.get(self.header, '0') != '0'
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            return None
+        # One profile at a time: from Python 3.12 only one profiler can be
+        # active in a process, and profiles stay small and comparable
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except Exception:
+            self._busy.release()
+            return None
+        return profile
+
+    def finish(self, profile, seconds, method, endpoint):
+        """Stop a profile from start(); returns the .prof path if it was saved"""
+        try:
+            profile.disable()
+        finally:
+            self._busy.release()
+        self.profiled += 1
+        if seconds < self.slow_seconds:
+            return None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', endpoint).strip('_') or 'request'
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        base = os.path.join(self.output_dir, f"{stamp}_{method}_{slug}")
+        profile.dump_stats(base + '.prof')
+        text = io.StringIO()
+        text.write(f"{method} {endpoint} took {seconds * 1000:.1f} ms\n\n")
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(self.top)
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(text.getvalue())
+        self.saved += 1
+        return base + '.prof'
+
+    def stats(self):
+        return {'enabled': self.enabled, 'profiled': self.profiled, 'saved': self.saved}
+
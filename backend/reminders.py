@@ -0,0 +1,268 @@
+"""
+Dose reminders pushed from the backend.
+
+Each current prescription contributes its next dose time, derived from its
+frequency (the same daily times the frontend uses) and its start_date and
+end_date, to a heap ordered by due time. A ReminderScheduler thread sleeps
+until the earliest dose is due, delivers it to the user's mailbox and pushes
+that prescription's following dose, so the work done tracks the number of
+doses falling due rather than the number of clients or prescriptions.
+
+Clients wait on a user's mailbox (Server-Sent Events or long-poll) and are
+woken only when a reminder for that user is delivered. The scheduler watches
+the prescription table's file state; when it changes, only the users whose
+prescriptions differ are rescheduled.
+"""
+
+import heapq
+import itertools
+import threading
+from collections import deque
+from datetime import date, datetime, time, timedelta
+
+# Daily dose times per frequency, matching generateDosingSchedule() in
+# frontend/script.js. "As needed" and unknown frequencies get no reminders.
+DOSE_TIMES = {
+    'once daily': ['08:00'],
+    'twice daily': ['08:00', '20:00'],
+    'three times daily': ['08:00', '14:00', '20:00'],
+    'four times daily': ['08:00', '12:00', '16:00', '20:00'],
+    'as needed': [],
+}
+
+
+def dose_times(frequency):
+    """Sorted times of day for a frequency such as "Twice daily" """
+    times = DOSE_TIMES.get((frequency or '').strip().lower(), [])
+    return sorted(time.fromisoformat(value) for value in times)
+
+
+def parse_date(value):
+    """A YYYY-MM-DD cell as a date, or None when empty or invalid"""
+    try:
+        return date.fromisoformat((value or '').strip()[:10])
+    except ValueError:
+        return None
+
+
+def next_dose(row, after):
+    """First dose time of a prescription row strictly after a datetime
+
+    Returns None when the prescription has no dose times or has ended.
+    """
+    times = dose_times(row.get('frequency'))
+    start = parse_date(row.get('start_date'))
+    if not times or start is None:
+        return None
+    end = parse_date(row.get('end_date'))
+
+    day = max(after.date(), start)
+    while end is None or day <= end:
+        for dose_time in times:
+            due = datetime.combine(day, dose_time)
+            if due > after:
+                return due
+        day += timedelta(days=1)
+    return None
+
+
+class Mailbox:
+    """Recent reminders of one user, with a condition to wait for new ones
+
+    waiters counts the clients waiting on it; the scheduler keeps a mailbox
+    only while it has waiters or holds reminders.
+    """
+
+    def __init__(self, size):
+        self.reminders = deque(maxlen=size)
+        self.changed = threading.Condition()
+        self.waiters = 0
+
+
+class ReminderScheduler(threading.Thread):
+    """Background thread delivering prescription doses as they fall due
+
+    load_prescriptions(last_state) returns (state, rows) for the
+    prescription table, with rows None while its state still equals
+    last_state. It is called when the thread starts and then every
+    check_interval seconds. Doses found more than max_lateness overdue
+    (the server was stopped or suspended) are skipped, not delivered.
+    """
+
+    def __init__(self, load_prescriptions, check_interval=5.0, history_size=50,
+                 max_lateness=timedelta(minutes=15), clock=datetime.now):
+        super().__init__(name='reminder-scheduler', daemon=True)
+        self.load_prescriptions = load_prescriptions
+        self.check_interval = check_interval
+        self.history_size = history_size
+        self.max_lateness = max_lateness
+        self.clock = clock
+        self._lock = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._reminder_ids = itertools.count(1)
+        self._generations = {}
+        self._user_rows = {}
+        self._mailboxes = {}
+        self._state = None
+        self._stopped = False
+        self.delivered = 0
+        self.rescheduled_users = 0
+
+    def refresh(self):
+        """Reschedule users whose prescriptions changed since the last check"""
+        state, rows = self.load_prescriptions(self._state)
+        if rows is None:
+            return 0
+
+        by_user = {}
+        for row in rows:
+            user_id = row.get('user_id')
+            if user_id:
+                by_user.setdefault(user_id, []).append(row)
+
+        with self._lock:
+            changed = [
+                user_id for user_id in set(by_user) | set(self._user_rows)
+                if by_user.get(user_id) != self._user_rows.get(user_id)
+            ]
+            now = self.clock()
+            for user_id in changed:
+                self._schedule_user(user_id, by_user.get(user_id, []), now)
+                if user_id not in by_user:
+                    self._drop_mailbox(user_id, keep_reminders=False)
+            self._user_rows = by_user
+            self._state = state
+            self.rescheduled_users += len(changed)
+            self._lock.notify_all()
+        return len(changed)
+
+    def _schedule_user(self, user_id, rows, now):
+        """Replace a user's queued doses; older heap entries become stale"""
+        generation = self._generations.get(user_id, 0) + 1
+        self._generations[user_id] = generation
+        for row in rows:
+            self._push(user_id, generation, row, now)
+
+    def _push(self, user_id, generation, row, after):
+        due = next_dose(row, after)
+        if due is not None:
+            heapq.heappush(self._heap, (due, next(self._sequence), user_id, generation, row))
+
+    def deliver_due(self):
+        """Deliver every dose due by now; returns how many were delivered"""
+        delivered = 0
+        with self._lock:
+            now = self.clock()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, user_id, generation, row = heapq.heappop(self._heap)
+                if generation != self._generations.get(user_id):
+                    continue
+                if now - due <= self.max_lateness:
+                    self._deliver(user_id, due, row)
+                    delivered += 1
+                self._push(user_id, generation, row, max(due, now - self.max_lateness))
+        self.delivered += delivered
+        return delivered
+
+    def _deliver(self, user_id, due, row):
+        mailbox = self._mailbox(user_id)
+        with mailbox.changed:
+            mailbox.reminders.append({
+                'id': next(self._reminder_ids),
+                'user_id': user_id,
+                'medicine_name': row.get('medicine_name'),
+                'dose': row.get('dose'),
+                'frequency': row.get('frequency'),
+                'due': due.isoformat(sep=' '),
+            })
+            mailbox.changed.notify_all()
+
+    def _mailbox(self, user_id):
+        mailbox = self._mailboxes.get(user_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[user_id] = Mailbox(self.history_size)
+        return mailbox
+
+    def _drop_mailbox(self, user_id, keep_reminders=True):
+        """Forget a user's mailbox once nobody waits on it (called with _lock held)
+
+        With keep_reminders, a mailbox still holding reminders is kept.
+        """
+        mailbox = self._mailboxes.get(user_id)
+        if mailbox is not None and not mailbox.waiters \
+                and not (keep_reminders and mailbox.reminders):
+            del self._mailboxes[user_id]
+
+    def wait(self, user_id, after_id=0, timeout=None):
+        """Reminders for a user with an id above after_id
+
+        Blocks for up to timeout seconds until one is delivered, and returns
+        [] if none was. A mailbox made just for the wait goes with it when
+        nothing was delivered, so waits for unknown users leave nothing
+        behind.
+        """
+        with self._lock:
+            mailbox = self._mailbox(user_id)
+            mailbox.waiters += 1
+
+        def pending():
+            return [reminder for reminder in mailbox.reminders if reminder['id'] > after_id]
+
+        try:
+            with mailbox.changed:
+                mailbox.changed.wait_for(pending, timeout)
+                return pending()
+        finally:
+            with self._lock:
+                mailbox.waiters -= 1
+                self._drop_mailbox(user_id)
+
+    def last_id(self, user_id):
+        """Id of the newest reminder delivered to a user (0 if none)"""
+        with self._lock:
+            mailbox = self._mailboxes.get(user_id)
+            if mailbox is None:
+                return 0
+        with mailbox.changed:
+            return mailbox.reminders[-1]['id'] if mailbox.reminders else 0
+
+    def run(self):
+        next_check = 0.0
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+            now = self.clock()
+            if now.timestamp() >= next_check:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Error loading prescriptions for reminders: {e}")
+                next_check = now.timestamp() + self.check_interval
+
+            self.deliver_due()
+
+            with self._lock:
+                timeout = self.check_interval
+                if self._heap:
+                    until_due = (self._heap[0][0] - self.clock()).total_seconds()
+                    timeout = max(0.0, min(timeout, until_due))
+                if not self._stopped:
+                    self._lock.wait(timeout)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify_all()
+
+    def stats(self):
+        """Queue size and delivery counters for /api/cache/stats"""
+        with self._lock:
+            return {
+                'queued': len(self._heap),
+                'users': len(self._user_rows),
+                'mailboxes': len(self._mailboxes),
+                'delivered': self.delivered,
+                'rescheduled_users': self.rescheduled_users,
+            }
@@ -0,0 +1,283 @@
+"""
+In-process cache of parsed tables for the backend API.
+
+Each table is loaded once from its storage engine (see table_storage) and
+kept in memory together with the engine's state for it: the mtime and
+size of the CSV file it came from (and of its write-ahead log in "wal"
+storage mode), or the SQLite table's change stamp. A read only costs an
+os.stat() or a one-row query while the table is unchanged; the table is
+reloaded when another process (or a manual edit) changes it, and
+refreshed in place when this process writes to it.
+"""
+
+import os
+import threading
+from collections import deque
+from contextlib import nullcontext
+
+from table_index import HashIndex, SortedIndex, text_key
+
+
+def csv_row(fieldnames, record):
+    """Return record as csv.DictReader would read it back from the file"""
+    row = {}
+    for name in fieldnames:
+        value = record.get(name)
+        row[name] = '' if value is None else str(value)
+    return row
+
+
+def widened(fieldnames, record):
+    """fieldnames followed by any columns of record they don't have yet"""
+    return list(fieldnames) + [key for key in record if key not in fieldnames]
+
+
+def stat_key(path):
+    """(mtime_ns, size) of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class TableEntry:
+    """Parsed rows of one table plus the file state they were read from"""
+
+    def __init__(self, fieldnames, rows, state, index_spec=None):
+        self.fieldnames = list(fieldnames or [])
+        self.rows = rows
+        self.state = state
+        self.index_spec = index_spec or {}
+        self.log_entries = 0
+        # (old row, new row) for the latest in-memory edits, None standing
+        # for a missing row; edits counts every edit ever made
+        self.edits = 0
+        self.recent_edits = deque(maxlen=1024)
+        self._indexes = {}
+        self._sorted = {}
+
+    @property
+    def size(self):
+        """Size in bytes of the CSV file the rows came from (0 for SQLite)"""
+        return (self.state[0][1] or 0) if self.state[0] else 0
+
+    def index(self, column):
+        """Hash index for a column, built on first use; None if not indexed"""
+        if column not in self.index_spec:
+            return None
+        index = self._indexes.get(column)
+        if index is None:
+            index = HashIndex(column, self.index_spec[column])
+            index.build(self.rows)
+            self._indexes[column] = index
+        return index
+
+    def sorted_index(self, column, key=text_key):
+        """Rows ordered by a column under a sort key, built on first use"""
+        index = self._sorted.get((column, key))
+        if index is None:
+            index = SortedIndex(column, key)
+            index.build(self.rows)
+            self._sorted[(column, key)] = index
+        return index
+
+    def has_sorted_index(self, column, key=text_key):
+        """Check whether sorted_index(column, key) has already been built"""
+        return (column, key) in self._sorted
+
+    def append(self, row):
+        """Add a row at the end of the table, keeping built indexes current"""
+        self._add_columns(row)
+        position = len(self.rows)
+        self.rows.append(row)
+        for index in self._all_indexes():
+            index.add(position, row)
+        self._edited(None, row)
+
+    def replace(self, position, row):
+        """Swap the row at a position, keeping built indexes current"""
+        self._add_columns(row)
+        old_row = self.rows[position]
+        self.rows[position] = row
+        for index in self._all_indexes():
+            index.remove(position, old_row)
+            index.add(position, row)
+        self._edited(old_row, row)
+
+    def remove(self, positions):
+        """Drop the rows at the given positions
+
+        Positions after the removed rows shift, so built indexes are
+        discarded and rebuilt on their next use.
+        """
+        positions = set(positions)
+        if positions:
+            for position in sorted(positions):
+                self._edited(self.rows[position], None)
+            self.rows = [row for i, row in enumerate(self.rows) if i not in positions]
+            self._indexes = {}
+            self._sorted = {}
+
+    def apply(self, log_entry):
+        """Apply one write-ahead log entry (see table_log) to the rows"""
+        op = log_entry['op']
+        if op == 'insert':
+            self.append(log_entry['record'])
+        elif op == 'update':
+            positions = self.positions(log_entry['column'], log_entry['key'])
+            if positions:
+                self.replace(positions[0], log_entry['record'])
+        elif op == 'delete':
+            self.remove(self.positions(log_entry['column'], log_entry['key']))
+        self.log_entries += 1
+
+    def _edited(self, old_row, new_row):
+        self.edits += 1
+        self.recent_edits.append((old_row, new_row))
+
+    def _all_indexes(self):
+        return list(self._indexes.values()) + list(self._sorted.values())
+
+    def _add_columns(self, row):
+        """Extend fieldnames with columns first seen in row"""
+        for name in row:
+            if name not in self.fieldnames:
+                self.fieldnames.append(name)
+
+    def built_indexes(self):
+        """Columns whose index has been built so far"""
+        return sorted(self._indexes)
+
+    def positions(self, column, value):
+        """Positions of rows where column == value, using an index when available"""
+        index = self.index(column)
+        if index is not None:
+            return index.lookup(value)
+        return [i for i, row in enumerate(self.rows) if row.get(column) == value]
+
+
+class TableCache:
+    """Cache of parsed tables keyed by the backend's TABLE_PATHS names
+
+    Tables are loaded from a storage engine, replaying any write-ahead log
+    entries it hands back. When given a TableLocks, tables are loaded under
+    its cross-process load lock.
+    """
+
+    def __init__(self, storage, index_columns=None, locks=None):
+        self.storage = storage
+        self.table_paths = storage.table_paths
+        self.index_columns = index_columns or {}
+        self.locks = locks
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = {}
+
+    def file_state(self, table_name):
+        """Current storage state of a table, compared against entries"""
+        return self.storage.state(table_name)
+
+    def get(self, table_name):
+        """Return the current TableEntry for a table, or None if it does not exist"""
+        if table_name not in self.table_paths:
+            return None
+
+        state = self.file_state(table_name)
+        if state[0] is None:
+            with self._lock:
+                self._entries.pop(table_name, None)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(table_name)
+            if entry is not None and entry.state == state:
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        with self.locks.load(table_name) if self.locks else nullcontext():
+            state = self.file_state(table_name)
+            entry = self._load(table_name, state)
+
+        with self._lock:
+            self._entries[table_name] = entry
+            self.reloads[table_name] = self.reloads.get(table_name, 0) + 1
+        return entry
+
+    def is_cached(self, table_name):
+        """Check whether a table has an entry that is still current"""
+        if table_name not in self.table_paths:
+            return False
+        with self._lock:
+            entry = self._entries.get(table_name)
+        return entry is not None and entry.state == self.file_state(table_name)
+
+    def put(self, table_name, fieldnames, rows):
+        """Replace a table's entry after this process has written the whole table"""
+        if table_name not in self.table_paths:
+            return None
+
+        entry = TableEntry(fieldnames, rows, self.file_state(table_name),
+                           self.index_columns.get(table_name))
+        with self._lock:
+            self._entries[table_name] = entry
+        return entry
+
+    def applied(self, table_name, change, before, after):
+        """Bring the cached entry up to date after this process wrote to a table
+
+        before/after are file_state() results around the write and change is
+        called with the entry to mirror the write in memory. If the entry did
+        not match the files just before the write, some other writer got in
+        first and the entry is dropped instead.
+        """
+        with self._lock:
+            entry = self._entries.get(table_name)
+            if entry is None or entry.state != before:
+                self._entries.pop(table_name, None)
+                return
+            change(entry)
+            entry.state = after
+
+    def invalidate(self, table_name=None):
+        """Drop one table (or every table) so the next read re-parses the file"""
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(table_name, None)
+
+    def stats(self):
+        """Hit/miss counters and per-table details"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'tables': {
+                    name: {
+                        'rows': len(entry.rows),
+                        'size_bytes': entry.size,
+                        'log_entries': entry.log_entries,
+                        'reloads': self.reloads.get(name, 0),
+                        'indexes': entry.built_indexes(),
+                    }
+                    for name, entry in self._entries.items()
+                },
+            }
+
+    def _load(self, table_name, state):
+        """Load a table from storage and replay its log
+
+        state is taken before reading, so a write racing with the load
+        leaves the entry looking stale rather than current.
+        """
+        fieldnames, rows, log_entries = self.storage.load(table_name, state)
+        entry = TableEntry(fieldnames, rows, state, self.index_columns.get(table_name))
+        for log_entry in log_entries:
+            entry.apply(log_entry)
+        return entry
@@ -0,0 +1,299 @@
+"""
+Per-table change feed for /api/tables/<table_name>/changes.
+
+Every change to a table gets the next version number of that table and is
+recorded in a journal next to the CSV (prescription.csv ->
+prescription.csv.changes), one JSON line per change. A client that synced
+at version N asks for the changes after N and gets one entry per key that
+changed since: "insert" or "update" with the key's current rows, or a
+"delete" tombstone. Keys follow the table's primary key, which is not
+unique in every table (prescription has one row per medicine of a user),
+so an entry carries all rows of its key.
+
+ChangeFeed.refresh() diffs the rows of the current TableEntry against the
+rows it saw last, the same way the drug search index is refreshed, so
+writes made by other processes are recorded too. After a write this
+process mirrored into the same entry, only the keys of the rows in the
+entry's recent edits are compared. A column missing from a row and an
+empty one compare equal, so a write that adds a column to the table does
+not turn every row into an update. Only the newest max_entries changes
+are kept; a client whose version is older than that, or that has never
+synced, gets the whole table back as a reset instead.
+
+The journal also records the table's file state after each refresh. A
+process starting up adopts the table as it is when that state still
+matches; otherwise the table was changed while nobody was watching and
+every client is sent a reset.
+"""
+
+import bisect
+import json
+import os
+import threading
+from datetime import datetime
+from itertools import islice
+
+
+def changes_path(file_path):
+    """Path of the change journal for a table's CSV file"""
+    return file_path.with_name(file_path.name + '.changes')
+
+
+def _encode(item):
+    return (json.dumps(item, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _same_values(old_group, group):
+    """Check whether two groups of rows differ only in columns missing or empty
+
+    Adding a column to a table rewrites every row with it empty, which is
+    not a change of the rows.
+    """
+    if old_group is None or len(old_group) != len(group):
+        return False
+    for old_row, row in zip(old_group, group):
+        for column in old_row.keys() | row.keys():
+            if (old_row.get(column) or '') != (row.get(column) or ''):
+                return False
+    return True
+
+
+def _as_state(value):
+    """A file state read back from JSON, with its lists turned into tuples"""
+    if value is None:
+        return None
+    return tuple(_as_state(part) if isinstance(part, list) else part for part in value)
+
+
+class ChangeFeed:
+    """Versioned changes of one table, kept in memory and in its journal
+
+    Callers serialize refresh() with the table's write lock, which also
+    keeps other processes out of the journal while it is appended to.
+    """
+
+    def __init__(self, file_path, key_column, max_entries=10000):
+        self.path = changes_path(file_path)
+        self.key_column = key_column
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._rows = None
+        # Entry the rows were last taken from, and its edit count then
+        self._entry = None
+        self._edits = 0
+        self._state = None
+        self._journal_state = None
+        self._changes = []
+        self._versions = []
+        self._floor = 0
+        self._version = 0
+        self._lines = 0
+        self.resets = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def is_current(self, state):
+        """Check whether the feed has recorded the table at this file state"""
+        return self._rows is not None and state == self._state
+
+    def refresh(self, entry):
+        """Record the changes between the last seen rows and entry
+
+        Returns the number of changes recorded.
+        """
+        with self._lock:
+            if entry is None:
+                return 0
+            if self._journal_state is None or _stat(self.path) != self._journal_state:
+                self._load()
+                if self._state == entry.state:
+                    self._adopt(entry)
+                    return 0
+            if self._rows is not None and entry.state == self._state:
+                return 0
+
+            lines = []
+            if self._rows is None:
+                # No rows to diff against: start a new history, or restart it
+                # if the table changed since the journal last saw it
+                self._version += 1
+                self._floor = self._version
+                self._changes, self._versions = [], []
+                self.resets += 1
+                lines.append({'floor': self._floor})
+                self._adopt(entry)
+            else:
+                now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                for key, group in self._touched(entry).items():
+                    old_group = self._rows.get(key)
+                    if group is None and old_group is not None:
+                        lines.append(self._change('delete', key, None, now))
+                        del self._rows[key]
+                    elif group is not None and group != old_group:
+                        if not _same_values(old_group, group):
+                            lines.append(self._change('insert' if old_group is None else 'update',
+                                                      key, group, now))
+                        self._rows[key] = group
+                self._entry, self._edits = entry, entry.edits
+
+            recorded = sum(1 for line in lines if 'op' in line)
+            self._state = entry.state
+            lines.append({'version': self._version, 'state': entry.state})
+            self._write(lines)
+            return recorded
+
+    def changes_since(self, since, limit=None):
+        """Changes after version since, at most one per key
+
+        Returns (changes, next_since), next_since being the version to ask
+        from for the rest when limit cut the list short (None otherwise),
+        or (None, None) if the changes after since are no longer all known
+        and the client has to reset from snapshot().
+        """
+        with self._lock:
+            if since < self._floor or since > self._version:
+                return None, None
+
+            latest = {}
+            next_since = None
+            for change in self._changes[bisect.bisect_right(self._versions, since):]:
+                key = change['key']
+                previous = latest.pop(key, None)
+                if previous is None and limit is not None and len(latest) >= limit:
+                    next_since = change['version'] - 1
+                    break
+                if previous is not None and previous['op'] == 'insert' and change['op'] == 'update':
+                    change = {**change, 'op': 'insert'}
+                latest[key] = change
+            return list(latest.values()), next_since
+
+    def snapshot(self):
+        """(version, rows) of the table as last recorded"""
+        with self._lock:
+            rows = [row for group in (self._rows or {}).values() for row in group]
+            return self._version, rows
+
+    def _adopt(self, entry):
+        """Take entry's rows as the ones seen last, without recording changes"""
+        self._rows = self._group(entry.rows)
+        self._entry, self._edits = entry, entry.edits
+
+    def _group(self, rows):
+        """{key: tuple of rows} in table order"""
+        groups = {}
+        for row in rows:
+            groups.setdefault(row.get(self.key_column), []).append(row)
+        return {key: tuple(group) for key, group in groups.items()}
+
+    def _touched(self, entry):
+        """{key: current rows, or None if it has none} for keys whose rows changed
+
+        May include keys that turn out unchanged. When entry is the one seen
+        last and still remembers every edit made since, only the keys of
+        the edited rows are looked up, in edit order; otherwise the whole
+        table is regrouped.
+        """
+        new_edits = entry.edits - self._edits
+        index = entry.index(self.key_column)
+        if entry is not self._entry or new_edits > len(entry.recent_edits) or index is None:
+            groups = self._group(entry.rows)
+            touched = dict.fromkeys(key for key in self._rows if key not in groups)
+            touched.update(groups)
+            return touched
+
+        keys = {}
+        for pair in islice(entry.recent_edits, len(entry.recent_edits) - new_edits, None):
+            keys.update((row.get(self.key_column), None) for row in pair if row is not None)
+        return {
+            key: tuple(entry.rows[i] for i in index.lookup(key)) or None
+            for key in keys
+        }
+
+    def _change(self, op, key, group, at):
+        self._version += 1
+        change = {'version': self._version, 'op': op, 'key': key,
+                  'rows': list(group) if group is not None else [], 'at': at}
+        self._changes.append(change)
+        self._versions.append(self._version)
+        return change
+
+    def _load(self):
+        """Read the journal, as written by this or another process"""
+        self._changes, self._versions = [], []
+        self._floor = self._version = self._lines = 0
+        self._state = None
+        try:
+            with open(self.path, 'rb') as f:
+                lines = f.read().split(b'\n')
+        except FileNotFoundError:
+            lines = []
+
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                break
+            self._lines += 1
+            if 'floor' in item:
+                self._floor = item['floor']
+                self._version = max(self._version, self._floor)
+                self._changes, self._versions = [], []
+            elif 'state' in item:
+                self._version = max(self._version, item['version'])
+                self._state = _as_state(item['state'])
+            else:
+                self._version = max(self._version, item['version'])
+                self._changes.append(item)
+                self._versions.append(item['version'])
+        self._journal_state = _stat(self.path)
+
+    def _write(self, lines):
+        """Append lines to the journal, rewriting it once it grows too long"""
+        self._lines += len(lines)
+        if len(self._changes) > self.max_entries or self._lines > 2 * self.max_entries + 2:
+            dropped = max(0, len(self._changes) - self.max_entries)
+            if dropped:
+                self._floor = self._changes[dropped - 1]['version']
+                del self._changes[:dropped]
+                del self._versions[:dropped]
+            lines = ([{'floor': self._floor}] + self._changes
+                     + [{'version': self._version, 'state': self._state}])
+            temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            try:
+                with open(temp_path, 'wb') as f:
+                    f.write(b''.join(_encode(line) for line in lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            finally:
+                if temp_path.exists():
+                    temp_path.unlink()
+            self._lines = len(lines)
+        else:
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(_encode(line) for line in lines))
+                f.flush()
+                os.fsync(f.fileno())
+        self._journal_state = _stat(self.path)
+
+    def stats(self):
+        """Version and journal counters for /api/cache/stats"""
+        with self._lock:
+            return {
+                'version': self._version,
+                'oldest_version': self._floor,
+                'changes': len(self._changes),
+                'resets': self.resets,
+            }
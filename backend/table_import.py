@@ -0,0 +1,215 @@
+"""
+Merging a client's localStorage snapshot into the server tables.
+
+/api/import-from-localstorage receives {"csv_<table>": [records], ...}.
+stream_tables() parses that body as it is read, handing back each table's
+records as soon as its array is complete, so the raw body is never held
+in memory whole and a table can be merged while the next one is parsed.
+
+merge_records() diffs a table's incoming records against its cached rows
+by primary key, with updated_at deciding which side wins:
+
+- a key the table doesn't have is inserted
+- a key whose rows are already the same is skipped
+- a key whose incoming updated_at is newer replaces the table's rows
+- a key whose table rows are as new or newer is a conflict; the table
+  keeps its rows
+
+When one side has no updated_at, the import counts as the later write
+unless only the table's side is dated. Written rows get created_at and
+(if the record had none) updated_at set, as other writes do. Rows missing
+from the snapshot are kept: a stale snapshot must not delete what other
+clients added.
+"""
+
+import codecs
+import json
+from datetime import datetime
+
+from table_cache import csv_row, widened
+from table_log import delete_entry, insert_entry, update_entry
+
+# Keys listed per table in a merge result, at most
+MAX_REPORTED_CONFLICTS = 100
+
+_WHITESPACE = ' \t\n\r'
+
+
+class ImportFormatError(ValueError):
+    """Raised when an import body is not {"table": [records], ...} JSON"""
+
+
+class _Reader:
+    """Incremental JSON tokens from a binary stream read in chunks"""
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Read another chunk; False at the end of the stream"""
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + self.utf8.decode(chunk or b'', final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, or '' at the end"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ImportFormatError(f"Expected '{char}' in import body")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if not self._fill():
+                    raise ImportFormatError('Import body is not valid JSON')
+                continue
+            # A number at the end of the buffer may go on in the next chunk
+            if end == len(self.buffer) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+
+def stream_tables(stream, chunk_size=64 * 1024):
+    """Yield (name, records) for each member of a top-level JSON object
+
+    Array members are decoded one element at a time; other members are
+    yielded with their value as is.
+    """
+    reader = _Reader(stream, chunk_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        if not isinstance(name, str):
+            raise ImportFormatError('Expected a table name in import body')
+        reader.expect(':')
+        if reader.peek() == '[':
+            reader.pos += 1
+            records = []
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    records.append(reader.value())
+                    if reader.peek() == ']':
+                        reader.pos += 1
+                        break
+                    reader.expect(',')
+            yield name, records
+        else:
+            yield name, reader.value()
+
+        if reader.peek() == '}':
+            return
+        reader.expect(',')
+
+
+def timestamp(value):
+    """updated_at cell as a comparable string ('' when missing)"""
+    return str(value or '').replace('T', ' ')[:19]
+
+
+def newest(rows):
+    return max((timestamp(row.get('updated_at')) for row in rows), default='')
+
+
+def stamped(row, now, dated):
+    """row with created_at filled in, and updated_at set unless dated"""
+    stamps = {'created_at': row.get('created_at') or now}
+    if not dated:
+        stamps['updated_at'] = now
+    return {**row, **stamps}
+
+
+def merge_records(entry, key_column, records):
+    """Merge records into a TableEntry by key_column, last writer wins
+
+    The entry is changed in memory. Returns (counts, conflicts,
+    log_entries): row counts of inserted, updated, skipped, conflicts and
+    invalid (records without a key), the keys that conflicted, and the
+    write-ahead log entries for the rows that changed.
+    """
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0, 'conflicts': 0, 'invalid': 0}
+    conflicts = []
+    log_entries = []
+
+    incoming = {}
+    for record in records:
+        key = record.get(key_column) if isinstance(record, dict) else None
+        if key is None or key == '':
+            counts['invalid'] += 1
+            continue
+        incoming.setdefault(str(key), []).append(record)
+
+    removed = []
+    for key, group in incoming.items():
+        positions = entry.positions(key_column, key)
+        current = [entry.rows[i] for i in positions]
+        if len(group) == 1 and len(current) == 1:
+            # One row each side: the record updates the row like a PUT would
+            merged = {**current[0], **group[0]}
+            rows = [csv_row(widened(entry.fieldnames, merged), merged)]
+        else:
+            rows = [csv_row(widened(entry.fieldnames, record), record) for record in group]
+
+        incoming_time = newest(group)
+        if not current:
+            for row in rows:
+                row = stamped(row, now, incoming_time)
+                entry.append(row)
+                log_entries.append(insert_entry(row))
+            counts['inserted'] += len(rows)
+            continue
+        if rows == current:
+            counts['skipped'] += len(rows)
+            continue
+
+        current_time = newest(current)
+        if current_time and (not incoming_time or incoming_time <= current_time):
+            counts['conflicts'] += len(rows)
+            if len(conflicts) < MAX_REPORTED_CONFLICTS:
+                conflicts.append(key)
+            continue
+
+        rows = [stamped(row, now, incoming_time) for row in rows]
+        if len(rows) == 1 and len(current) == 1:
+            entry.replace(positions[0], rows[0])
+            log_entries.append(update_entry(key_column, key, rows[0]))
+        else:
+            removed.extend(positions)
+            log_entries.append(delete_entry(key_column, key))
+            for row in rows:
+                entry.append(row)
+                log_entries.append(insert_entry(row))
+        counts['updated'] += len(rows)
+
+    # Removing shifts positions, so replaced groups go in one pass at the end
+    entry.remove(removed)
+    return counts, conflicts, log_entries
@@ -0,0 +1,201 @@
+"""
+Hash and sorted indexes over cached table rows.
+
+A hash index maps a column value to the positions of the rows holding it,
+so equality lookups on indexed columns no longer scan the table. Which
+columns are indexed is derived from table_schemas.json (primary keys, unique
+columns and each table's "indexes" list). A sorted index keeps rows ordered
+by one column for key-ordered pagination and range lookups.
+"""
+
+import bisect
+
+
+class DuplicateKeyError(ValueError):
+    """Raised when an insert would duplicate a value in a unique index"""
+
+    def __init__(self, table_name, column, value):
+        super().__init__(f"Duplicate value '{value}' for unique column '{column}' in {table_name}")
+        self.table_name = table_name
+        self.column = column
+        self.value = value
+
+
+class HashIndex:
+    """Equality index from a column value to a list of row positions
+
+    Unique indexes keep the same structure; the flag is used to reject
+    inserts that would add a second row for an existing value.
+    """
+
+    def __init__(self, column, unique=False):
+        self.column = column
+        self.unique = unique
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def build(self, rows):
+        """Index every row of a table"""
+        self._positions = {}
+        for position, row in enumerate(rows):
+            self.add(position, row)
+
+    def add(self, position, row):
+        """Index a row stored at the given position"""
+        positions = self._positions.setdefault(row.get(self.column), [])
+        if not positions or positions[-1] < position:
+            positions.append(position)
+        else:
+            bisect.insort(positions, position)
+
+    def remove(self, position, row):
+        """Drop a row from the index"""
+        key = row.get(self.column)
+        positions = self._positions.get(key)
+        if positions is None:
+            return
+        try:
+            positions.remove(position)
+        except ValueError:
+            return
+        if not positions:
+            del self._positions[key]
+
+    def lookup(self, value):
+        """Positions of the rows whose column equals value, in table order"""
+        return list(self._positions.get(value, ()))
+
+    def contains(self, value):
+        """Check whether any row holds the value"""
+        return value in self._positions
+
+
+def text_key(value):
+    """Default sort key: the cell text, with missing cells first"""
+    return '' if value is None else value
+
+
+class SortedIndex:
+    """Rows ordered by one column, as (key, position) pairs
+
+    key converts a cell to a comparable sort key; rows with equal keys stay
+    in table order.
+    """
+
+    _AFTER_ALL = float('inf')
+
+    def __init__(self, column, key=text_key):
+        self.column = column
+        self.key = key
+        self._items = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def build(self, rows):
+        """Index every row of a table"""
+        self._items = sorted(
+            (self.key(row.get(self.column)), position) for position, row in enumerate(rows)
+        )
+
+    def add(self, position, row):
+        """Index a row stored at the given position"""
+        bisect.insort(self._items, (self.key(row.get(self.column)), position))
+
+    def remove(self, position, row):
+        """Drop a row from the index"""
+        item = (self.key(row.get(self.column)), position)
+        i = bisect.bisect_left(self._items, item)
+        if i < len(self._items) and self._items[i] == item:
+            del self._items[i]
+
+    def range(self, low=None, high=None, include_low=True, include_high=True, reverse=False):
+        """Positions of rows whose key lies between low and high, in key order
+
+        None for low or high leaves that end open. Bounds are sort keys, as
+        produced by self.key.
+        """
+        start, stop = 0, len(self._items)
+        if low is not None:
+            if include_low:
+                start = bisect.bisect_left(self._items, (low, -1))
+            else:
+                start = bisect.bisect_right(self._items, (low, self._AFTER_ALL))
+        if high is not None:
+            if include_high:
+                stop = bisect.bisect_right(self._items, (high, self._AFTER_ALL))
+            else:
+                stop = bisect.bisect_left(self._items, (high, -1))
+
+        indices = range(start, stop)
+        if reverse:
+            indices = reversed(indices)
+        return (self._items[i][1] for i in indices)
+
+    def page_after(self, after, limit):
+        """Up to limit positions following the key after (None = from the start)
+
+        A page never ends part-way through a run of rows sharing a key, so
+        the last key on a page is always a complete cursor for the next one.
+        The page can therefore hold more than limit rows.
+        """
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(self._items, (after, self._AFTER_ALL))
+
+        stop = min(start + limit, len(self._items))
+        while 0 < stop < len(self._items) and self._items[stop][0] == self._items[stop - 1][0]:
+            stop += 1
+
+        page = self._items[start:stop]
+        has_more = stop < len(self._items)
+        return [position for _, position in page], (page[-1][0] if page and has_more else None)
+
+
+def is_indexable(value):
+    """Only scalar JSON values can be looked up in a hash index"""
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+def build_index_columns(schemas, index_setting=True):
+    """Work out which columns of each table to index
+
+    Returns {table_name: {column: unique}}. The primary key is always
+    indexed (unique when its column is declared unique; prescription keys
+    on user_id but holds several rows per user), as are columns declared
+    "unique" and any listed in the table's "indexes". index_setting is
+    performance_settings.index_columns: False disables indexing, and a
+    mapping of {table_name: [columns]} adds further non-unique indexes.
+    """
+    if index_setting is False:
+        return {}
+
+    index_columns = {}
+    for table_name, schema in schemas.items():
+        columns = schema.get('columns', {})
+        indexed = {}
+
+        primary_key = schema.get('primary_key')
+        if primary_key:
+            indexed[primary_key] = bool(columns.get(primary_key, {}).get('unique', False))
+
+        for column, props in columns.items():
+            if props.get('unique'):
+                indexed[column] = True
+
+        for column in schema.get('indexes', []):
+            indexed.setdefault(column, False)
+
+        if isinstance(index_setting, dict):
+            for column in index_setting.get(table_name, []):
+                indexed.setdefault(column, False)
+
+        index_columns[table_name] = indexed
+
+    if isinstance(index_setting, dict):
+        for table_name, extra_columns in index_setting.items():
+            if table_name not in index_columns:
+                index_columns[table_name] = {column: False for column in extra_columns}
+    return index_columns
@@ -0,0 +1,192 @@
+"""
+Per-table locking for the backend API.
+
+Within a process, each table has a reader/writer lock: requests that only
+read a table run in parallel, while writes (and the read-modify-write of an
+update) are serialized. Across processes, writers also take an exclusive
+fcntl lock on <table>.csv.lock, and loading a table from disk takes a shared
+one, so several gunicorn workers can share database/core_tables. On
+platforms without fcntl only the in-process locks are used.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class ReadWriteLock:
+    """Reader/writer lock that prefers writers
+
+    Both sides are re-entrant for the thread holding them, and the writing
+    thread may also take read locks. A reader cannot upgrade to a writer.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            self._readers[me] -= 1
+            if not self._readers[me]:
+                del self._readers[me]
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("Cannot upgrade a read lock to a write lock")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    def held_for_write(self):
+        """Check whether the calling thread holds the write lock"""
+        return self._writer == threading.get_ident()
+
+
+@contextmanager
+def file_lock(lock_path, exclusive):
+    """Hold an fcntl lock on lock_path (a no-op without fcntl)"""
+    if fcntl is None:
+        yield
+        return
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
+
+
+class TableLocks:
+    """Reader/writer and cross-process locks for every table in table_paths"""
+
+    def __init__(self, table_paths):
+        self.table_paths = table_paths
+        self._locks = {table_name: ReadWriteLock() for table_name in table_paths}
+        # {(table_name, 'read'|'write'): [acquisitions, seconds spent waiting]}
+        self._waits = {}
+        self._waits_lock = threading.Lock()
+
+    def _waited(self, table_name, mode, seconds):
+        with self._waits_lock:
+            waits = self._waits.setdefault((table_name, mode), [0, 0.0])
+            waits[0] += 1
+            waits[1] += seconds
+
+    def lock_path(self, table_name):
+        file_path = self.table_paths[table_name]
+        return file_path.with_name(file_path.name + '.lock')
+
+    @contextmanager
+    def read(self, table_name):
+        """Read a table, in parallel with other readers in this process"""
+        lock = self._locks.get(table_name)
+        if lock is None:
+            yield
+            return
+
+        started = time.perf_counter()
+        lock.acquire_read()
+        self._waited(table_name, 'read', time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            lock.release_read()
+
+    @contextmanager
+    def write(self, table_name):
+        """Write a table, excluding all other readers and writers
+
+        The outermost write also holds the table's exclusive file lock.
+        """
+        lock = self._locks.get(table_name)
+        if lock is None:
+            yield
+            return
+
+        if lock.held_for_write():
+            lock.acquire_write()
+            try:
+                yield
+            finally:
+                lock.release_write()
+            return
+
+        started = time.perf_counter()
+        lock.acquire_write()
+        try:
+            with file_lock(self.lock_path(table_name), exclusive=True):
+                self._waited(table_name, 'write', time.perf_counter() - started)
+                yield
+        finally:
+            lock.release_write()
+
+    @contextmanager
+    def load(self, table_name):
+        """Read a table's files from disk, excluding writers in other processes
+
+        A thread that already holds the table's write lock has the file
+        locked exclusively and does not lock it again.
+        """
+        if table_name not in self._locks or self._locks[table_name].held_for_write():
+            yield
+            return
+
+        file_path = self.table_paths[table_name]
+        if not file_path.parent.exists():
+            yield
+            return
+
+        with file_lock(self.lock_path(table_name), exclusive=False):
+            yield
+
+    def stats(self):
+        """Acquisitions and seconds spent waiting, per table and lock mode
+
+        Write waits include the wait for the cross-process file lock.
+        Re-entrant acquisitions by the writing thread are not counted.
+        """
+        with self._waits_lock:
+            waits = sorted((key, tuple(value)) for key, value in self._waits.items())
+        stats = {}
+        for (table_name, mode), (acquisitions, seconds) in waits:
+            stats.setdefault(table_name, {})[mode] = {'acquisitions': acquisitions,
+                                                      'wait_seconds': seconds}
+        return stats
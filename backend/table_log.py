@@ -0,0 +1,166 @@
+"""
+Write-ahead log for the CSV tables.
+
+In "wal" storage mode every insert, update and delete is appended to a
+per-table log next to the CSV (prescription.csv -> prescription.csv.wal)
+and fsynced before the request returns. Reads replay the log on top of the
+base CSV, and a background LogCompactor folds the log into a fresh CSV once
+it grows past the configured size or entry count.
+
+The first line of a log records the (mtime_ns, size) of the CSV it applies
+to. Compaction replaces the CSV before removing the log, so a log left
+behind by a crash in between no longer matches its base and is set aside
+instead of being applied twice.
+"""
+
+import json
+import os
+import threading
+
+
+def log_path(file_path):
+    """Path of the write-ahead log for a table's CSV file"""
+    return file_path.with_name(file_path.name + '.wal')
+
+
+def insert_entry(record):
+    """Log entry adding a row"""
+    return {'op': 'insert', 'record': record}
+
+
+def update_entry(column, key, record):
+    """Log entry replacing the first row whose key column equals key"""
+    return {'op': 'update', 'column': column, 'key': key, 'record': record}
+
+
+def delete_entry(column, key):
+    """Log entry removing every row whose key column equals key"""
+    return {'op': 'delete', 'column': column, 'key': key}
+
+
+def append_entries(file_path, entries, base_state):
+    """Append entries to a table's log with one write and fsync
+
+    base_state is the (mtime_ns, size) of the CSV, written as the header
+    when the log is started. Returns the number of bytes written.
+    """
+    path = log_path(file_path)
+    with open(path, 'ab+') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            _drop_torn_tail(f, size)
+        payload = b''.join(_encode(entry) for entry in entries)
+        if not f.tell():
+            payload = _encode({'base': list(base_state)}) + payload
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(payload)
+
+
+def read_entries(file_path, base_state):
+    """Entries of a table's log, or [] if there is no usable log
+
+    A log whose base does not match the current CSV (the CSV was rewritten
+    or edited by hand after the log was started) is renamed to *.wal.stale
+    and ignored. A torn last line from an interrupted write is skipped.
+    """
+    path = log_path(file_path)
+    try:
+        with open(path, 'rb') as f:
+            lines = f.read().split(b'\n')
+    except FileNotFoundError:
+        return []
+
+    entries = []
+    header = None
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            break
+        if header is None:
+            header = item
+        else:
+            entries.append(item)
+
+    if header is None:
+        return []
+    if tuple(header.get('base') or ()) != tuple(base_state or ()):
+        print(f"Ignoring stale write-ahead log {path.name}: its base no longer matches the table")
+        try:
+            os.replace(path, path.with_name(path.name + '.stale'))
+        except FileNotFoundError:
+            pass
+        return []
+    return entries
+
+
+def remove_log(file_path):
+    """Delete a table's log once its entries are in the CSV"""
+    try:
+        os.remove(log_path(file_path))
+    except FileNotFoundError:
+        pass
+
+
+def log_size(file_path):
+    """Size of a table's log in bytes (0 when there is none)"""
+    try:
+        return os.stat(log_path(file_path)).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _encode(item):
+    return (json.dumps(item, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _drop_torn_tail(f, size):
+    """Cut an unterminated last line left by an interrupted append"""
+    f.seek(-1, os.SEEK_END)
+    if f.read(1) == b'\n':
+        return
+    f.seek(0)
+    data = f.read()
+    f.truncate(data.rfind(b'\n') + 1)
+    f.seek(0, os.SEEK_END)
+
+
+class LogCompactor(threading.Thread):
+    """Background thread folding table logs into fresh CSV files
+
+    compact(table_name) does the actual work; pending(table_name) returns
+    the number of entries waiting in the table's log.
+    """
+
+    def __init__(self, table_paths, compact, pending, max_entries=1000,
+                 max_bytes=4 * 1024 * 1024, interval=5.0):
+        super().__init__(name='table-log-compactor', daemon=True)
+        self.table_paths = table_paths
+        self.compact = compact
+        self.pending = pending
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def due(self, table_name):
+        """Check whether a table's log has passed a compaction threshold"""
+        file_path = self.table_paths[table_name]
+        return (log_size(file_path) >= self.max_bytes
+                or self.pending(table_name) >= self.max_entries)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            for table_name in list(self.table_paths):
+                try:
+                    if self.due(table_name):
+                        self.compact(table_name)
+                except Exception as e:
+                    print(f"Error compacting {table_name}: {e}")
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,303 @@
+"""
+Query engine for POST /api/tables/<table_name>/find.
+
+A query is a set of conditions on columns plus an optional order and limit:
+
+    {"where": {"user_id": "demo",
+               "end_date": {"gt": "2025-10-28"},
+               "medicine_name": {"prefix": "Para"},
+               "frequency": {"in": ["Once daily", "Twice daily"]}},
+     "order_by": "-end_date",
+     "limit": 20}
+
+A plain {column: value} body (the original /find format) is a query whose
+conditions are all equality. Operators are eq, ne, in, gt, gte, lt, lte and
+prefix. Cells are compared by the column's type in table_schemas.json, so
+INTEGER and DECIMAL columns compare as numbers, and DATE and TIMESTAMP
+columns as ISO date strings; empty cells never satisfy a range condition.
+
+The planner starts from a hash index for an eq/in condition when one exists,
+then from a sorted index for a range or prefix condition or for the order,
+and otherwise streams over the rows. The plan it picked is returned with the
+results.
+"""
+
+OPERATORS = ('eq', 'ne', 'in', 'gt', 'gte', 'lt', 'lte', 'prefix')
+RANGE_OPERATORS = ('gt', 'gte', 'lt', 'lte', 'prefix')
+QUERY_KEYS = ('where', 'order_by', 'limit')
+
+_PREFIX_END = '\U0010ffff'
+
+
+class QueryError(ValueError):
+    """Raised for a query that cannot be run (reported to the client as a 400)"""
+
+
+def text_value(value):
+    return '' if value is None else str(value)
+
+
+def number_value(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def date_value(value):
+    value = '' if value is None else str(value).strip()
+    return value or None
+
+
+def boolean_value(value):
+    if isinstance(value, bool):
+        return value
+    value = '' if value is None else str(value).strip().lower()
+    if value in ('true', '1', 'yes'):
+        return True
+    if value in ('false', '0', 'no'):
+        return False
+    return None
+
+
+CONVERTERS = {
+    'text': text_value,
+    'number': number_value,
+    'date': date_value,
+    'boolean': boolean_value,
+}
+
+
+def column_kind(columns, column):
+    """How a column's cells are compared, from its declared schema type"""
+    declared = columns.get(column, {}).get('type', '').upper()
+    if declared.startswith(('INTEGER', 'DECIMAL')):
+        return 'number'
+    if declared in ('DATE', 'TIMESTAMP'):
+        return 'date'
+    if declared == 'BOOLEAN':
+        return 'boolean'
+    return 'text'
+
+
+def _ordered(value):
+    """Sort key that puts empty cells before every typed value"""
+    return (0,) if value is None else (1, value)
+
+
+def _sort_key(convert):
+    return lambda cell: _ordered(convert(cell))
+
+
+# One key function per kind, so sorted indexes built for a kind are reused
+SORT_KEYS = {kind: _sort_key(convert) for kind, convert in CONVERTERS.items()}
+
+
+class Condition:
+    """One operator applied to one column"""
+
+    def __init__(self, column, op, value, kind):
+        if op not in OPERATORS:
+            raise QueryError(f"Unknown operator '{op}' for column '{column}'")
+        self.column = column
+        self.op = op
+        self.kind = kind
+        self.convert = CONVERTERS[kind]
+
+        if op == 'in':
+            if not isinstance(value, list):
+                raise QueryError(f"'in' for column '{column}' expects a list")
+            self.value = [self.convert(item) for item in value]
+            if self.kind == 'text':
+                self.value = set(self.value)
+        elif op == 'prefix':
+            if not isinstance(value, str):
+                raise QueryError(f"'prefix' for column '{column}' expects a string")
+            self.value = value
+        else:
+            self.value = self.convert(value)
+            if self.value is None and (op in RANGE_OPERATORS or text_value(value).strip()):
+                raise QueryError(f"Cannot compare column '{column}' with {value!r}")
+
+    def matches(self, row):
+        cell = row.get(self.column)
+        if self.op == 'prefix':
+            return cell is not None and cell.startswith(self.value)
+
+        cell = self.convert(cell)
+        if self.op == 'eq':
+            return cell == self.value
+        if self.op == 'ne':
+            return cell != self.value
+        if self.op == 'in':
+            return cell in self.value
+        if cell is None:
+            return False
+        if self.op == 'gt':
+            return cell > self.value
+        if self.op == 'gte':
+            return cell >= self.value
+        if self.op == 'lt':
+            return cell < self.value
+        return cell <= self.value
+
+    def hash_keys(self):
+        """Cell texts to look up in a hash index, or None if it cannot be used"""
+        if self.kind != 'text' or self.op not in ('eq', 'in'):
+            return None
+        return [self.value] if self.op == 'eq' else sorted(self.value)
+
+    def bounds(self):
+        """range() arguments selecting the rows this condition can match"""
+        if self.op == 'prefix':
+            return {'low': (1, self.value), 'high': (1, self.value + _PREFIX_END)}
+        value = _ordered(self.value)
+        if self.op in ('gt', 'gte'):
+            return {'low': value, 'include_low': self.op == 'gte'}
+        # (1,) sorts after every empty cell and before every typed value
+        return {'low': (1,), 'high': value, 'include_high': self.op == 'lte'}
+
+    def describe(self):
+        return {'column': self.column, 'op': self.op}
+
+
+class Query:
+    """Parsed find request"""
+
+    def __init__(self, conditions, order_by=None, descending=False, limit=None):
+        self.conditions = conditions
+        self.order_by = order_by
+        self.descending = descending
+        self.limit = limit
+
+    @classmethod
+    def parse(cls, payload, columns):
+        """Build a Query from a request body and the table's schema columns"""
+        if not isinstance(payload, dict):
+            raise QueryError("Expected a JSON object")
+
+        if any(key in payload for key in QUERY_KEYS):
+            unknown = sorted(set(payload) - set(QUERY_KEYS))
+            if unknown:
+                raise QueryError(f"Unknown query keys: {', '.join(unknown)}")
+            where = payload.get('where') or {}
+        else:
+            where = payload
+        if not isinstance(where, dict):
+            raise QueryError("'where' must be an object")
+
+        conditions = []
+        for column, spec in where.items():
+            kind = column_kind(columns, column)
+            if isinstance(spec, dict):
+                if not spec:
+                    raise QueryError(f"No operator given for column '{column}'")
+                for op, value in spec.items():
+                    conditions.append(Condition(column, op, value, kind))
+            else:
+                conditions.append(Condition(column, 'eq', spec, kind))
+
+        order_by = payload.get('order_by')
+        descending = False
+        if order_by is not None:
+            if not isinstance(order_by, str) or not order_by.lstrip('-'):
+                raise QueryError("'order_by' must be a column name, prefixed with '-' for descending")
+            descending = order_by.startswith('-')
+            order_by = order_by.lstrip('-')
+
+        limit = payload.get('limit')
+        if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 1):
+            raise QueryError("'limit' must be a positive integer")
+
+        return cls(conditions, order_by, descending, limit)
+
+
+def run_query(entry, query, columns, sorted_columns=()):
+    """Rows of a TableEntry matching a query, and the plan used to find them
+
+    A sorted index is used when it has already been built, when the query is
+    ordered by its column (the rows have to be sorted either way), or when its
+    column is hash-indexed or listed in sorted_columns.
+    """
+    if query.order_by is not None and query.order_by not in entry.fieldnames:
+        raise QueryError(f"Unknown column '{query.order_by}' for order_by")
+
+    def sorted_index_for(column, build=False):
+        key = SORT_KEYS[column_kind(columns, column)]
+        if (build or entry.has_sorted_index(column, key)
+                or column in entry.index_spec or column in sorted_columns):
+            return entry.sorted_index(column, key)
+        return None
+
+    plan = {'strategy': 'scan', 'column': None, 'sort': None}
+    candidates = None
+    ordered = False
+
+    # 1. Hash index on an equality condition, unique indexes first
+    hashed = [
+        (not entry.index_spec[condition.column], condition.op != 'eq', i, condition)
+        for i, condition in enumerate(query.conditions)
+        if condition.column in entry.index_spec and condition.hash_keys() is not None
+    ]
+    if hashed:
+        condition = min(hashed)[-1]
+        positions = set()
+        for value in condition.hash_keys():
+            positions.update(entry.positions(condition.column, value))
+        candidates = sorted(positions)
+        plan.update(strategy='hash_index', column=condition.column)
+
+    # 2. Sorted index on a range or prefix condition
+    if candidates is None:
+        for condition in query.conditions:
+            if condition.op not in RANGE_OPERATORS:
+                continue
+            if condition.op == 'prefix' and condition.kind != 'text':
+                continue
+            index = sorted_index_for(condition.column, build=condition.column == query.order_by)
+            if index is not None:
+                descending = query.descending and condition.column == query.order_by
+                candidates = index.range(reverse=descending, **condition.bounds())
+                ordered = condition.column == query.order_by
+                plan.update(strategy='sorted_index', column=condition.column)
+                break
+
+    # 3. Walk the sorted index of the order column
+    if candidates is None and query.order_by is not None:
+        index = sorted_index_for(query.order_by, build=True)
+        candidates = index.range(reverse=query.descending)
+        ordered = True
+        plan.update(strategy='ordered_index', column=query.order_by)
+
+    if candidates is None:
+        candidates = range(len(entry.rows))
+
+    examined = 0
+
+    def walk():
+        nonlocal examined
+        for position in candidates:
+            examined += 1
+            yield entry.rows[position]
+
+    rows = (row for row in walk() if all(c.matches(row) for c in query.conditions))
+
+    if query.order_by is not None and not ordered:
+        key = SORT_KEYS[column_kind(columns, query.order_by)]
+        rows = sorted(rows, key=lambda row: key(row.get(query.order_by)),
+                      reverse=query.descending)
+        plan['sort'] = 'memory'
+    elif ordered:
+        plan['sort'] = 'index'
+
+    data = []
+    for row in rows:
+        data.append(row)
+        if query.limit is not None and len(data) >= query.limit:
+            break
+
+    plan['conditions'] = [condition.describe() for condition in query.conditions]
+    plan['rows_examined'] = examined
+    return data, plan
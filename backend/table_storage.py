@@ -0,0 +1,573 @@
+"""
+Storage engines the backend keeps its tables in.
+
+TableCache loads tables from a storage engine and app.py writes to it;
+storage_settings.engine in database_config.json picks the engine:
+
+- "csv" (the default): one CSV file per table at its TABLE_PATHS path,
+  with the per-table write-ahead logs of "wal" mode (see table_log).
+- "sqlite": every table in one SQLite database (storage_settings.sqlite_path
+  under the database directory) in WAL journal mode. Tables are created
+  with the columns of the rows written to them, all TEXT holding the same
+  strings as the CSV cells, so rows read back exactly as from the CSV
+  files. The primary key, unique columns and "indexes" of
+  table_schemas.json become SQLite indexes. Each write is one transaction.
+
+Both engines offer the same methods:
+
+    state(table_name)              compared against cached entries; state[0]
+                                   is None while the table does not exist
+    load(table_name, state)        (fieldnames, rows, log entries to replay)
+    stream(table_name)             (fieldnames, row iterator) or None
+    get(table_name, column, value) rows where column == value
+    find(table_name, conditions)   rows matching every {column: value}
+    insert / update / delete       one row change, as bulk() of one entry
+    bulk(table_name, log_entries)  table_log entries applied as one write
+    replace(table_name, fieldnames, rows)  the whole table
+    stats()                        read/write counters (see StorageCounters)
+
+Callers hold the table's write lock around writes. Run this module to
+copy the tables between the CSV files and the SQLite database:
+
+    python table_storage.py import   # CSV files -> SQLite database
+    python table_storage.py export   # SQLite database -> CSV files
+"""
+
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager, nullcontext
+
+from table_cache import TableEntry, csv_row, stat_key, widened
+from table_index import DuplicateKeyError, build_index_columns
+from table_log import (append_entries, delete_entry, insert_entry, log_path, read_entries,
+                       remove_log, update_entry)
+
+# Seconds a SQLite write waits for another connection's transaction
+SQLITE_TIMEOUT = 30
+
+# Change stamp of each table, so every process sees the others' writes
+STATE_TABLE = '_table_state'
+
+
+def _quote(name):
+    """SQL identifier for a table or column name"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _matches(row, conditions):
+    return all(row.get(column) == str(value) for column, value in conditions.items())
+
+
+class StorageCounters:
+    """Reads and writes of each table, for a storage engine's stats()
+
+    Loads are timed, parsing included; streams count the rows iterated.
+    Writes are counted by kind: "append" (one row added to a CSV), "log"
+    (write-ahead log entries), "transaction" (a SQLite write) and
+    "rewrite" (the whole table written). Bytes are those of the CSV files
+    and logs read and written; SQLite tables count rows only.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _table(self, table_name):
+        counters = self._tables.get(table_name)
+        if counters is None:
+            counters = self._tables[table_name] = {
+                'loads': 0, 'load_seconds': 0.0, 'streams': 0, 'rows_read': 0, 'bytes_read': 0,
+                'writes': {}, 'write_seconds': 0.0, 'rows_written': 0, 'bytes_written': 0,
+            }
+        return counters
+
+    def loaded(self, table_name, rows, size, seconds):
+        with self._lock:
+            counters = self._table(table_name)
+            counters['loads'] += 1
+            counters['load_seconds'] += seconds
+            counters['rows_read'] += rows
+            counters['bytes_read'] += size
+
+    def streamed(self, table_name, rows, size):
+        with self._lock:
+            counters = self._table(table_name)
+            counters['streams'] += 1
+            counters['rows_read'] += rows
+            counters['bytes_read'] += size
+
+    def wrote(self, table_name, kind, rows, size, seconds):
+        with self._lock:
+            counters = self._table(table_name)
+            counters['writes'][kind] = counters['writes'].get(kind, 0) + 1
+            counters['write_seconds'] += seconds
+            counters['rows_written'] += rows
+            counters['bytes_written'] += size
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(counters, writes=dict(counters['writes']))
+                    for name, counters in self._tables.items()}
+
+
+def _size(state):
+    """Bytes of the files in a CsvStorage state"""
+    return sum(key[1] for key in state if key is not None)
+
+
+class CsvStorage:
+    """Tables as CSV files, with write-ahead logs when use_logs is set"""
+
+    name = 'csv'
+
+    def __init__(self, table_paths, use_logs=False):
+        self.table_paths = table_paths
+        self.use_logs = use_logs
+        self.counters = StorageCounters()
+
+    def state(self, table_name):
+        """(csv, log) (mtime_ns, size) of a table's files"""
+        file_path = self.table_paths[table_name]
+        log_state = stat_key(log_path(file_path)) if self.use_logs else None
+        return (stat_key(file_path), log_state)
+
+    def load(self, table_name, state=None):
+        """Parse a table's CSV, with the log entries to replay over it"""
+        started = time.perf_counter()
+        file_path = self.table_paths[table_name]
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            rows = list(reader)
+            fieldnames = reader.fieldnames or []
+        state = state or self.state(table_name)
+        log_entries = []
+        if self.use_logs and state[1] is not None:
+            log_entries = list(read_entries(file_path, state[0]))
+        self.counters.loaded(table_name, len(rows) + len(log_entries), _size(state),
+                             time.perf_counter() - started)
+        return fieldnames, rows, log_entries
+
+    def stream(self, table_name):
+        """(fieldnames, rows parsed as they are read), or None with a log to merge
+
+        The file is opened when iteration starts. Table files are only ever
+        replaced, never rewritten in place, so the open handle keeps reading
+        one consistent version.
+        """
+        file_path = self.table_paths[table_name]
+        if not file_path.exists() or (self.use_logs and log_path(file_path).exists()):
+            return None
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            fieldnames = csv.DictReader(f).fieldnames or []
+
+        def rows():
+            count = 0
+            with open(file_path, 'r', encoding='utf-8', newline='') as f:
+                try:
+                    for count, row in enumerate(csv.DictReader(f), 1):
+                        yield row
+                finally:
+                    self.counters.streamed(table_name, count, os.fstat(f.fileno()).st_size)
+        return fieldnames, rows()
+
+    def read(self, table_name):
+        """Current (fieldnames, rows) of a table, its log replayed; None if it has no file"""
+        entry = self._entry(table_name)
+        return (entry.fieldnames, entry.rows) if entry else None
+
+    def _entry(self, table_name):
+        if stat_key(self.table_paths[table_name]) is None:
+            return None
+        fieldnames, rows, log_entries = self.load(table_name)
+        entry = TableEntry(fieldnames, rows, None)
+        for log_entry in log_entries:
+            entry.apply(log_entry)
+        return entry
+
+    def get(self, table_name, column, value):
+        return self.find(table_name, {column: value})
+
+    def find(self, table_name, conditions):
+        """Rows matching every condition, read by a full scan of the table"""
+        entry = self._entry(table_name)
+        return [row for row in entry.rows if _matches(row, conditions)] if entry else []
+
+    def insert(self, table_name, fieldnames, record):
+        """Append one row, in the column order of fieldnames (the file's header)"""
+        started = time.perf_counter()
+        file_path = self.table_paths[table_name]
+        line = io.StringIO()
+        csv.DictWriter(line, fieldnames=fieldnames).writerow(record)
+        payload = line.getvalue().encode('utf-8')
+        with open(file_path, 'ab+') as f:
+            # Don't glue the new row onto a last line without a line break
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    payload = b'\r\n' + payload
+            f.write(payload)
+        self.counters.wrote(table_name, 'append', 1, len(payload), time.perf_counter() - started)
+
+    def update(self, table_name, column, key, row):
+        self.bulk(table_name, [update_entry(column, key, row)])
+
+    def delete(self, table_name, column, key):
+        self.bulk(table_name, [delete_entry(column, key)])
+
+    def bulk(self, table_name, log_entries):
+        """Append the entries to the table's log, or rewrite it without logs"""
+        file_path = self.table_paths[table_name]
+        if self.use_logs and stat_key(file_path) is not None:
+            started = time.perf_counter()
+            size = append_entries(file_path, log_entries, stat_key(file_path))
+            self.counters.wrote(table_name, 'log', len(log_entries), size,
+                                time.perf_counter() - started)
+            return
+        entry = self._entry(table_name) or TableEntry([], [], None)
+        for log_entry in log_entries:
+            entry.apply(log_entry)
+        self.replace(table_name, entry.fieldnames, entry.rows)
+
+    def replace(self, table_name, fieldnames, rows):
+        """Write the table to a temporary file that then replaces the CSV
+
+        A crash mid-write leaves the previous version intact. Any
+        write-ahead log is folded in by the rows written and removed.
+        """
+        started = time.perf_counter()
+        file_path = self.table_paths[table_name]
+        temp_path = file_path.with_name(f"{file_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(rows)
+                f.flush()
+                os.fsync(f.fileno())
+                size = os.fstat(f.fileno()).st_size
+            os.replace(temp_path, file_path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        remove_log(file_path)
+        self.counters.wrote(table_name, 'rewrite', len(rows), size, time.perf_counter() - started)
+
+    def tables(self):
+        """Names of the tables that have a file"""
+        return [name for name, path in self.table_paths.items() if path.exists()]
+
+    def stats(self):
+        """Per-table read and write counters (see StorageCounters)"""
+        return self.counters.stats()
+
+
+class SqliteStorage:
+    """Tables in one SQLite database, indexed as table_schemas.json declares
+
+    Rows keep the order they were inserted in (rowid order). A table's
+    state is ((stamp, None), None), stamp being the time in nanoseconds of
+    its last write as kept in STATE_TABLE, so other processes' writes are
+    seen like changed files are. Each thread has its own connection.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path, table_paths, schemas=None):
+        self.db_path = os.fspath(db_path)
+        self.table_paths = table_paths
+        # {table_name: {column: unique}}, as the cache indexes them
+        self.index_columns = build_index_columns(schemas or {})
+        self.counters = StorageCounters()
+        self._local = threading.local()
+        with self._write() as connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} "
+                               "(name TEXT PRIMARY KEY, stamp INTEGER NOT NULL)")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=SQLITE_TIMEOUT,
+                                     isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    def _write(self):
+        return _Transaction(self.connection)
+
+    def _columns(self, table_name, connection=None):
+        """Columns of a table in order, [] if it does not exist"""
+        cursor = (connection or self.connection).execute(f"PRAGMA table_info({_quote(table_name)})")
+        return [column[1] for column in cursor]
+
+    def state(self, table_name):
+        row = self.connection.execute(f"SELECT stamp FROM {STATE_TABLE} WHERE name = ?",
+                                      (table_name,)).fetchone()
+        return ((row[0], None) if row else None, None)
+
+    def load(self, table_name, state=None):
+        """All rows in one read transaction; no log entries"""
+        started = time.perf_counter()
+        connection = self.connection
+        connection.execute('BEGIN')
+        try:
+            fieldnames = self._columns(table_name)
+            cursor = connection.execute(f"SELECT * FROM {_quote(table_name)} ORDER BY rowid")
+            rows = [dict(zip(fieldnames, values)) for values in cursor]
+        finally:
+            connection.execute('COMMIT')
+        self.counters.loaded(table_name, len(rows), 0, time.perf_counter() - started)
+        return fieldnames, rows, []
+
+    def read(self, table_name):
+        """Current (fieldnames, rows) of a table, None if it does not exist"""
+        if self.state(table_name)[0] is None:
+            return None
+        return self.load(table_name)[:2]
+
+    def stream(self, table_name):
+        """(fieldnames, rows read as they are iterated), or None with no table
+
+        Iteration reads from its own connection inside one read transaction,
+        so it sees one consistent version of the table.
+        """
+        fieldnames = self._columns(table_name)
+        if not fieldnames:
+            return None
+
+        def rows():
+            count = 0
+            with closing(self._connect()) as connection:
+                connection.execute('BEGIN')
+                cursor = connection.execute(f"SELECT * FROM {_quote(table_name)} ORDER BY rowid")
+                names = [column[0] for column in cursor.description]
+                try:
+                    for count, values in enumerate(cursor, 1):
+                        yield dict(zip(names, values))
+                finally:
+                    self.counters.streamed(table_name, count, 0)
+                connection.execute('COMMIT')
+        return fieldnames, rows()
+
+    def get(self, table_name, column, value):
+        return self.find(table_name, {column: value})
+
+    def find(self, table_name, conditions):
+        """Rows matching every condition, through the indexes on their columns"""
+        fieldnames = self._columns(table_name)
+        if any(column not in fieldnames for column in conditions):
+            return []
+        where = ' AND '.join(f"{_quote(column)} = ?" for column in conditions) or '1'
+        cursor = self.connection.execute(
+            f"SELECT * FROM {_quote(table_name)} WHERE {where} ORDER BY rowid",
+            [str(value) for value in conditions.values()])
+        return [dict(zip(fieldnames, values)) for values in cursor]
+
+    def insert(self, table_name, fieldnames, record):
+        self.bulk(table_name, [insert_entry(csv_row(widened(fieldnames, record), record))])
+
+    def update(self, table_name, column, key, row):
+        self.bulk(table_name, [update_entry(column, key, row)])
+
+    def delete(self, table_name, column, key):
+        self.bulk(table_name, [delete_entry(column, key)])
+
+    def bulk(self, table_name, log_entries):
+        """Apply table_log entries in one transaction, as TableEntry.apply does
+
+        Inserts add any columns the table lacks; an update changes the
+        first row with its key, a delete every such row.
+        """
+        started = time.perf_counter()
+        with self._write() as connection:
+            columns = self._columns(table_name, connection)
+            table = _quote(table_name)
+            for log_entry in log_entries:
+                op = log_entry['op']
+                if op == 'insert':
+                    record = log_entry['record']
+                    if not columns:
+                        columns = self._create(connection, table_name, list(record))
+                    columns = self._widen(connection, table_name, columns, record)
+                    names = list(record)
+                    with _unique(table_name, record):
+                        connection.execute(
+                            f"INSERT INTO {table} ({', '.join(map(_quote, names))}) "
+                            f"VALUES ({', '.join('?' * len(names))})",
+                            [record[name] for name in names])
+                    continue
+                column, key = log_entry['column'], log_entry['key']
+                # Cell values are text, so a key of another type matches no row
+                if column not in columns or not isinstance(key, str):
+                    continue
+                if op == 'update':
+                    record = log_entry['record']
+                    columns = self._widen(connection, table_name, columns, record)
+                    assignments = ', '.join(f"{_quote(name)} = ?" for name in record)
+                    with _unique(table_name, record):
+                        connection.execute(
+                            f"UPDATE {table} SET {assignments} WHERE rowid = "
+                            f"(SELECT rowid FROM {table} WHERE {_quote(column)} = ? "
+                            f"ORDER BY rowid LIMIT 1)",
+                            list(record.values()) + [key])
+                elif op == 'delete':
+                    connection.execute(f"DELETE FROM {table} WHERE {_quote(column)} = ?", (key,))
+            self._touch(connection, table_name)
+        self.counters.wrote(table_name, 'transaction', len(log_entries), 0,
+                            time.perf_counter() - started)
+
+    def replace(self, table_name, fieldnames, rows):
+        """Recreate the table with these rows in one transaction"""
+        if not fieldnames:
+            raise ValueError(f"Table '{table_name}' needs at least one column")
+        started = time.perf_counter()
+        with self._write() as connection:
+            connection.execute(f"DROP TABLE IF EXISTS {_quote(table_name)}")
+            fieldnames = self._create(connection, table_name, fieldnames)
+            connection.executemany(
+                f"INSERT INTO {_quote(table_name)} VALUES ({', '.join('?' * len(fieldnames))})",
+                (tuple(csv_row(fieldnames, record).values()) for record in rows))
+            self._touch(connection, table_name)
+        self.counters.wrote(table_name, 'rewrite', len(rows), 0, time.perf_counter() - started)
+
+    def tables(self):
+        """Names of the tables the database holds"""
+        cursor = self.connection.execute(f"SELECT name FROM {STATE_TABLE} ORDER BY name")
+        return [name for (name,) in cursor if name in self.table_paths]
+
+    def stats(self):
+        """Per-table read and write counters (see StorageCounters)"""
+        return self.counters.stats()
+
+    def _create(self, connection, table_name, fieldnames):
+        # A repeated column name means its first occurrence, as in csv_row
+        fieldnames = list(dict.fromkeys(fieldnames))
+        definitions = ', '.join(f"{_quote(name)} TEXT NOT NULL DEFAULT ''" for name in fieldnames)
+        connection.execute(f"CREATE TABLE {_quote(table_name)} ({definitions})")
+        for column in fieldnames:
+            self._index(connection, table_name, column)
+        return fieldnames
+
+    def _widen(self, connection, table_name, columns, record):
+        """Add the columns of record the table lacks; returns all columns"""
+        new_columns = [name for name in record if name not in columns]
+        for name in new_columns:
+            connection.execute(f"ALTER TABLE {_quote(table_name)} "
+                               f"ADD COLUMN {_quote(name)} TEXT NOT NULL DEFAULT ''")
+            self._index(connection, table_name, name)
+        return columns + new_columns
+
+    def _index(self, connection, table_name, column):
+        """Create the schema's index on a column, if it has one
+
+        A unique column whose rows already repeat a value gets a plain
+        index instead; the backend checks unique columns itself before
+        every insert, as with CSV storage.
+        """
+        unique = self.index_columns.get(table_name, {}).get(column)
+        if unique is None:
+            return
+        name = _quote(f"{table_name}__{column}")
+        on = f"{_quote(table_name)} ({_quote(column)})"
+        if unique:
+            connection.execute('SAVEPOINT unique_index')
+            try:
+                connection.execute(f"CREATE UNIQUE INDEX {name} ON {on}")
+                connection.execute('RELEASE unique_index')
+                return
+            except sqlite3.IntegrityError:
+                connection.execute('ROLLBACK TO unique_index')
+                connection.execute('RELEASE unique_index')
+        connection.execute(f"CREATE INDEX {name} ON {on}")
+
+    def _touch(self, connection, table_name):
+        """Give a table a new change stamp, later than its last one"""
+        row = connection.execute(f"SELECT stamp FROM {STATE_TABLE} WHERE name = ?",
+                                 (table_name,)).fetchone()
+        stamp = max(time.time_ns(), row[0] + 1 if row else 0)
+        connection.execute(f"INSERT OR REPLACE INTO {STATE_TABLE} (name, stamp) VALUES (?, ?)",
+                           (table_name, stamp))
+
+
+@contextmanager
+def _unique(table_name, record):
+    """Turn a unique index violation writing record into DuplicateKeyError"""
+    try:
+        yield
+    except sqlite3.IntegrityError as e:
+        if 'UNIQUE' not in str(e):
+            raise
+        column = str(e).rsplit('.', 1)[-1]
+        raise DuplicateKeyError(table_name, column, record.get(column)) from None
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on an exception"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+def copy_tables(source, target, locks=None):
+    """Copy every table source has into target
+
+    Yields (table_name, rows, seconds) as each table is copied, under the
+    table's write lock when given a TableLocks.
+    """
+    for table_name in source.tables():
+        started = time.perf_counter()
+        with locks.write(table_name) if locks else nullcontext():
+            table = source.read(table_name)
+            if table is None:
+                continue
+            fieldnames, rows = table
+            target.replace(table_name, fieldnames, rows)
+        yield table_name, len(rows), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Copy the tables between the CSV files and the SQLite database')
+    parser.add_argument('command', choices=['import', 'export'],
+                        help='import: CSV files -> SQLite, export: SQLite -> CSV files')
+    parser.add_argument('--sqlite', help='SQLite database (default: storage_settings.sqlite_path)')
+    args = parser.parse_args()
+
+    # The backend's table paths, schemas and cross-process locks
+    import app
+
+    csv_storage = CsvStorage(app.TABLE_PATHS, use_logs=True)
+    sqlite_storage = SqliteStorage(args.sqlite or app.SQLITE_PATH, app.TABLE_PATHS,
+                                   app.TABLE_SCHEMAS)
+    if args.command == 'import':
+        source, target = csv_storage, sqlite_storage
+    else:
+        source, target = sqlite_storage, csv_storage
+
+    total = 0
+    for table_name, rows, seconds in copy_tables(source, target, app.table_locks):
+        print(f"✅ {table_name}: {rows:,} rows in {seconds:.2f}s")
+        total += rows
+    print(f"{total:,} rows {'imported into' if args.command == 'import' else 'exported from'} "
+          f"{sqlite_storage.db_path}")
+
+
+if __name__ == '__main__':
+    main()
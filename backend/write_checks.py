@@ -0,0 +1,228 @@
+"""
+Checks of the backend's write paths, run against a temporary copy of a database.
+
+    python write_checks.py --db ../bench_db
+    python write_checks.py --only batch --engine sqlite
+    python write_checks.py --only concurrent --threads 16 --writes 50
+
+The database directory is copied and the app imported with
+PRESCRIPCARE_DATABASE_DIR pointing at the copy, so the checks never touch
+the original. --engine and --mode override the copy's storage_settings to
+check another write path. Each check drives the API through Flask's test
+client, then drops the table cache and reads back what reached the
+storage engine. Exits non-zero if a check fails.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent
+DEFAULT_DATABASE_DIR = BASE_DIR / 'database'
+
+
+def configure_storage(database_dir, engine=None, mode=None):
+    """Override storage_settings in a database copy's config"""
+    config_path = database_dir / 'config' / 'database_config.json'
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    storage = config.setdefault('storage_settings', {})
+    if engine:
+        storage['engine'] = engine
+    if mode:
+        storage['mode'] = mode
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+
+def stored_rows(app_module, client, table_name, key_column):
+    """{key: row} of a table as read back from storage, not from the cache"""
+    app_module.table_cache.invalidate(table_name)
+    response = client.get(f"/api/tables/{table_name}")
+    return {row[key_column]: row for row in response.get_json()['data']}
+
+
+def check_batch(app_module, client, run_id, args):
+    """Malformed batch operations fail alone; the valid ones around them apply"""
+    operations = [
+        {'op': 'insert', 'record': {'user_id': f"{run_id}-a", 'email': 'a@check'}},
+        'not an operation',
+        ['not', 'an', 'operation'],
+        {'op': 'insert', 'record': 'not a record'},
+        {'op': 'update', 'key': f"{run_id}-a", 'record': ['not', 'a', 'record']},
+        {'op': 'rename', 'key': f"{run_id}-a"},
+        {'op': 'insert', 'record': {'user_id': f"{run_id}-b", 'email': 'b@check'}},
+        {'op': 'update', 'key': f"{run_id}-a", 'record': {'email': 'a2@check'}},
+        # A key deleted earlier in the batch is gone for the operations after it
+        {'op': 'delete', 'key': f"{run_id}-b"},
+        {'op': 'update', 'key': f"{run_id}-b", 'record': {'email': 'gone@check'}},
+        {'op': 'insert', 'record': {'user_id': f"{run_id}-b", 'email': 'b2@check'}},
+    ]
+    expected = ['inserted', 'error', 'error', 'error', 'error', 'error', 'inserted', 'updated',
+                'deleted', 'error', 'inserted']
+
+    response = client.post('/api/tables/authentication/batch', json=operations)
+    if response.status_code != 200:
+        return [f"batch answered {response.status_code}: {response.get_json()}"]
+    statuses = [result['status'] for result in response.get_json()['results']]
+    failures = []
+    if statuses != expected:
+        failures.append(f"statuses {statuses}, expected {expected}")
+
+    rows = stored_rows(app_module, client, 'authentication', 'user_id')
+    for key, email in ((f"{run_id}-a", 'a2@check'), (f"{run_id}-b", 'b2@check')):
+        if rows.get(key, {}).get('email') != email:
+            failures.append(f"{key} stored as {rows.get(key)}, expected email {email}")
+    return failures
+
+
+def check_import(app_module, client, run_id, args):
+    """A body malformed after its first table reports the table it did import"""
+    key = f"{run_id}-import"
+    body = json.dumps({'csv_progress': [{'user_id': key, 'pending_dose': '3',
+                                         'updated_at': '2099-01-01 00:00:00'}]})
+    response = client.post('/api/import-from-localstorage', data=body[:-1] + ', "csv_info": [{',
+                           content_type='application/json')
+    payload = response.get_json()
+    failures = []
+    if response.status_code != 400 or payload.get('success'):
+        failures.append(f"malformed body answered {response.status_code}: {payload}")
+    if payload.get('results', {}).get('progress', {}).get('status') is None:
+        failures.append(f"results do not list the imported progress table: {payload}")
+    if key not in stored_rows(app_module, client, 'progress', 'user_id'):
+        failures.append(f"{key} was not imported")
+    return failures
+
+
+def write_worker(client, run_id, worker, writes):
+    """Insert a progress row, then update it writes times; returns the failed calls"""
+    key = f"{run_id}-w{worker}"
+    errors = []
+    response = client.post('/api/tables/progress', json={'user_id': key, 'completed_dose': '0'})
+    if response.status_code != 200:
+        errors.append(f"insert {key}: {response.status_code}")
+    for n in range(1, writes + 1):
+        response = client.put(f"/api/tables/progress/{key}", json={'completed_dose': str(n)})
+        if response.status_code != 200:
+            errors.append(f"update {key} to {n}: {response.status_code}")
+    return errors
+
+
+def process_worker(database_dir, run_id, worker, writes):
+    """write_worker in a process of its own, as a separate server worker would run"""
+    os.environ['PRESCRIPCARE_DATABASE_DIR'] = str(database_dir)
+    import app as app_module
+    return write_worker(app_module.app.test_client(), run_id, worker, writes)
+
+
+def lost_updates(app_module, client, run_id, workers, writes):
+    """Rows of write_worker missing or not at their last update"""
+    rows = stored_rows(app_module, client, 'progress', 'user_id')
+    failures = []
+    for worker in range(workers):
+        key = f"{run_id}-w{worker}"
+        value = rows.get(key, {}).get('completed_dose')
+        if value != str(writes):
+            failures.append(f"{key}: completed_dose {value}, expected {writes}")
+    return failures
+
+
+def check_concurrent(app_module, client, run_id, args):
+    """Parallel writers lose no update, and readers meanwhile never see a partial table"""
+    run_id = f"{run_id}-t"
+    done = threading.Event()
+    failures = []
+
+    def reader():
+        reader_client = app_module.app.test_client()
+        seen = 0
+        while not done.is_set():
+            response = reader_client.get('/api/tables/progress')
+            if response.status_code != 200:
+                failures.append(f"read during writes: {response.status_code}")
+                return
+            ours = sum(1 for row in response.get_json()['data'] if row['user_id'].startswith(run_id))
+            if ours < seen:
+                failures.append(f"a read saw {ours} of the writers' rows after one saw {seen}")
+                return
+            seen = ours
+
+    def writer(worker):
+        failures.extend(write_worker(app_module.app.test_client(), run_id, worker, args.writes))
+
+    threads = [threading.Thread(target=reader)]
+    threads += [threading.Thread(target=writer, args=(worker,)) for worker in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads[1:]:
+        thread.join()
+    done.set()
+    threads[0].join()
+    return failures + lost_updates(app_module, client, run_id, args.threads, args.writes)
+
+
+def check_processes(app_module, client, run_id, args):
+    """Writers in separate processes, sharing the tables through the file locks"""
+    run_id = f"{run_id}-p"
+    database_dir = os.environ['PRESCRIPCARE_DATABASE_DIR']
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.processes) as pool:
+        results = pool.starmap(process_worker, [(database_dir, run_id, worker, args.writes)
+                                                for worker in range(args.processes)])
+    failures = [error for errors in results for error in errors]
+    return failures + lost_updates(app_module, client, run_id, args.processes, args.writes)
+
+
+CHECKS = {
+    'batch': check_batch,
+    'import': check_import,
+    'concurrent': check_concurrent,
+    'processes': check_processes,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the backend write paths on a copy of a database')
+    parser.add_argument('--db', default=str(DEFAULT_DATABASE_DIR), help='Database directory to copy')
+    parser.add_argument('--only', choices=sorted(CHECKS), action='append',
+                        help='Run only this check (repeatable)')
+    parser.add_argument('--engine', choices=['csv', 'sqlite'], help='Storage engine to check')
+    parser.add_argument('--mode', choices=['direct', 'wal'], help='CSV write mode to check')
+    parser.add_argument('--threads', type=int, default=8, help='Writer threads of the concurrent check')
+    parser.add_argument('--processes', type=int, default=4, help='Writer processes of the processes check')
+    parser.add_argument('--writes', type=int, default=25, help='Updates per writer')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='prescripcare_checks_') as temp_dir:
+        database_dir = Path(temp_dir) / 'database'
+        shutil.copytree(args.db, database_dir, ignore=shutil.ignore_patterns('*.lock', 'logs'))
+        configure_storage(database_dir, args.engine, args.mode)
+        os.environ['PRESCRIPCARE_DATABASE_DIR'] = str(database_dir)
+        import app as app_module
+
+        client = app_module.app.test_client()
+        run_id = f"check-{uuid.uuid4().hex[:8]}"
+        failed = 0
+        for name in args.only or CHECKS:
+            started = time.perf_counter()
+            failures = CHECKS[name](app_module, client, run_id, args)
+            seconds = time.perf_counter() - started
+            print(f"{'FAIL' if failures else 'ok  '} {name} ({seconds:.2f}s)")
+            for failure in failures:
+                print(f"     {failure}")
+            failed += bool(failures)
+
+    print(f"{len(args.only or CHECKS) - failed} passed, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,460 @@
+"""
+Adherence analytics over dose_events, for database_utils.py adherence.
+
+AdherenceAnalytics.refresh() reads the dose events appended to
+user_data/dose_events.csv since the last refresh and materializes, under
+analytics/:
+
+- adherence_daily: doses per user, medication and day, by status
+- adherence_weekly: the same per user and week (weeks start on Monday)
+- medication_adherence: totals, rates and streaks per user and medication
+- adherence_summaries: totals, rates and streaks per user
+
+It also brings the progress table's counters up to date. Doses on days
+up to the as-of date (today by default) count as completed_dose if taken
+or partially taken, and as pending_dose if missed, skipped or snoozed.
+upcoming_dose counts the doses scheduled after the as-of date, and
+continue_dose the prescriptions running on it.
+
+Only the daily rollup is carried from one refresh to the next. New events
+are grouped by (user, medication, day) a chunk at a time and added into
+it, and the other tables are group-bys of it. A day is adherent when
+every dose scheduled on it was taken or partially taken. A streak is a
+run of adherent days one after another; the current streak is the one
+ending on the last tracked day.
+
+The watermark in analytics/adherence_state.json records how many bytes of
+dose_events.csv have been processed and their CRC-32. As with the table
+manifest, when the file has only been appended to since, only the bytes
+after the watermark are parsed; otherwise everything is recomputed. Each
+table is written to a temporary file that then replaces it, holding the
+<table>.csv.lock file lock the backend takes to write (CSV storage).
+"""
+
+import csv
+import json
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from table_manifest import BLOCK_SIZE, prefix_checksum
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+STATE_NAME = 'adherence_state.json'
+FORMAT_VERSION = 1
+STATUSES = ['taken', 'partial', 'missed', 'skipped', 'snoozed']
+STATUS_COLUMNS = [f"{status}_doses" for status in STATUSES]
+COUNT_COLUMNS = ['total_doses'] + STATUS_COLUMNS
+# Statuses progress counts as completed_dose; the others are pending_dose
+COMPLETED = ['taken_doses', 'partial_doses']
+PROGRESS_COUNTERS = ['pending_dose', 'continue_dose', 'upcoming_dose', 'completed_dose']
+# Dose events parsed and grouped at a time
+EVENT_CHUNK_ROWS = 500000
+EVENT_COLUMNS = ['user_id', 'medication_id', 'scheduled_datetime', 'status']
+
+
+@contextmanager
+def _table_lock(file_path):
+    """Hold the exclusive file lock the backend's writers take on a table"""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(file_path.with_name(file_path.name + '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _replace(file_path, write):
+    """Call write(temp_path), then move the temporary file over file_path"""
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = file_path.with_name(f"{file_path.name}.{os.getpid()}.tmp")
+    try:
+        write(temp_path)
+        os.replace(temp_path, file_path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def _stat(file_path):
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def records_end(file_path, start, size):
+    """Offset just past the last complete record in bytes start to size
+
+    start must be at a record boundary. Line breaks inside quoted fields
+    don't end a record; a last line without a line break (still being
+    written) is left out.
+    """
+    end, inside, position = start, False, start
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        while position < size:
+            block = f.read(min(BLOCK_SIZE, size - position))
+            if not block:
+                break
+            # Parts alternate between outside and inside quotes
+            parts = block.split(b'"') if b'"' in block else [block]
+            offset = 0
+            for i, part in enumerate(parts):
+                if (i % 2 == 0) != inside:
+                    newline = part.rfind(b'\n')
+                    if newline >= 0:
+                        end = position + offset + newline + 1
+                offset += len(part) + 1
+            inside ^= (len(parts) - 1) % 2 == 1
+            position += len(block)
+    return end
+
+
+class _Segment:
+    """Bytes start to end of a file, read by pandas, with their CRC-32"""
+
+    def __init__(self, f, start, end, checksum):
+        self.f = f
+        self.left = end - start
+        self.checksum = checksum
+        f.seek(start)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.left:
+            size = self.left
+        data = self.f.read(size)
+        self.left -= len(data)
+        self.checksum = zlib.crc32(data, self.checksum)
+        return data
+
+
+def _daily_counts(chunk):
+    """Doses per (user_id, medication_id, date) by status, of a chunk of events
+
+    Events without a valid scheduled date or status are dropped.
+    """
+    days = pd.to_datetime(chunk['scheduled_datetime'].str.slice(0, 10),
+                          format='%Y-%m-%d', errors='coerce')
+    codes = pd.Categorical(chunk['status'].str.strip().str.lower(), categories=STATUSES).codes
+    valid = (days.notna().to_numpy() & (codes >= 0)
+             & (chunk['user_id'] != '').to_numpy() & (chunk['medication_id'] != '').to_numpy())
+    counts = pd.DataFrame(np.eye(len(STATUSES), dtype=np.int64)[codes[valid]],
+                          columns=STATUS_COLUMNS)
+    counts['user_id'] = chunk['user_id'].to_numpy()[valid]
+    counts['medication_id'] = chunk['medication_id'].to_numpy()[valid]
+    counts['date'] = days.to_numpy()[valid]
+    grouped = counts.groupby(['user_id', 'medication_id', 'date'], sort=False).sum()
+    return grouped, int((~valid).sum())
+
+
+def _streaks(keys, days, adherent):
+    """Streak (adherent days in a row) at each row, rows sorted by key then day"""
+    count = len(days)
+    starts = np.ones(count, dtype=bool)
+    if count:
+        starts[1:] = (keys[1:] != keys[:-1]) | (days[1:] != days[:-1] + 1) | ~adherent[:-1]
+    run_start = np.maximum.accumulate(np.where(starts, np.arange(count), 0))
+    return np.where(adherent, np.arange(count) - run_start + 1, 0)
+
+
+def _summarize(daily, keys):
+    """Totals, rates, dates and streaks per keys of a daily table
+
+    daily has a row per keys and date, sorted by them.
+    """
+    adherent = (daily[COMPLETED].sum(axis=1) == daily['total_doses']).to_numpy()
+    group_codes = daily.groupby(keys, sort=False).ngroup().to_numpy()
+    days = daily['date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    frame = daily[keys + COUNT_COLUMNS + ['date']].assign(
+        adherent_days=adherent.astype(np.int64), streak=_streaks(group_codes, days, adherent))
+    grouped = frame.groupby(keys, sort=False)
+    summary = grouped[COUNT_COLUMNS + ['adherent_days']].sum()
+    summary['days_tracked'] = grouped.size()
+    summary['first_dose_date'] = grouped['date'].min().dt.strftime('%Y-%m-%d')
+    summary['last_dose_date'] = grouped['date'].max().dt.strftime('%Y-%m-%d')
+    summary['current_streak_days'] = grouped['streak'].last()
+    summary['longest_streak_days'] = grouped['streak'].max()
+    _add_rates(summary)
+    return summary.reset_index()
+
+
+def _add_rates(table):
+    total = table['total_doses']
+    for status in ('taken', 'missed', 'skipped'):
+        table[f"{status}_rate"] = (table[f"{status}_doses"] / total).round(4)
+    table['adherence_percentage'] = (table[COMPLETED].sum(axis=1) * 100 / total).round(1)
+
+
+class AdherenceAnalytics:
+    """Adherence tables of a database directory, refreshed from its dose events"""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.events_path = self.db_path / 'user_data' / 'dose_events.csv'
+        self.prescription_path = self.db_path / 'core_tables' / 'prescription.csv'
+        self.progress_path = self.db_path / 'core_tables' / 'progress.csv'
+        self.analytics_path = self.db_path / 'analytics'
+        self.state_path = self.analytics_path / STATE_NAME
+
+    def table_path(self, table_name):
+        return self.analytics_path / f"{table_name}.csv"
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return state if state.get('format') == FORMAT_VERSION else {}
+
+    def _save_state(self, state):
+        def write(temp_path):
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(dict(state, format=FORMAT_VERSION), f, indent=1)
+        _replace(self.state_path, write)
+
+    def _resume_offset(self, state, columns, events_stat):
+        """(offset, checksum) to carry on parsing from, (0, 0) to start over"""
+        watermark = state.get('watermark')
+        if not watermark or watermark.get('columns') != columns:
+            return 0, 0
+        # The daily rollup must be the one written with this watermark
+        if state.get('daily') != _stat(self.table_path('adherence_daily')):
+            return 0, 0
+        offset = watermark['offset']
+        if not 0 < offset <= events_stat[0] \
+                or prefix_checksum(self.events_path, offset) != watermark['checksum']:
+            return 0, 0
+        return offset, watermark['checksum']
+
+    def refresh(self, full=False, as_of=None, update_progress=True):
+        """Fold new dose events into the analytics tables
+
+        full recomputes everything from the first event. Returns counters
+        of the work done; 'up_to_date' when there was nothing new.
+        """
+        started = time.perf_counter()
+        as_of = as_of or date.today()
+        if not self.events_path.exists():
+            raise FileNotFoundError(f"No dose events at {self.events_path}")
+
+        with open(self.events_path, 'r', encoding='utf-8', newline='') as f:
+            columns = next(csv.reader(f), [])
+        missing = [column for column in EVENT_COLUMNS if column not in columns]
+        if missing:
+            raise ValueError(f"dose_events has no {', '.join(missing)} column")
+
+        state = {} if full else self._load_state()
+        events_stat = _stat(self.events_path)
+        if state.get('complete') and state.get('events') == events_stat \
+                and state.get('as_of') == as_of.isoformat() \
+                and state.get('daily') == _stat(self.table_path('adherence_daily')):
+            return {'up_to_date': True, 'new_events': 0, 'seconds': time.perf_counter() - started}
+
+        offset, checksum = self._resume_offset(state, columns, events_stat)
+        end = records_end(self.events_path, offset, events_stat[0])
+        new_daily, events, dropped, checksum = self._read_events(columns, offset, end, checksum)
+
+        daily = new_daily
+        if offset:
+            daily = pd.concat([self._load_daily(), new_daily])
+            daily = daily.groupby(['user_id', 'medication_id', 'date'], sort=False).sum()
+        daily = daily.reset_index()
+        daily['total_doses'] = daily[STATUS_COLUMNS].sum(axis=1)
+        daily = daily.sort_values(['user_id', 'medication_id', 'date'], ignore_index=True)
+
+        self._write('adherence_daily', daily.assign(date=daily['date'].dt.strftime('%Y-%m-%d')),
+                    ['user_id', 'medication_id', 'date'] + COUNT_COLUMNS)
+        state = {
+            'watermark': {'offset': end, 'checksum': checksum, 'columns': columns,
+                          'events': (state['watermark']['events'] if offset else 0) + events},
+            'events': events_stat if end == events_stat[0] else None,
+            'daily': _stat(self.table_path('adherence_daily')),
+            'as_of': as_of.isoformat(),
+            'complete': False,
+        }
+        self._save_state(state)
+
+        stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        medications = _summarize(daily, ['user_id', 'medication_id'])
+        user_daily = daily.groupby(['user_id', 'date'], sort=True)[COUNT_COLUMNS].sum().reset_index()
+        summaries = _summarize(user_daily, ['user_id'])
+        weekly = self._weekly(user_daily)
+        summary_columns = COUNT_COLUMNS + ['taken_rate', 'missed_rate', 'skipped_rate',
+                                           'adherence_percentage', 'days_tracked', 'adherent_days',
+                                           'current_streak_days', 'longest_streak_days',
+                                           'first_dose_date', 'last_dose_date', 'updated_at']
+        self._write('medication_adherence', medications.assign(updated_at=stamp),
+                    ['user_id', 'medication_id'] + summary_columns)
+        self._write('adherence_summaries', summaries.assign(updated_at=stamp),
+                    ['user_id'] + summary_columns)
+        self._write('adherence_weekly', weekly,
+                    ['user_id', 'week_start'] + COUNT_COLUMNS
+                    + ['adherence_percentage', 'days_tracked', 'adherent_days'])
+
+        progress = None
+        if update_progress:
+            progress = self.update_progress(user_daily, as_of, stamp)
+
+        state['complete'] = True
+        self._save_state(state)
+        return {
+            'up_to_date': False,
+            'full': not offset,
+            'new_events': events,
+            'dropped_events': dropped,
+            'bytes_read': end - offset,
+            'total_events': state['watermark']['events'],
+            'users': len(summaries),
+            'medications': len(medications),
+            'daily_rows': len(daily),
+            'weekly_rows': len(weekly),
+            'progress': progress,
+            'seconds': time.perf_counter() - started,
+        }
+
+    def _read_events(self, columns, start, end, checksum):
+        """Daily counts of the events in bytes start to end of dose_events.csv
+
+        Returns (counts, events read, events dropped, CRC-32 of the file
+        up to end).
+        """
+        parts, events, dropped = [], 0, 0
+        with open(self.events_path, 'rb') as f:
+            segment = _Segment(f, start, end, checksum)
+            if end > start:
+                header = {'header': 0} if start == 0 else {'header': None, 'names': columns}
+                reader = pd.read_csv(segment, usecols=EVENT_COLUMNS, dtype=str,
+                                     keep_default_na=False, chunksize=EVENT_CHUNK_ROWS,
+                                     encoding='utf-8', **header)
+                for chunk in reader:
+                    counts, bad = _daily_counts(chunk)
+                    parts.append(counts)
+                    events += len(chunk)
+                    dropped += bad
+            # Whatever pandas did not need to read still counts in the checksum
+            while segment.read(BLOCK_SIZE):
+                pass
+        if not parts:
+            empty = pd.DataFrame(columns=['user_id', 'medication_id', 'date'] + STATUS_COLUMNS)
+            empty = empty.astype({column: np.int64 for column in STATUS_COLUMNS})
+            empty['date'] = pd.to_datetime(empty['date'])
+            return empty.set_index(['user_id', 'medication_id', 'date']), 0, 0, segment.checksum
+        counts = pd.concat(parts)
+        if len(parts) > 1:
+            counts = counts.groupby(level=[0, 1, 2], sort=False).sum()
+        return counts, events, dropped, segment.checksum
+
+    def _load_daily(self):
+        daily = pd.read_csv(self.table_path('adherence_daily'),
+                            dtype={'user_id': str, 'medication_id': str, 'date': str},
+                            keep_default_na=False)
+        daily['date'] = pd.to_datetime(daily['date'], format='%Y-%m-%d')
+        return daily.set_index(['user_id', 'medication_id', 'date'])[STATUS_COLUMNS]
+
+    def _weekly(self, user_daily):
+        adherent = user_daily[COMPLETED].sum(axis=1) == user_daily['total_doses']
+        week_start = user_daily['date'] - pd.to_timedelta(user_daily['date'].dt.weekday, unit='D')
+        frame = user_daily.assign(week_start=week_start, adherent_days=adherent.astype(np.int64))
+        grouped = frame.groupby(['user_id', 'week_start'], sort=True)
+        weekly = grouped[COUNT_COLUMNS + ['adherent_days']].sum()
+        weekly['days_tracked'] = grouped.size()
+        weekly['adherence_percentage'] = (weekly[COMPLETED].sum(axis=1) * 100
+                                          / weekly['total_doses']).round(1)
+        weekly = weekly.reset_index()
+        weekly['week_start'] = weekly['week_start'].dt.strftime('%Y-%m-%d')
+        return weekly
+
+    def _write(self, table_name, table, columns):
+        file_path = self.table_path(table_name)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with _table_lock(file_path):
+            _replace(file_path, lambda temp_path: table.to_csv(temp_path, columns=columns,
+                                                               index=False))
+
+    def progress_counters(self, user_daily, as_of):
+        """{user_id: {counter: value}} of the progress table's dose counters"""
+        past = (user_daily['date'] <= pd.Timestamp(as_of)).to_numpy()
+        doses = user_daily.assign(
+            completed_dose=np.where(past, user_daily[COMPLETED].sum(axis=1), 0),
+            pending_dose=np.where(past, user_daily['total_doses'] - user_daily[COMPLETED].sum(axis=1), 0),
+            upcoming_dose=np.where(past, 0, user_daily['total_doses']),
+        ).groupby('user_id')[['pending_dose', 'upcoming_dose', 'completed_dose']].sum()
+
+        running = pd.Series(dtype=np.int64)
+        if self.prescription_path.exists():
+            prescriptions = pd.read_csv(self.prescription_path, dtype=str, keep_default_na=False,
+                                        usecols=lambda column: column in ('user_id', 'start_date',
+                                                                          'end_date'))
+            today = as_of.isoformat()
+            start = prescriptions.get('start_date', pd.Series('', index=prescriptions.index))
+            end = prescriptions.get('end_date', pd.Series('', index=prescriptions.index))
+            on = ((start == '') | (start <= today)) & ((end == '') | (end >= today))
+            running = prescriptions[on].groupby('user_id').size()
+
+        counters = doses.join(running.rename('continue_dose'), how='outer').fillna(0).astype(np.int64)
+        return counters[PROGRESS_COUNTERS].to_dict('index')
+
+    def update_progress(self, user_daily, as_of, stamp):
+        """Write the dose counters into the progress table; returns rows changed
+
+        Users with events or prescriptions but no progress row get one.
+        The table is left alone while the backend has a write-ahead log
+        for it to fold in (returns None).
+        """
+        if not self.progress_path.exists() \
+                or self.progress_path.with_name(self.progress_path.name + '.wal').exists():
+            return None
+        counters = self.progress_counters(user_daily, as_of)
+
+        with _table_lock(self.progress_path):
+            with open(self.progress_path, 'r', encoding='utf-8', newline='') as f:
+                reader = csv.DictReader(f)
+                fieldnames = list(reader.fieldnames or ['user_id'])
+                rows = list(reader)
+            fieldnames += [column for column in PROGRESS_COUNTERS if column not in fieldnames]
+
+            changed, seen = 0, set()
+            for row in rows:
+                values = counters.get(row.get('user_id'))
+                if values is None:
+                    continue
+                seen.add(row['user_id'])
+                values = {column: str(value) for column, value in values.items()}
+                if any(row.get(column) != value for column, value in values.items()):
+                    row.update(values)
+                    if 'updated_at' in fieldnames:
+                        row['updated_at'] = stamp
+                    changed += 1
+            for user_id, values in counters.items():
+                if user_id not in seen:
+                    row = {'user_id': user_id, **{k: str(v) for k, v in values.items()}}
+                    row.update({column: stamp for column in ('created_at', 'updated_at')
+                                if column in fieldnames})
+                    rows.append(row)
+                    changed += 1
+            if not changed:
+                return 0
+
+            def write(temp_path):
+                with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=fieldnames, restval='')
+                    writer.writeheader()
+                    writer.writerows(rows)
+            _replace(self.progress_path, write)
+        return changed
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Timings of the database CLIs' operations, for backend/benchmark.py --cli.
+
+Runs each operation of PrescripCareDB (database_utils.py) and
+SimpleDBLoader (simple_loader.py) repeat times against a database
+directory and prints {operation: [seconds, ...]} as JSON. What the
+operations print themselves is swallowed. The first run of each
+operation is the cold one: list_tables and count_records start from
+whatever table manifest is there.
+
+    python benchmark_cli.py --db-path ./bench_db --table prescription --repeat 3
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import random
+import time
+
+from database_utils import PrescripCareDB
+from simple_loader import SimpleDBLoader
+
+
+def sample_user_id(db, seed):
+    """A user id from the authentication table, picked with seed"""
+    file_path = db.get_table_path('authentication')
+    if not file_path:
+        return ''
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        user_ids = [row['user_id'] for row in csv.DictReader(f)]
+    return random.Random(seed).choice(user_ids) if user_ids else ''
+
+
+def operations(db, loader, table_name, user_id):
+    """(name, function) of every operation timed"""
+    return [
+        ('simple_loader.list_tables', loader.list_tables),
+        ('simple_loader.search_table',
+         lambda: loader.search_table(table_name, 'user_id', user_id, limit=10)),
+        ('database_utils.list_tables', db.list_tables),
+        ('database_utils.count_records', lambda: db.count_records(table_name)),
+        ('database_utils.query_table',
+         lambda: db.query_table(table_name, [f"user_id={user_id}"], limit=10)),
+        ('database_utils.get_statistics', db.get_statistics),
+        ('database_utils.validate_table', lambda: db.validate_table(table_name)),
+    ]
+
+
+def run(db_path, table_name, repeat=3, seed=1):
+    """{operation: [seconds of each run]}"""
+    db = PrescripCareDB(db_path)
+    loader = SimpleDBLoader(db_path)
+    user_id = sample_user_id(db, seed)
+    timings = {}
+    for name, function in operations(db, loader, table_name, user_id):
+        timings[name] = []
+        for _ in range(repeat):
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                function()
+                timings[name].append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the database CLI operations')
+    parser.add_argument('--db-path', default='./database', help='Path to database directory')
+    parser.add_argument('--table', default='prescription', help='Table to search, query and validate')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each operation')
+    parser.add_argument('--seed', type=int, default=1, help='Seed picking the user searched for')
+    args = parser.parse_args()
+    print(json.dumps(run(args.db_path, args.table, args.repeat, args.seed)))
+
+
+if __name__ == '__main__':
+    main()
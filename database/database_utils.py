@@ -10,29 +10,53 @@ Usage:
     python database_utils.py load --table users
     python database_utils.py validate --all
     python database_utils.py query --table users --filter "account_status=active"
+    python database_utils.py query --table dose_events --filter status=missed --columns event_id,user_id --limit 10
     python database_utils.py export --table medications --format json
+    python database_utils.py validate --all --jobs 4
+    python database_utils.py adherence --as-of 2025-03-01
+
+Tables are read through a binary snapshot kept next to each CSV file (see
+table_snapshot.py); pass --no-snapshot to parse the CSV files directly.
 """
 
 import csv
+import io
 import json
 import os
 import sys
+import time
 import argparse
 import pandas as pd
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
 from pathlib import Path
 
+import table_snapshot
+import table_export
+from adherence import AdherenceAnalytics
+from table_manifest import TableManifest
+from table_query import TableQuery, parse_filter
+from table_validation import ErrorLog, TableValidator, split_ranges
+
 class PrescripCareDB:
-    def __init__(self, db_path="./database"):
+    def __init__(self, db_path="./database", use_snapshots=None):
         self.db_path = Path(db_path)
         self.config_path = self.db_path / "config"
         self.core_tables_path = self.db_path / "core_tables"
         self.master_data_path = self.db_path / "master_data"
         self.user_data_path = self.db_path / "user_data"
         self.analytics_path = self.db_path / "analytics"
+        self.manifest = TableManifest(self.db_path)
         
         # Load configuration
         self.config = self.load_config()
+        if use_snapshots is None:
+            use_snapshots = self.config.get('performance_settings', {}).get('snapshot_cache', True)
+        self.use_snapshots = use_snapshots
+        performance = self.config.get('performance_settings', {})
+        self.chunk_size = performance.get('chunk_size', 10000)
+        # Tables larger than this are validated in parallel pieces
+        self.split_bytes = int(performance.get('parallel_split_mb', 16) * 1024 * 1024)
         
     def load_config(self):
         """Load database configuration from JSON files"""
@@ -61,141 +85,266 @@ class PrescripCareDB:
                 return file_path
         return None
     
-    def load_table(self, table_name):
-        """Load a table from CSV file into a pandas DataFrame"""
+    def column_kinds(self, table_name):
+        """Snapshot storage kinds of a table's columns, from its schema"""
+        schemas = self.config.get('schemas', {}).get('table_schemas', {})
+        return table_snapshot.schema_kinds(schemas.get(table_name))
+    
+    def load_table(self, table_name, columns=None, verbose=True):
+        """Load a table from CSV file into a pandas DataFrame
+        
+        Reads the table's snapshot when it is up to date with the CSV and
+        rebuilds it otherwise. columns limits the load to those columns.
+        """
         file_path = self.get_table_path(table_name)
         if not file_path:
             raise FileNotFoundError(f"Table '{table_name}' not found")
         
         try:
-            df = pd.read_csv(file_path)
-            print(f"Loaded {len(df)} records from {table_name}")
+            if self.use_snapshots:
+                df, source = table_snapshot.load(file_path, self.column_kinds(table_name), columns)
+            else:
+                df, source = pd.read_csv(file_path), 'csv'
+                if columns is not None:
+                    df = df[list(columns)]
+            if verbose:
+                print(f"Loaded {len(df)} records from {table_name}"
+                      + (" (snapshot)" if source == 'snapshot' else ""))
             return df
         except Exception as e:
             print(f"Error loading table {table_name}: {e}")
             return None
     
-    def list_tables(self):
-        """List all available tables in the database"""
-        tables = []
+    def list_tables(self, jobs=1):
+        """List all available tables in the database
+        
+        Record counts and columns come from the table manifest; tables
+        changed since it was written are rescanned, in up to jobs processes.
+        seconds is the time a table's rescan took, None if it needed none.
+        """
+        file_paths = []
         for path in [self.core_tables_path, self.master_data_path, 
                      self.user_data_path, self.analytics_path]:
             if path.exists():
-                for file_path in path.glob("*.csv"):
-                    table_name = file_path.stem
-                    table_category = path.name
-                    tables.append({
-                        'name': table_name,
-                        'category': table_category,
-                        'path': str(file_path),
-                        'size': file_path.stat().st_size
-                    })
+                file_paths.extend(sorted(path.glob("*.csv")))
+        
+        def pool_map(function, *iterables):
+            with ProcessPoolExecutor(jobs) as pool:
+                return list(pool.map(function, *iterables))
+        
+        entries = self.manifest.refresh(file_paths, map_function=pool_map if jobs > 1 else map)
+        rescanned = set(self.manifest.rescanned)
+        tables = []
+        for file_path, entry in zip(file_paths, entries):
+            tables.append({
+                'name': file_path.stem,
+                'category': file_path.parent.name,
+                'path': str(file_path),
+                'size': entry['size'],
+                'records': entry['records'],
+                'columns': entry['columns'],
+                'seconds': entry.get('scan_seconds') if file_path in rescanned else None
+            })
         return tables
     
-    def validate_table(self, table_name):
-        """Validate a table against its schema"""
-        df = self.load_table(table_name)
-        if df is None:
-            return False
-        
-        print(f"Validating {table_name}...")
+    def validator(self, table_name):
+        """TableValidator for a table from its schema and data_validation.json"""
+        schemas = self.config.get('schemas', {}).get('table_schemas', {})
+        return TableValidator(table_name, schemas.get(table_name),
+                              self.config.get('validation', {}), self.config.get('data_format'))
+    
+    def table_ranges(self, file_path, jobs):
+        """Byte ranges a table is validated in: one per split_bytes, up to jobs"""
+        pieces = min(jobs, file_path.stat().st_size // self.split_bytes)
+        if pieces < 2:
+            return [None]
+        return split_ranges(file_path, pieces)
+    
+    def validate_table(self, table_name, log=None, jobs=1):
+        """Validate a table against its schema and data_validation.json
         
-        # Basic validation
-        validation_results = {
-            'total_records': len(df),
-            'columns': list(df.columns),
-            'null_counts': df.isnull().sum().to_dict(),
-            'data_types': df.dtypes.to_dict(),
-            'duplicates': df.duplicated().sum(),
-            'errors': []
-        }
+        The CSV is checked in performance_settings.chunk_size chunks (see
+        table_validation.py), and in up to jobs processes when it is large.
+        Errors go to the error_handling log file, or to log if given.
+        """
+        return self.validate_tables([table_name], jobs, log)[0]
+    
+    def validate_tables(self, table_names, jobs=1, log=None):
+        """Validate tables, spreading them and pieces of large ones over jobs processes
         
-        # Check for required fields if schema exists
-        if 'schemas' in self.config and table_name in self.config['schemas']['table_schemas']:
-            schema = self.config['schemas']['table_schemas'][table_name]
-            required_columns = [col for col, props in schema['columns'].items() 
-                              if props.get('required', False)]
+        Reports are printed in table order as each table completes, with
+        the seconds spent on it (summed over its pieces).
+        """
+        pool = ProcessPoolExecutor(jobs) if jobs > 1 else None
+        error_log = self.error_log() if log is None else None
+        try:
+            pending = []
+            for table_name in table_names:
+                file_path = self.get_table_path(table_name)
+                if not file_path:
+                    raise FileNotFoundError(f"Table '{table_name}' not found")
+                pieces = []
+                if pool is not None:
+                    pieces = [pool.submit(_scan_piece, self.db_path, self.use_snapshots,
+                                          table_name, byte_range)
+                              for byte_range in self.table_ranges(file_path, jobs)]
+                pending.append((table_name, file_path, pieces))
             
-            for col in required_columns:
-                if col in df.columns:
-                    null_count = df[col].isnull().sum()
-                    if null_count > 0:
-                        validation_results['errors'].append(
-                            f"Required column '{col}' has {null_count} null values"
-                        )
+            all_results = []
+            for table_name, file_path, pieces in pending:
+                print(f"Validating {table_name}...")
+                validator = self.validator(table_name)
+                started = time.perf_counter()
+                if pool is None:
+                    validation_results = validator.validate(file_path, self.chunk_size,
+                                                            log or error_log)
+                    seconds = time.perf_counter() - started
                 else:
-                    validation_results['errors'].append(
-                        f"Required column '{col}' is missing"
-                    )
-        
-        # Print validation summary
+                    parts, seconds = [], 0.0
+                    for piece in pieces:
+                        part, piece_seconds = piece.result()
+                        parts.append(part)
+                        seconds += piece_seconds
+                    started = time.perf_counter()
+                    validation_results = validator.merge(file_path, parts, self.chunk_size,
+                                                         log or error_log)
+                    seconds += time.perf_counter() - started
+                validation_results['seconds'] = seconds
+                validation_results['pieces'] = max(1, len(pieces))
+                self.print_validation(validation_results)
+                if len(table_names) > 1:
+                    print()
+                all_results.append(validation_results)
+            return all_results
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            if error_log is not None:
+                error_log.close()
+    
+    def print_validation(self, validation_results):
+        """Print the summary of a table's validation results"""
         print(f"  Total records: {validation_results['total_records']}")
         print(f"  Columns: {len(validation_results['columns'])}")
         print(f"  Duplicates: {validation_results['duplicates']}")
         
-        if validation_results['errors']:
-            print(f"  Errors: {len(validation_results['errors'])}")
+        if validation_results['error_count']:
+            print(f"  Errors: {validation_results['error_count']}")
             for error in validation_results['errors']:
                 print(f"    - {error}")
+            hidden = validation_results['error_count'] - len(validation_results['errors'])
+            if hidden > 0:
+                print(f"    ... and {hidden} more")
+            if validation_results['stopped']:
+                print("  Validation stopped early")
         else:
             print("  ✅ Validation passed")
         
-        return validation_results
+        pieces = validation_results.get('pieces', 1)
+        print(f"  Time: {validation_results['seconds']:.2f}s"
+              + (f" in {pieces} pieces" if pieces > 1 else ""))
     
-    def query_table(self, table_name, filters=None, limit=None):
-        """Query a table with optional filters"""
-        df = self.load_table(table_name)
-        if df is None:
+    def error_log(self):
+        """ErrorLog writing to error_handling.error_log_location"""
+        handling = self.config.get('validation', {}).get('error_handling', {})
+        location = handling.get('error_log_location', './logs/validation_errors.log')
+        return ErrorLog(self.db_path / location)
+    
+    def query_table(self, table_name, filters=None, limit=None, columns=None):
+        """Query a table with optional filters
+        
+        The CSV is streamed through a TableQuery: filters are tested as it
+        is read, only the columns asked for are kept and reading stops once
+        limit rows matched. Only the matching rows are parsed by pandas.
+        """
+        file_path = self.get_table_path(table_name)
+        if not file_path:
+            raise FileNotFoundError(f"Table '{table_name}' not found")
+        
+        # Simple filter format: column=value
+        predicates = []
+        for filter_expr in filters or []:
+            try:
+                predicates.append(parse_filter(filter_expr))
+                print(f"Applied filter: {filter_expr}")
+            except ValueError as e:
+                print(f"Error applying filter '{filter_expr}': {e}")
+        
+        try:
+            query = TableQuery(file_path, predicates, columns, limit or None)
+            matches = io.StringIO()
+            writer = csv.DictWriter(matches, fieldnames=query.columns)
+            writer.writeheader()
+            writer.writerows(query)
+        except Exception as e:
+            print(f"Error querying table {table_name}: {e}")
             return None
         
-        # Apply filters
-        if filters:
-            for filter_expr in filters:
-                try:
-                    # Simple filter format: column=value
-                    if '=' in filter_expr:
-                        column, value = filter_expr.split('=', 1)
-                        df = df[df[column.strip()] == value.strip()]
-                    print(f"Applied filter: {filter_expr}")
-                except Exception as e:
-                    print(f"Error applying filter '{filter_expr}': {e}")
+        matches.seek(0)
+        return pd.read_csv(matches)
+    
+    def export_table(self, table_name, format='csv', output_file=None, filters=None,
+                     columns=None, compression=None):
+        """Export a table to different formats
+        
+        json, ndjson, csv and parquet exports stream the table's rows to the
+        file as they are read (see table_export.py), typed by the table's
+        schema. xlsx still loads the whole table.
+        """
+        format = format.lower()
+        if format == 'xlsx':
+            return self.export_excel(table_name, output_file)
         
-        # Apply limit
-        if limit:
-            df = df.head(limit)
+        file_path = self.get_table_path(table_name)
+        if not file_path:
+            raise FileNotFoundError(f"Table '{table_name}' not found")
+        if not output_file:
+            output_file = table_export.default_output(table_name, format, compression)
         
-        return df
+        try:
+            predicates = [parse_filter(filter_expr) for filter_expr in filters or []]
+            schemas = self.config.get('schemas', {}).get('table_schemas', {})
+            stats = table_export.export_table(file_path, output_file, format, predicates,
+                                              columns, schemas.get(table_name), compression)
+            print(f"Exported {table_export.describe(stats)} to {output_file}")
+            return True
+        except Exception as e:
+            print(f"Error exporting table: {e}")
+            return False
     
-    def export_table(self, table_name, format='csv', output_file=None):
-        """Export a table to different formats"""
+    def export_excel(self, table_name, output_file=None):
+        """Export a whole table to an Excel workbook"""
         df = self.load_table(table_name)
         if df is None:
             return False
         
         if not output_file:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = f"{table_name}_export_{timestamp}.{format}"
+            output_file = f"{table_name}_export_{timestamp}.xlsx"
         
         try:
-            if format.lower() == 'json':
-                df.to_json(output_file, orient='records', indent=2)
-            elif format.lower() == 'xlsx':
-                df.to_excel(output_file, index=False)
-            elif format.lower() == 'csv':
-                df.to_csv(output_file, index=False)
-            else:
-                print(f"Unsupported format: {format}")
-                return False
-            
+            df.to_excel(output_file, index=False)
             print(f"Exported {len(df)} records to {output_file}")
             return True
         except Exception as e:
             print(f"Error exporting table: {e}")
             return False
     
-    def get_statistics(self):
-        """Get overall database statistics"""
-        tables = self.list_tables()
+    def count_records(self, table_name):
+        """Record count of a table, from the table manifest"""
+        file_path = self.get_table_path(table_name)
+        if not file_path:
+            return 0
+        return self.manifest.refresh([file_path], prune=False)[0]['records']
+    
+    def get_statistics(self, jobs=1):
+        """Get overall database statistics
+        
+        Record counts come from the table manifest; tables changed since it
+        was written are rescanned first, in up to jobs processes, and report
+        the seconds their rescan took.
+        """
+        tables = self.list_tables(jobs)
         stats = {
             'total_tables': len(tables),
             'categories': {},
@@ -210,25 +359,48 @@ class PrescripCareDB:
             stats['categories'][category] += 1
             stats['total_size'] += table['size']
             
-            # Get record count
-            try:
-                df = pd.read_csv(table['path'])
-                record_count = len(df)
-            except:
-                record_count = 0
-            
             stats['table_details'].append({
                 'name': table['name'],
                 'category': category,
-                'records': record_count,
-                'size_bytes': table['size']
+                'records': table['records'],
+                'size_bytes': table['size'],
+                'columns': len(table['columns']),
+                'seconds': table['seconds']
             })
         
         return stats
+    
+    def refresh_adherence(self, full=False, as_of=None, update_progress=True):
+        """Fold new dose events into the adherence tables under analytics/
+        
+        See adherence.py: only events appended since the last refresh are
+        read unless full is set, and the progress counters are rewritten
+        unless update_progress is False.
+        """
+        return AdherenceAnalytics(self.db_path).refresh(full, as_of, update_progress)
+
+# PrescripCareDB of each pool worker process, by database path and snapshot use
+_worker_dbs = {}
+
+def _worker_db(db_path, use_snapshots):
+    key = (str(db_path), use_snapshots)
+    if key not in _worker_dbs:
+        _worker_dbs[key] = PrescripCareDB(db_path, use_snapshots)
+    return _worker_dbs[key]
+
+def _scan_piece(db_path, use_snapshots, table_name, byte_range):
+    """Pool task: scan() results for one byte range of a table, and its seconds"""
+    started = time.perf_counter()
+    db = _worker_db(db_path, use_snapshots)
+    results = db.validator(table_name).scan(db.get_table_path(table_name), db.chunk_size,
+                                            byte_range)
+    return results, time.perf_counter() - started
 
 def main():
     parser = argparse.ArgumentParser(description='PrescripCare Database Utilities')
     parser.add_argument('--db-path', default='./database', help='Path to database directory')
+    parser.add_argument('--no-snapshot', action='store_true',
+                        help='Parse the CSV files instead of reading table snapshots')
     
     subparsers = parser.add_subparsers(dest='command', help='Available commands')
     
@@ -245,21 +417,41 @@ def main():
     validate_parser = subparsers.add_parser('validate', help='Validate tables')
     validate_parser.add_argument('--table', help='Specific table to validate')
     validate_parser.add_argument('--all', action='store_true', help='Validate all tables')
+    validate_parser.add_argument('--jobs', type=int, default=1,
+                                 help='Worker processes to use (0 for one per CPU)')
     
     # Query command
     query_parser = subparsers.add_parser('query', help='Query a table')
     query_parser.add_argument('--table', required=True, help='Table name to query')
     query_parser.add_argument('--filter', action='append', help='Filter conditions (column=value)')
     query_parser.add_argument('--limit', type=int, help='Limit results')
+    query_parser.add_argument('--columns', help='Comma-separated columns to show')
     
     # Export command
     export_parser = subparsers.add_parser('export', help='Export a table')
     export_parser.add_argument('--table', required=True, help='Table name to export')
-    export_parser.add_argument('--format', choices=['csv', 'json', 'xlsx'], default='csv', help='Export format')
+    export_parser.add_argument('--format', choices=['csv', 'json', 'ndjson', 'parquet', 'xlsx'],
+                               default='csv', help='Export format')
     export_parser.add_argument('--output', help='Output file name')
+    export_parser.add_argument('--filter', action='append', help='Filter conditions (column=value)')
+    export_parser.add_argument('--columns', help='Comma-separated columns to export')
+    export_parser.add_argument('--compression', choices=table_export.COMPRESSIONS,
+                               help='Compress the output (zstd needs zstandard)')
     
     # Stats command
     stats_parser = subparsers.add_parser('stats', help='Show database statistics')
+    stats_parser.add_argument('--jobs', type=int, default=1,
+                              help='Worker processes for rescanning changed tables (0 for one per CPU)')
+    
+    # Adherence command
+    adherence_parser = subparsers.add_parser('adherence',
+                                             help='Refresh the adherence analytics tables')
+    adherence_parser.add_argument('--full', action='store_true',
+                                  help='Recompute from every dose event, not just new ones')
+    adherence_parser.add_argument('--as-of', type=date.fromisoformat,
+                                  help='Date the progress counters are taken on (default: today)')
+    adherence_parser.add_argument('--no-progress', action='store_true',
+                                  help='Leave the progress table as it is')
     
     args = parser.parse_args()
     
@@ -267,8 +459,11 @@ def main():
         parser.print_help()
         return
     
+    if getattr(args, 'jobs', 1) < 1:
+        args.jobs = os.cpu_count() or 1
+    
     # Initialize database
-    db = PrescripCareDB(args.db_path)
+    db = PrescripCareDB(args.db_path, use_snapshots=False if args.no_snapshot else None)
     
     # Execute commands
     if args.command == 'list':
@@ -278,7 +473,7 @@ def main():
         
         print(f"Found {len(tables)} tables:")
         for table in tables:
-            print(f"  {table['name']} ({table['category']}) - {table['size']} bytes")
+            print(f"  {table['name']} ({table['category']}) - {table['records']:,} records, {table['size']} bytes")
     
     elif args.command == 'load':
         df = db.load_table(args.table)
@@ -292,35 +487,67 @@ def main():
             print(df.head())
     
     elif args.command == 'validate':
+        started = time.perf_counter()
         if args.all:
             tables = db.list_tables()
-            for table in tables:
-                db.validate_table(table['name'])
-                print()
+            results = db.validate_tables([table['name'] for table in tables], args.jobs)
+            failed = sum(1 for result in results if result['error_count'])
+            print(f"Validated {len(results)} tables in {time.perf_counter() - started:.2f}s"
+                  f" with {args.jobs} job{'s' if args.jobs != 1 else ''}"
+                  f" ({failed} with errors)")
         elif args.table:
-            db.validate_table(args.table)
+            db.validate_table(args.table, jobs=args.jobs)
     
     elif args.command == 'query':
-        df = db.query_table(args.table, args.filter, args.limit)
+        columns = [c.strip() for c in args.columns.split(',')] if args.columns else None
+        df = db.query_table(args.table, args.filter, args.limit, columns)
         if df is not None:
             print(f"\nQuery results for {args.table}:")
             print(f"Found {len(df)} records")
             print(df.to_string(index=False))
     
     elif args.command == 'export':
-        success = db.export_table(args.table, args.format, args.output)
+        columns = [c.strip() for c in args.columns.split(',')] if args.columns else None
+        success = db.export_table(args.table, args.format, args.output, args.filter,
+                                  columns, args.compression)
         if success:
             print("Export completed successfully")
     
     elif args.command == 'stats':
-        stats = db.get_statistics()
+        started = time.perf_counter()
+        stats = db.get_statistics(args.jobs)
         print("Database Statistics:")
         print(f"  Total tables: {stats['total_tables']}")
         print(f"  Total size: {stats['total_size']:,} bytes")
         print(f"  Categories: {dict(stats['categories'])}")
         print("\nTable Details:")
         for table in stats['table_details']:
-            print(f"  {table['name']}: {table['records']:,} records ({table['size_bytes']:,} bytes)")
+            scanned = (f"scanned in {table['seconds']:.2f}s" if table['seconds'] is not None
+                       else "from the manifest")
+            print(f"  {table['name']}: {table['records']:,} records ({table['size_bytes']:,} bytes),"
+                  f" {scanned}")
+        print(f"\nCollected in {time.perf_counter() - started:.2f}s")
+    
+    elif args.command == 'adherence':
+        try:
+            result = db.refresh_adherence(args.full, args.as_of, not args.no_progress)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Error refreshing adherence: {e}")
+            return
+        if result['up_to_date']:
+            print("Adherence tables are up to date")
+            return
+        print(f"{'Recomputed' if result['full'] else 'Refreshed'} adherence from "
+              f"{result['new_events']:,} new dose events ({result['total_events']:,} in all)"
+              f" in {result['seconds']:.2f}s")
+        if result['dropped_events']:
+            print(f"  Skipped {result['dropped_events']:,} events without a valid date or status")
+        print(f"  {result['users']:,} users, {result['medications']:,} medications, "
+              f"{result['daily_rows']:,} daily and {result['weekly_rows']:,} weekly rows")
+        if result['progress'] is None:
+            print("  Progress counters not updated")
+        else:
+            print(f"  Progress counters changed for {result['progress']:,} users")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
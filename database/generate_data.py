@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Synthetic PrescripCare database for load tests and benchmarks.
+
+Writes authentication, info, prescription, progress, drugs_master and
+dose_events tables at any scale into a new database directory with the
+same layout as this one, so database_utils.py, simple_loader.py and the
+backend (PRESCRIPCARE_DATABASE_DIR) can all be pointed at it:
+
+    python generate_data.py --output ./bench_db --users 100000 --dose-events 10000000
+
+Columns come from table_schemas.json, followed by the created_at and
+updated_at stamps the backend adds to every record, and the values pass
+data_validation.json: UUIDs, emails, phone numbers, enum values, ranges,
+bcrypt-length password hashes, dosage amounts and end dates after start
+dates. Schema columns without a dedicated generator get a value of their
+type. User ids are UUIDs, as dose_events.user_id requires, and emails
+are built on them.
+
+drugs_master starts with the source database's drugs (so drug_interactions,
+copied along with the config, still refers to real rows) and is padded
+with synthetic ones; prescriptions name drugs from it. Each user's dose
+events follow their prescriptions day by day from the prescription's
+start date, and progress counts them: completed_dose the taken and partial
+doses, pending_dose the missed, skipped and snoozed ones, continue_dose
+the prescriptions without an end date.
+
+The same seed and arguments always produce the same bytes. Rows are
+streamed to the files, so memory use does not grow with the scale.
+Standard library only.
+"""
+
+import argparse
+import csv
+import json
+import random
+import shutil
+import string
+import time
+from datetime import date, timedelta
+from operator import itemgetter
+from pathlib import Path
+
+# Table -> directory under the database path, as the README lays them out
+TABLE_DIRS = {
+    'authentication': 'core_tables',
+    'info': 'core_tables',
+    'prescription': 'core_tables',
+    'progress': 'core_tables',
+    'drugs_master': 'master_data',
+    'dose_events': 'user_data',
+}
+# Tables copied from the source database as they are
+COPIED_TABLES = [('master_data', 'drug_interactions.csv')]
+STAMP_COLUMNS = ['created_at', 'updated_at']
+# Values Generator.dose_events() produces for each event, in its order
+EVENT_FIELDS = ['event_id', 'user_id', 'medication_id', 'scheduled_datetime', 'actual_datetime',
+                'status', 'dose_amount_taken', 'taken_with_food', 'side_effects_noted', 'notes',
+                'recorded_via', 'created_at', 'updated_at']
+
+FREQUENCIES = {
+    'Once daily': ['08:00:00'],
+    'Twice daily': ['08:00:00', '20:00:00'],
+    'Three times daily': ['08:00:00', '14:00:00', '20:00:00'],
+    'Four times daily': ['07:00:00', '12:00:00', '17:00:00', '22:00:00'],
+}
+DOSES = ['250mg', '500mg', '1000mg', '5mg', '10mg', '20mg', '1 tablet', '2 tablets',
+         '1 capsule', '5ml', '10ml']
+# Out of 100 dose events
+STATUS_WEIGHTS = {'taken': 78, 'missed': 10, 'skipped': 4, 'snoozed': 5, 'partial': 3}
+RECORDED_VIA_WEIGHTS = {'manual': 40, 'reminder': 45, 'auto': 10, 'caregiver': 5}
+
+FIRST_NAMES = ['Aarav', 'Vivaan', 'Aditya', 'Ananya', 'Diya', 'Ishaan', 'Kavya', 'Meera',
+               'Rohan', 'Saanvi', 'Arjun', 'Priya', 'Liam', 'Olivia', 'Noah', 'Emma',
+               'Mateo', 'Sofia', 'Yusuf', 'Amara', 'Chen', 'Mei', 'Kenji', 'Aiko']
+LAST_NAMES = ['Sharma', 'Patel', 'Iyer', 'Reddy', 'Gupta', 'Khan', 'Singh', 'Das',
+              'Smith', 'Garcia', 'Nguyen', 'Okafor', 'Muller', 'Rossi', 'Tanaka', 'Silva']
+EMAIL_DOMAINS = ['example.com', 'mail.example.org', 'demo.prescripcare.app']
+DRUG_SYLLABLES = ['ab', 'cor', 'dex', 'fen', 'lo', 'mi', 'nor', 'pra', 'quin', 'ro',
+                  'sta', 'tri', 'val', 'xa', 'zol', 'ben', 'cla', 'du', 'pen', 'ta']
+DRUG_SUFFIXES = ['pril', 'statin', 'olol', 'sartan', 'mycin', 'cillin', 'azole', 'dipine',
+                 'formin', 'prazole', 'oxetine', 'tidine']
+DRUG_CLASSES = ['ACE Inhibitor', 'Statin', 'Beta Blocker', 'ARB', 'Antibiotic',
+                'Antifungal', 'Calcium Channel Blocker', 'Biguanide', 'Proton Pump Inhibitor',
+                'SSRI', 'H2 Blocker', 'Analgesic']
+CATEGORIES = ['Cardiovascular', 'Antidiabetic', 'Anti-infective', 'Gastrointestinal',
+              'Psychiatric', 'Pain Relief', 'Respiratory']
+FORMS = ['Tablet', 'Capsule', 'Liquid', 'Extended Release', 'Injection']
+ROUTES = ['Oral', 'Injection', 'Topical', 'Inhalation']
+_HASH_ALPHABET = string.ascii_letters + string.digits + './'
+
+
+def _weighted(weights):
+    """Lookup list of 100 values, one drawn by indexing it with a random 0-99"""
+    return [value for value, weight in weights.items() for _ in range(weight)]
+
+
+def _uuid(rng):
+    text = '%032x' % rng.getrandbits(128)
+    return f"{text[:8]}-{text[8:12]}-4{text[13:16]}-{text[16:20]}-{text[20:]}"
+
+
+def columns_for(schema):
+    """A generated table's columns: the schema's, then the backend's stamps"""
+    columns = list(schema.get('columns', {}))
+    return columns + [column for column in STAMP_COLUMNS if column not in columns]
+
+
+def fallback_value(props, rng, today):
+    """A valid value for a schema column without a dedicated generator"""
+    base = (props.get('type') or '').split('(')[0].strip().upper()
+    if props.get('nullable') and not props.get('required') and rng.random() < 0.3:
+        return ''
+    if base == 'UUID':
+        return _uuid(rng)
+    if base == 'ENUM':
+        return rng.choice(props.get('values') or [''])
+    if base == 'BOOLEAN':
+        return rng.choice(['true', 'false'])
+    if base == 'INTEGER':
+        return str(rng.randint(int(props.get('min', 0)), int(props.get('max', 100))))
+    if base == 'DECIMAL':
+        return f"{rng.uniform(props.get('min', 0), props.get('max', 100)):.2f}"
+    if base == 'DATE':
+        return (today - timedelta(days=rng.randrange(365))).isoformat()
+    if base in ('TIMESTAMP', 'DATETIME'):
+        return f"{(today - timedelta(days=rng.randrange(365))).isoformat()} 08:00:00"
+    if base == 'TIME':
+        return f"{rng.randrange(24):02d}:00:00"
+    if base == 'JSON':
+        return '[]'
+    if props.get('format') == 'EMAIL':
+        return f"user{rng.randrange(10 ** 9)}@example.com"
+    if props.get('format') == 'PHONE':
+        return f"+1{rng.randrange(10 ** 9, 10 ** 10)}"
+    return ''
+
+
+class TableWriter:
+    """CSV writer for one generated table, counting rows and filling columns"""
+
+    def __init__(self, path, columns, schema, rng, today):
+        self.path = path
+        self.columns = columns
+        self.schema_columns = schema.get('columns', {})
+        self.rng = rng
+        self.today = today
+        self.rows = 0
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        self._writer.writerow(columns)
+        self._missing = None
+
+    def write(self, record):
+        """Write a dict record, generating the schema columns it leaves out"""
+        if self._missing is None:
+            self._missing = [column for column in self.columns if column not in record]
+        for column in self._missing:
+            record[column] = fallback_value(self.schema_columns.get(column, {}),
+                                            self.rng, self.today)
+        self._writer.writerow([record[column] for column in self.columns])
+        self.rows += 1
+
+    def write_rows(self, rows):
+        """Write rows already in column order"""
+        self._writer.writerows(rows)
+        self.rows += len(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class Generator:
+    """Writes the synthetic tables of one database directory"""
+
+    def __init__(self, source, output, seed=42, start_date=date(2025, 1, 1)):
+        self.source = Path(source)
+        self.output = Path(output)
+        self.rng = random.Random(seed)
+        self.start_date = start_date
+        with open(self.source / 'config' / 'table_schemas.json', 'r', encoding='utf-8') as f:
+            self.schemas = json.load(f)['table_schemas']
+        self._days = {}
+        self._statuses = _weighted(STATUS_WEIGHTS)
+        self._recorded_via = _weighted(RECORDED_VIA_WEIGHTS)
+
+    def day(self, offset):
+        """'YYYY-MM-DD' of a day counted from start_date"""
+        text = self._days.get(offset)
+        if text is None:
+            text = self._days[offset] = (self.start_date + timedelta(days=offset)).isoformat()
+        return text
+
+    def writer(self, table_name):
+        directory = self.output / TABLE_DIRS[table_name]
+        directory.mkdir(parents=True, exist_ok=True)
+        schema = self.schemas[table_name]
+        return TableWriter(directory / f"{table_name}.csv", columns_for(schema), schema,
+                           self.rng, self.start_date)
+
+    def copy_fixed_files(self):
+        """The config directory and the tables that are copied, not generated"""
+        shutil.copytree(self.source / 'config', self.output / 'config', dirs_exist_ok=True)
+        for directory, name in COPIED_TABLES:
+            source = self.source / directory / name
+            if source.exists():
+                (self.output / directory).mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(source, self.output / directory / name)
+
+    def drugs(self, count):
+        """Write drugs_master, the source's drugs first; returns the drug names"""
+        writer = self.writer('drugs_master')
+        names = []
+        source = self.source / 'master_data' / 'drugs_master.csv'
+        if source.exists():
+            with open(source, 'r', encoding='utf-8', newline='') as f:
+                for row in csv.DictReader(f):
+                    if len(names) >= count:
+                        break
+                    writer.write({column: row.get(column) or '' for column in writer.columns})
+                    names.append(row['drug_name'])
+
+        rng = self.rng
+        taken = set(names)
+        while len(names) < count:
+            name = (rng.choice(DRUG_SYLLABLES) + rng.choice(DRUG_SYLLABLES)
+                    + rng.choice(DRUG_SUFFIXES)).capitalize()
+            if name in taken:
+                name = f"{name} {len(names)}"
+            taken.add(name)
+            names.append(name)
+            strengths = rng.sample(['2.5mg', '5mg', '10mg', '20mg', '50mg', '100mg', '250mg',
+                                    '500mg', '1000mg'], 3)
+            drug_class = rng.choice(DRUG_CLASSES)
+            record = {
+                'drug_id': _uuid(rng),
+                'drug_name': name,
+                'generic_name': name,
+                'brand_names': json.dumps([name[:4] + suffix for suffix in ('ex', 'ora')]),
+                'drug_class': drug_class,
+                'therapeutic_category': rng.choice(CATEGORIES),
+                'active_ingredients': json.dumps([{'ingredient': name, 'strength': 'varies'}]),
+                'available_strengths': json.dumps(sorted(strengths, key=lambda s: float(s[:-2]))),
+                'dosage_forms': json.dumps(rng.sample(FORMS, 2)),
+                'route_of_administration': json.dumps([rng.choice(ROUTES)]),
+                'indications': f"{drug_class} therapy",
+                'contraindications': 'Known hypersensitivity',
+                'side_effects': json.dumps([{'frequency': 'common',
+                                             'effects': ['nausea', 'headache']}]),
+                'warnings_precautions': 'Use as directed',
+                'pregnancy_category': rng.choice(['A', 'B', 'C', 'D']),
+                'storage_conditions': 'Room temperature 20-25°C',
+                'shelf_life_months': str(rng.choice([12, 24, 36])),
+                'fda_approved': rng.choice(['true', 'false']),
+                'manufacturer': 'Synthetic Pharma',
+                'created_at': f"{self.day(-365)} 08:00:00",
+                'updated_at': f"{self.day(-30)} 08:00:00",
+            }
+            writer.write(record)
+        writer.close()
+        return names
+
+    def run(self, users, prescriptions_per_user=3, dose_events=None, drugs=500, report=print):
+        """Write every table; returns {table_name: rows}"""
+        if dose_events is None:
+            dose_events = users * 100
+        self.output.mkdir(parents=True, exist_ok=True)
+        self.copy_fixed_files()
+
+        drug_names = self.drugs(drugs)
+        results = {'drugs_master': len(drug_names)}
+
+        writers = {name: self.writer(name) for name in
+                   ('authentication', 'info', 'prescription', 'progress', 'dose_events')}
+        for number in range(users):
+            quota = dose_events // users + (1 if number < dose_events % users else 0)
+            self.user(writers, drug_names, prescriptions_per_user, quota)
+            if report and number and number % 10000 == 0:
+                report(f"  {number:,} users, {writers['dose_events'].rows:,} dose events")
+        for name, writer in writers.items():
+            writer.close()
+            results[name] = writer.rows
+        return results
+
+    def user(self, writers, drug_names, prescriptions_per_user, quota):
+        """Write one user's rows to every table"""
+        rng = self.rng
+        user_id = _uuid(rng)
+        joined = rng.randrange(-400, -30)
+        stamp = f"{self.day(joined)} {rng.randrange(8, 22):02d}:{rng.randrange(60):02d}:00"
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        email = f"{user_id}@{rng.choice(EMAIL_DOMAINS)}"
+
+        writers['authentication'].write({
+            'user_id': user_id,
+            'email': email,
+            'password': '$2b$12$' + ''.join(rng.choices(_HASH_ALPHABET, k=53)),
+            'created_at': stamp, 'updated_at': stamp,
+        })
+        weight = round(rng.uniform(40, 130), 2)
+        height = rng.randint(140, 200)
+        writers['info'].write({
+            'user_id': user_id,
+            'name': f"{first} {last}",
+            'age': str(rng.randint(13, 90)),
+            'gender': rng.choice(['male', 'female', 'other']),
+            'weight': f"{weight:.2f}",
+            'height': str(height),
+            'contact_no': f"+91{rng.randrange(6000000000, 9999999999)}",
+            'email_id': email,
+            'bmi': f"{weight / (height / 100) ** 2:.1f}",
+            'created_at': stamp, 'updated_at': stamp,
+        })
+
+        # (medication_id, start day, end day or None, dose, slot times)
+        medications = []
+        count = max(1, min(2 * prescriptions_per_user - 1,
+                           round(rng.gauss(prescriptions_per_user, 1))))
+        for i in range(count):
+            frequency = rng.choice(list(FREQUENCIES))
+            start = joined + rng.randrange(0, 30)
+            # The first prescription is ongoing, so every user's events go on
+            end = None if i == 0 or rng.random() < 0.3 else start + rng.randrange(7, 180)
+            dose = rng.choice(DOSES)
+            medications.append((_uuid(rng), start, end, dose, FREQUENCIES[frequency]))
+            writers['prescription'].write({
+                'user_id': user_id,
+                'medicine_name': rng.choice(drug_names),
+                'frequency': frequency,
+                'start_date': self.day(start),
+                'end_date': self.day(end) if end is not None else '',
+                'dose': dose,
+                'doctor_name': f"Dr {rng.choice(LAST_NAMES)}",
+                'created_at': stamp, 'updated_at': stamp,
+            })
+
+        counts = self.dose_events(writers['dose_events'], user_id, medications, quota)
+        writers['progress'].write({
+            'user_id': user_id,
+            'pending_dose': str(counts['missed'] + counts['skipped'] + counts['snoozed']),
+            'continue_dose': str(sum(1 for medication in medications if medication[2] is None)),
+            'upcoming_dose': '0',
+            'completed_dose': str(counts['taken'] + counts['partial']),
+            'created_at': stamp, 'updated_at': stamp,
+        })
+
+    def dose_events(self, writer, user_id, medications, quota):
+        """Write quota dose events following medications day by day; returns status counts"""
+        rng = self.rng
+        # random() scaled is several times quicker than randrange() per event
+        random = rng.random
+        statuses, recorded_via = self._statuses, self._recorded_via
+        counts = dict.fromkeys(STATUS_WEIGHTS, 0)
+        # The event values below in the table's column order, '' for others
+        order = itemgetter(*[EVENT_FIELDS.index(column) if column in EVENT_FIELDS
+                             else len(EVENT_FIELDS) for column in writer.columns])
+        rows = []
+        offset = min(medication[1] for medication in medications)
+        while len(rows) < quota:
+            day = self.day(offset)
+            for medication_id, start, end, dose, slots in medications:
+                if offset < start or (end is not None and offset > end):
+                    continue
+                for slot in slots:
+                    if len(rows) >= quota:
+                        break
+                    status = statuses[int(random() * 100)]
+                    counts[status] += 1
+                    scheduled = f"{day} {slot}"
+                    if status in ('taken', 'partial', 'snoozed'):
+                        actual = f"{day} {slot[:3]}{int(random() * 60):02d}:{int(random() * 60):02d}"
+                        taken = dose if status != 'snoozed' else ''
+                        with_food = 'true' if random() < 0.5 else 'false'
+                    else:
+                        actual, taken, with_food = '', '', ''
+                    stamp = actual or scheduled
+                    rows.append(order((
+                        _uuid(rng), user_id, medication_id, scheduled, actual, status, taken,
+                        with_food, 'mild nausea' if random() < 0.02 else '', '',
+                        recorded_via[int(random() * 100)], stamp, stamp, '')))
+            offset += 1
+        writer.write_rows(rows)
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic PrescripCare database')
+    parser.add_argument('--output', required=True, help='Database directory to write')
+    parser.add_argument('--source', default=Path(__file__).parent,
+                        help='Database directory with the config and drugs to start from')
+    parser.add_argument('--users', type=int, default=1000, help='Number of users')
+    parser.add_argument('--prescriptions-per-user', type=int, default=3,
+                        help='Average prescriptions per user')
+    parser.add_argument('--dose-events', type=int, help='Total dose events (default: 100 per user)')
+    parser.add_argument('--drugs', type=int, default=500, help='Rows of drugs_master')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--start-date', type=date.fromisoformat, default=date(2025, 1, 1),
+                        help='Reference date the generated dates are spread around')
+    args = parser.parse_args()
+
+    if Path(args.output).resolve() == Path(args.source).resolve():
+        parser.error('--output must not be the source database')
+
+    generator = Generator(args.source, args.output, args.seed, args.start_date)
+    started = time.perf_counter()
+    results = generator.run(args.users, args.prescriptions_per_user, args.dose_events, args.drugs)
+    for table_name, rows in results.items():
+        path = generator.output / TABLE_DIRS[table_name] / f"{table_name}.csv"
+        print(f"✅ {table_name}: {rows:,} rows ({path.stat().st_size / (1024 * 1024):.1f} MB)")
+    print(f"Generated {generator.output} in {time.perf_counter() - started:.1f}s (seed {args.seed})")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ Usage:
     python simple_loader.py
     python simple_loader.py --table users
     python simple_loader.py --stats
+    python simple_loader.py --export dose_events --format ndjson --compression gzip
 """
 
 import csv
@@ -19,6 +20,10 @@ import argparse
 from datetime import datetime
 from pathlib import Path
 
+from table_manifest import TableManifest
+import table_export
+from table_query import Equals, TableQuery, parse_filter
+
 class SimpleDBLoader:
     def __init__(self, db_path="./database"):
         self.db_path = Path(db_path)
@@ -27,6 +32,7 @@ class SimpleDBLoader:
         self.master_data_path = self.db_path / "master_data"
         self.user_data_path = self.db_path / "user_data"
         self.analytics_path = self.db_path / "analytics"
+        self.manifest = TableManifest(self.db_path)
         
     def get_table_path(self, table_name):
         """Get the full path to a table CSV file"""
@@ -64,21 +70,21 @@ class SimpleDBLoader:
         return records
     
     def list_tables(self):
-        """List all available tables"""
-        tables = []
+        """List all available tables, with counts from the table manifest"""
+        file_paths = []
         for path in [self.core_tables_path, self.master_data_path, 
                      self.user_data_path, self.analytics_path]:
             if path.exists():
-                for file_path in path.glob("*.csv"):
-                    table_name = file_path.stem
-                    table_category = path.name
-                    record_count = sum(1 for _ in open(file_path)) - 1  # Subtract header
-                    tables.append({
-                        'name': table_name,
-                        'category': table_category,
-                        'records': record_count,
-                        'size': file_path.stat().st_size
-                    })
+                file_paths.extend(sorted(path.glob("*.csv")))
+        
+        tables = []
+        for file_path, entry in zip(file_paths, self.manifest.refresh(file_paths)):
+            tables.append({
+                'name': file_path.stem,
+                'category': file_path.parent.name,
+                'records': entry['records'],
+                'size': entry['size']
+            })
         return tables
     
     def show_table_info(self, table_name):
@@ -88,7 +94,7 @@ class SimpleDBLoader:
             return
         
         file_path = self.get_table_path(table_name)
-        total_records = sum(1 for _ in open(file_path)) - 1
+        total_records = self.manifest.refresh([file_path], prune=False)[0]['records']
         
         print(f"\nTable: {table_name}")
         print(f"Total records: {total_records}")
@@ -101,38 +107,50 @@ class SimpleDBLoader:
             print(f"  {key}: {value}")
     
     def search_table(self, table_name, column, value, limit=10):
-        """Search for records in a table"""
-        records = self.load_table(table_name)
-        if not records:
+        """Search for records in a table
+        
+        Streams the table through a TableQuery, which stops reading it once
+        limit records matched.
+        """
+        file_path = self.get_table_path(table_name)
+        if not file_path:
+            print(f"Table '{table_name}' not found")
             return []
         
-        matches = []
-        for record in records:
-            if column in record and str(record[column]).lower() == str(value).lower():
-                matches.append(record)
-                if len(matches) >= limit:
-                    break
+        try:
+            query = TableQuery(file_path, [Equals(column, value, ignore_case=True)], limit=limit)
+            matches = list(query)
+        except KeyError:
+            matches = []  # no record has that column
+        except Exception as e:
+            print(f"Error searching {table_name}: {e}")
+            return []
         
         print(f"Found {len(matches)} matches for {column}='{value}' in {table_name}")
         return matches
     
-    def export_to_json(self, table_name, output_file=None):
-        """Export table to JSON format"""
-        records = self.load_table(table_name)
-        if not records:
+    def export_to_json(self, table_name, output_file=None, format='json', filters=None,
+                       columns=None, compression=None):
+        """Export table to JSON format (or NDJSON, CSV or Parquet)
+        
+        Rows are streamed to the file as they are read, see table_export.py.
+        """
+        file_path = self.get_table_path(table_name)
+        if not file_path:
+            print(f"Table '{table_name}' not found")
             return False
         
         if not output_file:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = f"{table_name}_export_{timestamp}.json"
+            output_file = table_export.default_output(table_name, format, compression)
         
         try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(records, f, indent=2, default=str)
-            print(f"Exported {len(records)} records to {output_file}")
+            predicates = [parse_filter(filter_expr) for filter_expr in filters or []]
+            stats = table_export.export_table(file_path, output_file, format, predicates,
+                                              columns, compression=compression)
+            print(f"Exported {table_export.describe(stats)} to {output_file}")
             return True
         except Exception as e:
-            print(f"Error exporting to JSON: {e}")
+            print(f"Error exporting to {format.upper()}: {e}")
             return False
     
     def get_database_stats(self):
@@ -188,6 +206,12 @@ def main():
     parser.add_argument('--stats', action='store_true', help='Show database statistics')
     parser.add_argument('--demo', action='store_true', help='Run demo queries')
     parser.add_argument('--export', help='Export table to JSON')
+    parser.add_argument('--format', choices=table_export.FORMATS, default='json',
+                       help='Export format (default: json)')
+    parser.add_argument('--compression', choices=table_export.COMPRESSIONS,
+                       help='Compress the export')
+    parser.add_argument('--columns', help='Comma-separated columns to export')
+    parser.add_argument('--filter', action='append', help='Export only rows matching column=value')
     parser.add_argument('--search', nargs=3, metavar=('TABLE', 'COLUMN', 'VALUE'), 
                        help='Search for records: TABLE COLUMN VALUE')
     
@@ -219,7 +243,9 @@ def main():
             print(f"  {category}: {data['tables']} tables, {data['records']:,} records")
     
     elif args.export:
-        loader.export_to_json(args.export)
+        columns = [c.strip() for c in args.columns.split(',')] if args.columns else None
+        loader.export_to_json(args.export, format=args.format, filters=args.filter,
+                              columns=columns, compression=args.compression)
     
     elif args.search:
         table, column, value = args.search
@@ -0,0 +1,294 @@
+"""
+Streaming export of the CSV tables, for simple_loader.py --export and
+database_utils.py export.
+
+Rows are read through a TableQuery, so filters and a column selection
+work as they do for queries, and each row is written out as soon as it
+is read. An export therefore needs the same small amount of memory
+whatever the size of the table. The formats are:
+
+- json: a JSON array of records, laid out as json.dump(records, indent=2)
+- ndjson: one JSON record per line
+- csv: the selected columns of the matching rows
+- parquet: row groups of PARQUET_ROW_GROUP rows (needs pyarrow)
+
+Values stay the text in the table unless the table's schema is given.
+Then INTEGER, DECIMAL and BOOLEAN values are written as numbers and
+booleans and empty values as null. In JSON a value that doesn't parse
+stays text; in Parquet, whose columns take those types, it stops the
+export (validate the table first).
+
+json, ndjson and csv output can be gzip compressed, or zstd compressed
+when the zstandard package is installed; Parquet compresses its pages
+with the codec asked for instead. Standard library only otherwise, so
+simple_loader.py can use it.
+"""
+
+import csv
+import gzip
+import itertools
+import math
+import os
+import time
+from json.encoder import encode_basestring, encode_basestring_ascii
+
+from table_manifest import RecordCounter
+from table_query import TableQuery
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('json', 'ndjson', 'csv', 'parquet')
+COMPRESSIONS = ('gzip', 'zstd')
+# File name suffixes of the formats and compressions
+SUFFIXES = {'json': '.json', 'ndjson': '.ndjson', 'csv': '.csv', 'parquet': '.parquet',
+            'gzip': '.gz', 'zstd': '.zst'}
+# Rows per Parquet row group, the rows held in memory at a time
+PARQUET_ROW_GROUP = 64 * 1024
+# Rows encoded to JSON at a time
+JSON_BATCH = 4096
+
+# ASCII characters json leaves as they are in strings
+_PLAIN = bytes(c for c in range(0x20, 0x7f) if c not in b'"\\')
+
+
+def _decimal(text):
+    value = float(text)
+    if not math.isfinite(value):
+        raise ValueError(f"not a finite number: {text}")
+    return value
+
+
+def _boolean(text):
+    lowered = text.strip().lower()
+    if lowered in ('true', '1', 'yes'):
+        return True
+    if lowered in ('false', '0', 'no'):
+        return False
+    raise ValueError(f"not a boolean: {text}")
+
+
+_PARSERS = {'INTEGER': int, 'DECIMAL': _decimal, 'BOOLEAN': _boolean}
+_ARROW_TYPES = {'INTEGER': 'int64', 'DECIMAL': 'float64', 'BOOLEAN': 'bool_'}
+
+
+def _base_type(schema, column):
+    props = (schema or {}).get('columns', {}).get(column, {})
+    return (props.get('type') or '').split('(')[0].strip().upper()
+
+
+def _json_column(base_type, typed, ensure_ascii):
+    """Function giving the JSON texts for a column's fields"""
+    string = encode_basestring_ascii if ensure_ascii else encode_basestring
+    if not typed:
+        return lambda texts: list(map(string, texts))
+    parse = _PARSERS.get(base_type)
+    if parse is None:
+        return lambda texts: [string(text) if text else 'null' for text in texts]
+
+    def encode(text):
+        if not text:
+            return 'null'
+        try:
+            value = parse(text)
+        except ValueError:
+            return string(text)
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        return repr(value)
+    return lambda texts: list(map(encode, texts))
+
+
+def _plain(texts):
+    """Whether JSON strings of texts are just the texts between quotes"""
+    joined = ''.join(texts)
+    return joined.isascii() and not joined.encode('ascii').translate(None, _PLAIN)
+
+
+def _json_batches(records, columns, schema, ensure_ascii, separator, opening, closing):
+    """Lists of JSON objects for up to JSON_BATCH records at a time
+
+    The objects are laid out with the separators given. Each is its
+    fields' JSON put into a template of the keys, built per batch: a text
+    column whose fields in the batch are plain ASCII needing no escaping
+    (nor null for an empty field) goes in between quotes as it is, and only the other
+    columns are encoded, a column at a time.
+    """
+    string = encode_basestring_ascii if ensure_ascii else encode_basestring
+    keys = [string(column).replace('%', '%%') + ': ' for column in columns]
+    typed = bool(schema)
+    bases = [_base_type(schema, column) for column in columns]
+    encoders = [_json_column(base, typed, ensure_ascii) for base in bases]
+    while True:
+        batch = list(itertools.islice(records, JSON_BATCH))
+        if not batch:
+            return
+        if not columns:
+            yield ['{}'] * len(batch)
+            continue
+        parts, fields, verbatim = [], [], True
+        for key, base, encode, texts in zip(keys, bases, encoders, zip(*batch)):
+            if base not in _PARSERS and not (typed and '' in texts) and _plain(texts):
+                parts.append(key + '"%s"')
+                fields.append(texts)
+            else:
+                parts.append(key + '%s')
+                fields.append(encode(texts))
+                verbatim = False
+        template = opening + separator.join(parts) + closing
+        yield list(map(template.__mod__, batch if verbatim else zip(*fields)))
+
+
+def default_output(table_name, format, compression=None):
+    """<table>_export_<timestamp>.<format>[.gz|.zst], as the CLIs name exports"""
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    name = f"{table_name}_export_{timestamp}{SUFFIXES[format]}"
+    if compression and format != 'parquet':
+        name += SUFFIXES[compression]
+    return name
+
+
+def _open(path, compression, binary=False):
+    """Stream writing to path, compressed as asked"""
+    mode, text = ('wb', {}) if binary else ('wt', {'encoding': 'utf-8', 'newline': ''})
+    if compression == 'gzip':
+        return gzip.open(path, mode, compresslevel=6, **text)
+    if compression == 'zstd':
+        return zstandard.open(path, mode, **text)
+    return open(path, 'wb' if binary else 'w', **text)
+
+
+def _write_json(stream, records, columns, schema):
+    # The layout of json.dump(records, indent=2), a batch at a time
+    count = 0
+    for batch in _json_batches(records, columns, schema, True,
+                               ',\n    ', '{\n    ', '\n  }'):
+        stream.write(('[\n  ' if count == 0 else ',\n  ') + ',\n  '.join(batch))
+        count += len(batch)
+    stream.write('\n]' if count else '[]')
+    return count
+
+
+def _write_ndjson(stream, records, columns, schema):
+    count = 0
+    for batch in _json_batches(records, columns, schema, False, ', ', '{', '}'):
+        stream.write('\n'.join(batch) + '\n')
+        count += len(batch)
+    return count
+
+
+def _write_csv(stream, records, columns):
+    writer = csv.writer(stream, lineterminator='\n')
+    writer.writerow(columns)
+    count = 0
+    for record in records:
+        writer.writerow(record)
+        count += 1
+    return count
+
+
+def _copy_csv(file_path, stream):
+    """Copy a whole table's bytes to a binary stream; returns its record count"""
+    counter = RecordCounter()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            counter.feed(block)
+            stream.write(block)
+    return max(0, counter.records - 1)
+
+
+def _write_parquet(path, records, columns, schema, compression):
+    types = {column: _ARROW_TYPES.get(_base_type(schema, column), 'string')
+             for column in columns}
+    arrow_schema = pyarrow.schema([(column, getattr(pyarrow, types[column])())
+                                   for column in columns])
+    parsers = {column: _PARSERS[_base_type(schema, column)]
+               for column in columns if types[column] != 'string'}
+
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, arrow_schema,
+                                       compression=compression or 'snappy') as writer:
+        while True:
+            group = list(itertools.islice(records, PARQUET_ROW_GROUP))
+            if not group and count:
+                break
+            fields = list(zip(*group)) if group else [()] * len(columns)
+            batch = {}
+            for column, values in zip(columns, fields):
+                parse = parsers.get(column)
+                try:
+                    batch[column] = [None if text == '' and schema else
+                                     parse(text) if parse else text for text in values]
+                except ValueError as e:
+                    raise ValueError(f"column {column} near row {count + 1}: {e}") from None
+            writer.write_table(pyarrow.table(batch, schema=arrow_schema))
+            count += len(group)
+            if len(group) < PARQUET_ROW_GROUP:
+                break
+    return count
+
+
+def export_table(file_path, output_file, format='json', predicates=(), columns=None,
+                 schema=None, compression=None):
+    """Stream a CSV table's matching rows to output_file
+
+    Returns {'rows', 'bytes', 'seconds'}, bytes being the size of the
+    file written. The file is written under a temporary name and only
+    replaces output_file once complete. Raises ValueError for an unknown
+    format or an unavailable compression, and KeyError for unknown columns.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unsupported format: {format}")
+    if compression and compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+    if format == 'parquet' and pyarrow is None:
+        raise ValueError("Parquet export needs the pyarrow package")
+    if compression == 'zstd' and zstandard is None and format != 'parquet':
+        raise ValueError("zstd compression needs the zstandard package")
+
+    started = time.perf_counter()
+    query = TableQuery(file_path, predicates, columns)
+    records = query.records()
+    # Nothing to filter or cut: a CSV export is a copy of the table
+    whole_table = format == 'csv' and not query.predicates and query.columns == query.header
+
+    temp_path = f"{output_file}.{os.getpid()}.tmp"
+    try:
+        if format == 'parquet':
+            count = _write_parquet(temp_path, records, query.columns, schema, compression)
+        else:
+            with _open(temp_path, compression, binary=whole_table) as stream:
+                if format == 'json':
+                    count = _write_json(stream, records, query.columns, schema)
+                elif format == 'ndjson':
+                    count = _write_ndjson(stream, records, query.columns, schema)
+                elif whole_table:
+                    count = _copy_csv(file_path, stream)
+                else:
+                    count = _write_csv(stream, records, query.columns)
+        os.replace(temp_path, output_file)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return {
+        'rows': count,
+        'bytes': os.path.getsize(output_file),
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def describe(stats):
+    """'N rows (X MB) in Ys: R rows/s, Z MB/s' for export_table's stats"""
+    seconds = max(stats['seconds'], 1e-9)
+    megabytes = stats['bytes'] / (1024 * 1024)
+    return (f"{stats['rows']:,} rows ({megabytes:.1f} MB) in {stats['seconds']:.2f}s: "
+            f"{stats['rows'] / seconds:,.0f} rows/s, {megabytes / seconds:.1f} MB/s")
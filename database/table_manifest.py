@@ -0,0 +1,242 @@
+"""
+Manifest of the database's CSV tables: row count, size, mtime, columns and
+checksum of each, kept in table_manifest.json under the database path.
+
+Listing the tables or showing their statistics then only needs a stat()
+per file. A table is scanned again only when its size or mtime changed,
+and when it only grew (as the backend's appends make it) and its old bytes
+still have the recorded checksum, only the appended bytes are counted.
+
+Rows are counted over a memory map of the file, a block at a time.
+Newlines inside quoted fields (the JSON columns of drugs_master.csv) and
+blank lines are not counted, matching what csv and pandas read. A double
+quote is taken to open or close a quoted field, as csv writers produce;
+a stray quote inside an unquoted field would throw the count off. Standard
+library only, so simple_loader.py can use it.
+"""
+
+import csv
+import json
+import mmap
+import os
+import re
+import time
+import zlib
+from datetime import datetime
+
+MANIFEST_NAME = 'table_manifest.json'
+FORMAT_VERSION = 1
+# Bytes scanned at a time
+BLOCK_SIZE = 8 * 1024 * 1024
+
+# A line break followed by another one: the second ends a blank line
+_BLANK_LINE = re.compile(rb'\n(?=\r*\n)')
+
+
+class RecordCounter:
+    """Counts CSV records in bytes fed to it in order, quote-aware
+
+    state() and RecordCounter(state) carry a count over to bytes
+    appended later.
+    """
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.newlines = state.get('newlines', 0)
+        self.blank = state.get('blank', 0)
+        self.inside = state.get('inside', False)
+        # Last byte outside quotes, not counting carriage returns; a newline
+        # at the start, so a leading line break makes a blank line
+        self.last = state.get('last', '\n').encode('latin-1')
+        self.checksum = state.get('checksum', 0)
+
+    def feed(self, block):
+        self.checksum = zlib.crc32(block, self.checksum)
+        # Most tables quote nothing: don't copy the block to split it
+        parts = block.split(b'"') if b'"' in block else [block]
+        # Parts alternate between outside and inside quotes; "" escapes
+        # give an empty part and keep the alternation right
+        outside = parts[1::2] if self.inside else parts[0::2]
+        self.inside ^= (len(parts) - 1) % 2 == 1
+        last_index = len(outside) - 1
+        ends_outside = not self.inside
+        for i, part in enumerate(outside):
+            if part:
+                self.newlines += part.count(b'\n')
+                if self.last == b'\n' and _first_byte(part) == b'\n':
+                    self.blank += 1
+                if _BLANK_LINE.search(part):
+                    self.blank += len(_BLANK_LINE.findall(part))
+                # Carriage returns only matter as part of a line break
+                self.last = _last_byte(part) or self.last
+            if i < last_index or not ends_outside:
+                # A quoted field follows this part
+                self.last = b'"'
+
+    @property
+    def records(self):
+        """Records counted, the header included"""
+        lines = self.newlines - self.blank
+        if self.last != b'\n':
+            lines += 1  # a last record without a line break
+        return lines
+
+    def state(self):
+        return {'newlines': self.newlines, 'blank': self.blank, 'inside': self.inside,
+                'last': self.last.decode('latin-1'), 'checksum': self.checksum}
+
+
+def _first_byte(part):
+    """First byte of part that isn't a carriage return"""
+    first = part[:1]
+    return part.lstrip(b'\r')[:1] if first == b'\r' else first
+
+
+def _last_byte(part):
+    """Last byte of part that isn't a carriage return"""
+    last = part[-1:]
+    return part.rstrip(b'\r')[-1:] if last == b'\r' else last
+
+
+def _scan(file_path, start, end, counter):
+    """Feed bytes start to end of a file to counter, through a memory map"""
+    if end <= start:
+        return counter
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for offset in range(start, end, BLOCK_SIZE):
+            counter.feed(mapped[offset:min(offset + BLOCK_SIZE, end)])
+    return counter
+
+
+def prefix_checksum(file_path, size):
+    """CRC-32 of a file's first size bytes"""
+    checksum = 0
+    with open(file_path, 'rb') as f:
+        left = size
+        while left > 0:
+            block = f.read(min(BLOCK_SIZE, left))
+            if not block:
+                break
+            checksum = zlib.crc32(block, checksum)
+            left -= len(block)
+    return checksum
+
+
+def _columns(file_path):
+    """Header columns of a CSV file"""
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def scan_table(file_path, previous=None):
+    """Manifest entry for a CSV file, reusing previous where still valid
+
+    Returns previous itself when the file's size and mtime are unchanged.
+    """
+    stat = os.stat(file_path)
+    if previous and previous.get('size') == stat.st_size \
+            and previous.get('mtime_ns') == stat.st_mtime_ns:
+        return previous
+
+    started = time.perf_counter()
+    counter, start = RecordCounter(), 0
+    if previous and previous.get('scan') and 0 < previous['size'] <= stat.st_size \
+            and prefix_checksum(file_path, previous['size']) == previous['scan']['checksum']:
+        # Only appended to since: count the new bytes on from the old state
+        counter, start = RecordCounter(previous['scan']), previous['size']
+    _scan(file_path, start, stat.st_size, counter)
+
+    columns = previous['columns'] if start and previous.get('columns') else _columns(file_path)
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'records': max(0, counter.records - 1),
+        'columns': columns,
+        'checksum': f"{counter.checksum:08x}",
+        'scanned_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'scan_seconds': round(time.perf_counter() - started, 4),
+        'scan': counter.state(),
+    }
+
+
+class TableManifest:
+    """table_manifest.json of a database directory"""
+
+    def __init__(self, db_path):
+        self.db_path = os.fspath(db_path)
+        self.path = os.path.join(self.db_path, MANIFEST_NAME)
+        self._tables = None
+        self._state = None
+        # Paths the last refresh() rescanned
+        self.rescanned = []
+
+    def _load(self):
+        try:
+            stat = os.stat(self.path)
+            state = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            state = None
+        if self._tables is not None and state == self._state:
+            return
+        self._tables, self._state = {}, state
+        if state is None:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('format') == FORMAT_VERSION:
+            self._tables = data.get('tables', {})
+
+    def _save(self):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'format': FORMAT_VERSION, 'tables': self._tables}, f, indent=1)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Could not write {MANIFEST_NAME}: {e}")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        try:
+            stat = os.stat(self.path)
+            self._state = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            self._state = None
+
+    def refresh(self, file_paths, map_function=map, prune=True):
+        """Up-to-date entries for the CSV files, rescanning only changed ones
+
+        map_function runs scan_table over the (path, previous entry) pairs,
+        e.g. a process pool's map. With prune, file_paths are all the
+        tables and entries for any others (deleted tables) are dropped.
+        The paths rescanned are left in self.rescanned.
+        """
+        self._load()
+        keys = [os.path.relpath(os.fspath(path), self.db_path) for path in file_paths]
+        stale = [(path, key) for path, key in zip(file_paths, keys)
+                 if not _unchanged(path, self._tables.get(key))]
+        changed = bool(stale) or (prune and set(self._tables) != set(keys))
+        self.rescanned = [path for path, _ in stale]
+        if stale:
+            entries = map_function(scan_table, [path for path, _ in stale],
+                                   [self._tables.get(key) for _, key in stale])
+            for (_, key), entry in zip(stale, entries):
+                self._tables[key] = entry
+        if prune:
+            self._tables = {key: self._tables[key] for key in keys}
+        if changed:
+            self._save()
+        return [self._tables[key] for key in keys]
+
+
+def _unchanged(file_path, entry):
+    if not entry:
+        return False
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return False
+    return entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns
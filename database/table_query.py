@@ -0,0 +1,217 @@
+"""
+Streaming queries over the CSV tables, shared by simple_loader.py's
+--search and database_utils.py's query command.
+
+A query is a chain of generators, each pulling rows from the one before:
+
+    scan -> where -> project -> limit
+
+so nothing is read much ahead of what the last stage asks for. Equality
+predicates are pushed down into scan: a line outside any quoted field
+that doesn't contain a predicate's value can't be a match, so it is
+dropped before the csv module parses it. scan reads the file in blocks
+and, in blocks without quotes, only looks at the lines a value turns up
+on.
+where tests the predicates on the fields of the records left, project
+keeps only the requested columns, and limit stops pulling once it has
+enough rows, which ends the scan and closes the file. A search for the
+first few matches therefore reads only as far as the last of them.
+
+Standard library only, so simple_loader.py can use it.
+"""
+
+import csv
+import re
+from operator import itemgetter
+
+# Characters of the file read at a time while prefiltering
+BLOCK_SIZE = 256 * 1024
+
+# Lines as reading a file with newline='' splits them: \r\n, \n or a lone \r
+_LINE = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+_LONE_CR = re.compile(r'\r(?!\n)')
+
+
+class Equals:
+    """column=value predicate on the text of a field, optionally ignoring case"""
+
+    def __init__(self, column, value, ignore_case=False):
+        self.column = column
+        self.value = str(value)
+        self.ignore_case = ignore_case
+        self.expected = self.value.lower() if ignore_case else self.value
+
+    def matches(self, field):
+        return (field.lower() if self.ignore_case else field) == self.expected
+
+    def could_match(self, line, lowered):
+        """Whether a record on this line could match; line is unquoted"""
+        return self.expected in (lowered if self.ignore_case else line)
+
+    def __repr__(self):
+        return f"{self.column}={self.value}"
+
+
+def parse_filter(expression, ignore_case=False):
+    """Equals predicate for a 'column=value' filter expression"""
+    if '=' not in expression:
+        raise ValueError(f"expected column=value, got '{expression}'")
+    column, value = expression.split('=', 1)
+    return Equals(column.strip(), value.strip(), ignore_case)
+
+
+def read_header(file_path):
+    """Column names of a CSV table"""
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def _blocks(f):
+    """Whole lines of a file, BLOCK_SIZE characters or so at a time"""
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            return
+        # readline() also stops at a lone carriage return
+        while not block.endswith('\n'):
+            rest = f.readline()
+            if not rest:
+                break
+            block += rest
+        yield block
+
+
+def _matching_lines(block, pushed, any_case):
+    """Lines of an unquoted block on which all pushed predicates could match
+
+    Searches the block for the first predicate's value and only looks at
+    the lines it occurs on.
+    """
+    lowered = block.lower() if any_case else block
+    first = pushed[0]
+    haystack = lowered if first.ignore_case else block
+    position = haystack.find(first.expected)
+    while position >= 0:
+        start = block.rfind('\n', 0, position) + 1
+        end = block.find('\n', position)
+        end = len(block) if end < 0 else end + 1
+        line = block[start:end]
+        if all(predicate.could_match(line, lowered[start:end]) for predicate in pushed[1:]):
+            yield line
+        position = haystack.find(first.expected, end)
+
+
+def _candidate_lines(f, predicates):
+    """The lines of f, less unquoted ones no matching record can be on"""
+    pushed = [predicate for predicate in predicates if predicate.expected]
+    if not pushed:
+        yield from f
+        return
+    any_case = any(predicate.ignore_case for predicate in pushed)
+    inside = False
+    for block in _blocks(f):
+        # Quoted fields can span lines: lines are only skipped outside them
+        if not inside and '"' not in block and not _LONE_CR.search(block) and (
+                not any_case or len(block.lower()) == len(block)):
+            yield from _matching_lines(block, pushed, any_case)
+            continue
+        for line in _LINE.findall(block):
+            if '"' in line:
+                inside ^= line.count('"') % 2 == 1
+            elif not inside:
+                lowered = line.lower() if any_case else line
+                if not all(predicate.could_match(line, lowered) for predicate in pushed):
+                    continue
+            yield line
+
+
+def scan(f, predicates=()):
+    """Records (lists of fields) of an open CSV file from where it is read to
+
+    predicates prefilter the lines, see _candidate_lines.
+    """
+    for record in csv.reader(_candidate_lines(f, predicates)):
+        if record:  # blank lines
+            yield record
+
+
+def where(records, tests):
+    """Records whose fields pass every (position, predicate) test"""
+    if not tests:
+        yield from records
+        return
+    for record in records:
+        if all(predicate.matches(record[position] if position < len(record) else '')
+               for position, predicate in tests):
+            yield record
+
+
+def project(records, positions):
+    """Tuples of the records' fields at positions ('' where a record is short)"""
+    if not positions:
+        for _ in records:
+            yield ()
+        return
+    pick = itemgetter(*positions)
+    width = max(positions) + 1
+    for record in records:
+        if len(record) < width:
+            yield tuple(record[position] if position < len(record) else ''
+                        for position in positions)
+        elif len(positions) == 1:
+            yield (pick(record),)
+        else:
+            yield pick(record)
+
+
+def limit(rows, count):
+    """The first count rows (all of them for None)"""
+    if count is None:
+        yield from rows
+        return
+    if count <= 0:
+        return
+    for taken, row in enumerate(rows, 1):
+        yield row
+        if taken >= count:
+            return
+
+
+class TableQuery:
+    """Rows of a CSV table matching all predicates, streamed as dicts
+
+    columns restricts the rows to those columns (all by default), and
+    limit to the first limit matches. Unknown columns raise KeyError when
+    the query is created. Iterate it to run it, or records() for tuples
+    of the fields in columns order; each run reads the file again.
+    """
+
+    def __init__(self, file_path, predicates=(), columns=None, limit=None):
+        self.file_path = file_path
+        self.predicates = list(predicates)
+        self.header = read_header(file_path)
+        self.columns = list(columns) if columns is not None else list(self.header)
+        self.limit = limit
+
+        # A repeated column name means its first occurrence
+        self.positions = {}
+        for position, column in enumerate(self.header):
+            self.positions.setdefault(column, position)
+        unknown = [column for column in self.columns + [p.column for p in self.predicates]
+                   if column not in self.positions]
+        if unknown:
+            raise KeyError(f"Unknown columns: {', '.join(dict.fromkeys(unknown))}")
+
+    def records(self):
+        """Matching records as tuples of their fields in columns order"""
+        with open(self.file_path, 'r', encoding='utf-8', newline='') as f:
+            next(csv.reader(f), None)  # the header, however many lines it takes
+            rows = scan(f, self.predicates)
+            rows = where(rows, [(self.positions[p.column], p) for p in self.predicates])
+            rows = project(rows, [self.positions[column] for column in self.columns])
+            yield from limit(rows, self.limit)
+
+    def __iter__(self):
+        columns = self.columns
+        for fields in self.records():
+            yield dict(zip(columns, fields))
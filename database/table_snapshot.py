@@ -0,0 +1,295 @@
+"""
+Binary snapshots of the CSV tables for PrescripCareDB.load_table.
+
+Parsing a CSV and inferring its dtypes is by far the slowest part of every
+database_utils command. The first load of a table therefore also writes a
+snapshot next to it (prescription.csv -> prescription.csv.snapshot) holding
+each column already converted to the dtype its table_schemas.json type
+calls for. Later loads map the snapshot into memory instead of parsing:
+
+- INTEGER, DECIMAL, BOOLEAN, DATE and TIMESTAMP columns are stored as
+  NumPy arrays (with a null mask where needed) and read back as views of
+  the mapped file, without copying
+- text columns are stored as codes into their distinct values, so only
+  the distinct values are decoded; ENUM columns stay categorical
+
+A column whose values don't all convert to its schema type is kept as
+text, so validation still sees the bad values. Columns without a schema
+type keep the dtype pandas infers for them.
+
+The snapshot file is one JSON header followed by 64-byte aligned arrays.
+The header records the CSV's mtime, size and SHA-256 and the column types
+it was built with. A snapshot whose mtime and size still match is used
+as is; if only the mtime moved but the content hash matches, the header
+is updated in place; otherwise the snapshot is rebuilt from the CSV.
+"""
+
+import hashlib
+import io
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b'PCSNAP1\n'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# Header space reserved beyond its initial size, for in-place updates
+HEADER_SLACK = 256
+
+# Text columns come back with the dtype read_csv gives them
+TEXT_DTYPE = 'str' if pd.get_option('future.infer_string') else object
+
+
+def snapshot_path(csv_path):
+    """Path of the snapshot kept next to a table's CSV file"""
+    return csv_path.with_name(csv_path.name + '.snapshot')
+
+
+def column_kind(schema_type):
+    """Storage kind for a table_schemas.json column type, None if unknown"""
+    base = (schema_type or '').split('(')[0].strip().upper()
+    if base == 'INTEGER':
+        return 'integer'
+    if base == 'DECIMAL':
+        return 'decimal'
+    if base == 'BOOLEAN':
+        return 'boolean'
+    if base in ('DATE', 'TIMESTAMP'):
+        return 'datetime'
+    if base == 'ENUM':
+        return 'category'
+    if base:
+        return 'text'
+    return None
+
+
+def schema_kinds(schema):
+    """{column: kind} for the columns a table schema declares"""
+    return {
+        column: column_kind(props.get('type'))
+        for column, props in (schema or {}).get('columns', {}).items()
+    }
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _source_state(csv_path):
+    stat = os.stat(csv_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _convert(series, kind):
+    """(kind, arrays) storing a column read as text; falls back to text"""
+    present = series.notna().to_numpy()
+    if kind in ('integer', 'decimal'):
+        numbers = pd.to_numeric(series, errors='coerce')
+        if (numbers.notna().to_numpy() == present).all():
+            if kind == 'decimal':
+                return 'decimal', {'values': numbers.to_numpy(dtype='float64')}
+            values = numbers.fillna(0).to_numpy()
+            if (values == np.round(values)).all():
+                return 'integer', {'values': values.astype('int64'), 'mask': ~present}
+    elif kind == 'boolean':
+        lowered = series.str.strip().str.lower()
+        truth = lowered.isin(['true', '1', 'yes']).to_numpy()
+        falsity = lowered.isin(['false', '0', 'no']).to_numpy()
+        if ((truth | falsity) == present).all():
+            return 'boolean', {'values': truth, 'mask': ~present}
+    elif kind == 'datetime':
+        moments = pd.to_datetime(series, errors='coerce', format='ISO8601')
+        if (moments.notna().to_numpy() == present).all():
+            return 'datetime', {'values': moments.to_numpy()}
+
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    # The distinct values as one JSON array, decoded in one call on load
+    values = json.dumps([str(value) for value in uniques.tolist()], ensure_ascii=False)
+    return ('category' if kind == 'category' else 'text'), {
+        'codes': codes.astype('int32'),
+        'values': np.frombuffer(values.encode('utf-8'), dtype='uint8'),
+    }
+
+
+def _restore(kind, arrays):
+    """Column data for a stored column, viewing the mapped arrays"""
+    if kind == 'decimal':
+        return arrays['values']
+    if kind == 'integer':
+        if arrays['mask'].any():
+            return pd.arrays.IntegerArray(arrays['values'], arrays['mask'])
+        return arrays['values']
+    if kind == 'boolean':
+        if arrays['mask'].any():
+            return pd.arrays.BooleanArray(arrays['values'], arrays['mask'])
+        return arrays['values']
+    if kind == 'datetime':
+        return arrays['values']
+
+    uniques = np.array(json.loads(arrays['values'].tobytes()), dtype=object)
+    codes = arrays['codes']
+    if kind == 'category':
+        return pd.Categorical.from_codes(codes, categories=uniques)
+    values = uniques.take(codes) if len(uniques) else np.full(len(codes), np.nan, dtype=object)
+    values[codes < 0] = np.nan
+    return pd.array(values, dtype=TEXT_DTYPE) if TEXT_DTYPE != object else values
+
+
+def build_frame(data, kinds):
+    """Parse CSV bytes into (DataFrame, columns) with kinds applied
+
+    columns is the per-column storage for write_snapshot.
+    """
+    text = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=True)
+    inferred = pd.read_csv(io.BytesIO(data), nrows=1000) if any(
+        kinds.get(column) is None for column in text.columns) else None
+
+    columns = []
+    for column in text.columns:
+        kind = kinds.get(column)
+        if kind is None:
+            dtype = inferred[column].dtype
+            kind = ('integer' if pd.api.types.is_integer_dtype(dtype) else
+                    'decimal' if pd.api.types.is_float_dtype(dtype) else
+                    'boolean' if pd.api.types.is_bool_dtype(dtype) else 'text')
+        stored_kind, arrays = _convert(text[column], kind)
+        columns.append((column, stored_kind, arrays))
+
+    frame = pd.DataFrame(
+        {name: _restore(kind, arrays) for name, kind, arrays in columns},
+        index=pd.RangeIndex(len(text)),
+    )
+    return frame, columns
+
+
+def write_snapshot(path, source, kinds, rows, columns):
+    """Write a snapshot file atomically
+
+    source is (mtime_ns, size, sha256) of the CSV it was built from.
+    """
+    header = {
+        'format': FORMAT_VERSION,
+        'source': {'mtime_ns': source[0], 'size': source[1], 'sha256': source[2]},
+        'kinds': kinds,
+        'rows': rows,
+        'columns': [],
+    }
+    blobs = []
+    offset = 0
+    for name, kind, arrays in columns:
+        stored = {}
+        for role, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            stored[role] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            data = array.tobytes()
+            blobs.append(data + b'\0' * (-len(data) % ALIGNMENT))
+            offset += len(blobs[-1])
+        header['columns'].append({'name': name, 'kind': kind, 'arrays': stored})
+
+    encoded = json.dumps(header).encode('utf-8')
+    reserved = len(encoded) + HEADER_SLACK
+    reserved += -(len(MAGIC) + 8 + reserved) % ALIGNMENT
+
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', reserved) + encoded.ljust(reserved))
+            for data in blobs:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def read_header(path):
+    """(header, data start) of a snapshot file, or None if unreadable"""
+    try:
+        with open(path, 'rb') as f:
+            prefix = f.read(len(MAGIC) + 8)
+            if len(prefix) < len(MAGIC) + 8 or not prefix.startswith(MAGIC):
+                return None
+            reserved = struct.unpack('<Q', prefix[len(MAGIC):])[0]
+            header = json.loads(f.read(reserved))
+    except (OSError, ValueError):
+        return None
+    if header.get('format') != FORMAT_VERSION:
+        return None
+    return header, len(MAGIC) + 8 + reserved
+
+
+def _update_header(path, header):
+    """Rewrite a snapshot's header in place; False if it no longer fits"""
+    with open(path, 'r+b') as f:
+        reserved = struct.unpack('<Q', f.read(len(MAGIC) + 8)[len(MAGIC):])[0]
+        encoded = json.dumps(header).encode('utf-8')
+        if len(encoded) > reserved:
+            return False
+        f.write(encoded.ljust(reserved))
+    return True
+
+
+def read_snapshot(path, header, start, columns=None):
+    """DataFrame of a snapshot's columns (all, or the ones named), memory-mapped"""
+    wanted = None if columns is None else list(columns)
+    stored = {column['name']: column for column in header['columns']}
+    missing = [name for name in wanted or () if name not in stored]
+    if missing:
+        raise KeyError(f"Unknown columns: {', '.join(missing)}")
+
+    data = {}
+    if any(column['arrays'] for column in stored.values()):
+        mapped = np.memmap(path, dtype='uint8', mode='r')
+    for name in wanted if wanted is not None else stored:
+        column = stored[name]
+        arrays = {}
+        for role, spec in column['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape'])) if spec['shape'] else 1
+            arrays[role] = np.frombuffer(mapped, dtype=dtype, count=count,
+                                         offset=start + spec['offset'])
+        data[name] = _restore(column['kind'], arrays)
+    return pd.DataFrame(data, index=pd.RangeIndex(header['rows']), copy=False)
+
+
+def load(csv_path, kinds, columns=None):
+    """Table as a DataFrame, from its snapshot when it is still fresh
+
+    Returns (frame, source) with source 'snapshot' or 'csv' (a missing or
+    stale snapshot was rebuilt while loading).
+    """
+    path = snapshot_path(csv_path)
+    found = read_header(path)
+    mtime_ns, size = _source_state(csv_path)
+    if found is not None:
+        header, start = found
+        source = header['source']
+        fresh = header['kinds'] == kinds and source['size'] == size
+        if fresh and source['mtime_ns'] != mtime_ns:
+            # Touched but maybe not changed: compare the content
+            with open(csv_path, 'rb') as f:
+                fresh = file_hash(f.read()) == source['sha256']
+            if fresh:
+                source['mtime_ns'] = mtime_ns
+                _update_header(path, header)
+        if fresh:
+            try:
+                return read_snapshot(path, header, start, columns), 'snapshot'
+            except ValueError:
+                pass  # truncated or damaged: rebuild it below
+
+    with open(csv_path, 'rb') as f:
+        data = f.read()
+    frame, stored = build_frame(data, kinds)
+    try:
+        write_snapshot(path, (mtime_ns, size, file_hash(data)), kinds, len(frame), stored)
+    except OSError as e:
+        print(f"Could not write snapshot {path.name}: {e}")
+    if columns is not None:
+        frame = frame[list(columns)]
+    return frame, 'csv'
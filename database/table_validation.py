@@ -0,0 +1,745 @@
+"""
+Chunked validation of CSV tables against config/data_validation.json.
+
+A table is read in performance_settings.chunk_size row chunks, with every
+value kept as the text in the file, so memory stays the same however large
+the table is (apart from 8 bytes per row for each uniqueness check). Each
+chunk is checked column by column, each check running once per distinct
+value of the column in the chunk:
+
+- required columns (schema "required" or required_fields) must not be null
+- values must match their schema type: UUID, DATE and TIMESTAMP use the
+  data_types patterns; INTEGER, DECIMAL and BOOLEAN must parse;
+  VARCHAR(n) values fit n characters; ENUM values are listed
+- a column with "format" in its schema must match that data_types pattern
+- a column with "constraint" in its schema must meet that data_constraints
+  entry, and columns with "min"/"max" in their schema stay in range
+- "unique" columns, checked over the whole table
+
+and then against every business rule whose columns the table has. The
+rules' validation expressions are compiled once per table: comparisons
+between columns, numbers, 'strings' and current_time, joined with AND, OR
+and NOT. A comparison with a null or unparseable value passes; the column
+checks report those.
+
+error_handling decides what happens to failures: each is written to
+error_log_location, the scan stops once max_errors_per_file errors were
+found, and with stop_on_critical_error a critical error (a missing
+required column, or rows the CSV parser can't read) stops it at once.
+"""
+
+import io
+import os
+import re
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Errors kept in the results (and printed), the rest only go to the log
+MAX_REPORTED_ERRORS = 20
+# Bytes read at a time when looking for record boundaries
+SCAN_BLOCK = 1 << 20
+
+_NUMBER = re.compile(r'^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$')
+_INTEGER = re.compile(r'^[+-]?\d+$')
+# Columns whose values are never echoed in errors or the log
+_SECRET = re.compile(r'password|secret|token', re.IGNORECASE)
+
+
+class RuleSyntaxError(ValueError):
+    """Raised when a business rule's validation expression can't be parsed"""
+
+
+def base_type(schema_type):
+    """('VARCHAR', '100') for 'VARCHAR(100)'; the argument is '' if absent"""
+    match = re.match(r'^\s*(\w+)\s*(?:\((.*)\))?', schema_type or '')
+    if not match:
+        return '', ''
+    return match.group(1).upper(), match.group(2) or ''
+
+
+def _is_temporal(schema_type):
+    return base_type(schema_type)[0] in ('DATE', 'TIMESTAMP')
+
+
+def _is_numeric(schema_type):
+    return base_type(schema_type)[0] in ('INTEGER', 'DECIMAL')
+
+
+class ColumnCheck:
+    """One test of a column's non-null values
+
+    test takes an object array of distinct values and returns a boolean
+    array, True where a value fails.
+    """
+
+    def __init__(self, column, name, message, test):
+        self.column = column
+        self.name = name
+        self.message = message
+        self.test = test
+
+
+def _failing(predicate, values):
+    """Boolean array, True where predicate(value) is false"""
+    return np.fromiter((not predicate(value) for value in values), dtype=bool, count=len(values))
+
+
+def _pattern_check(column, name, pattern, description):
+    fullmatch = re.compile(pattern).fullmatch
+    return ColumnCheck(column, name, f"does not match {description}",
+                       lambda values: _failing(fullmatch, values))
+
+
+def _member_check(column, name, message, allowed, normalize=None):
+    allowed = frozenset(allowed)
+    if normalize is None:
+        test = allowed.__contains__
+    else:
+        test = lambda value: normalize(value) in allowed
+    return ColumnCheck(column, name, message, lambda values: _failing(test, values))
+
+
+def _range_check(column, name, low, high):
+    def test(values):
+        numbers = np.asarray(pd.to_numeric(values, errors='coerce'), dtype='float64')
+        bad = np.zeros(len(numbers), dtype=bool)
+        if low is not None:
+            bad |= numbers < low
+        if high is not None:
+            bad |= numbers > high
+        return bad
+    limits = ' and '.join(part for part in (
+        f">= {low}" if low is not None else '', f"<= {high}" if high is not None else '') if part)
+    return ColumnCheck(column, name, f"must be {limits}", test)
+
+
+def _length_check(column, name, low, high):
+    def test(values):
+        lengths = np.fromiter(map(len, values), dtype='int64', count=len(values))
+        bad = np.zeros(len(lengths), dtype=bool)
+        if low is not None:
+            bad |= lengths < low
+        if high is not None:
+            bad |= lengths > high
+        return bad
+    limits = ' and '.join(part for part in (
+        f"at least {low}" if low is not None else '',
+        f"at most {high}" if high is not None else '') if part)
+    return ColumnCheck(column, name, f"must be {limits} characters long", test)
+
+
+def column_checks(column, props, rules, quality, boolean_format):
+    """ColumnChecks for a column from its schema properties"""
+    data_types = rules.get('data_types', {})
+    constraints = rules.get('data_constraints', {})
+    accuracy = quality.get('accuracy', {})
+    consistency = quality.get('consistency', {})
+    kind, argument = base_type(props.get('type'))
+    checks = []
+
+    if kind == 'UUID' and accuracy.get('uuid_format_validation', True) and 'UUID' in data_types:
+        checks.append(_pattern_check(column, 'type', data_types['UUID']['pattern'],
+                                     data_types['UUID']['description']))
+    elif kind == 'DATE' and 'DATE' in data_types:
+        checks.append(_pattern_check(column, 'type', data_types['DATE']['pattern'],
+                                     data_types['DATE']['description']))
+    elif kind == 'TIMESTAMP' and 'DATETIME' in data_types:
+        checks.append(_pattern_check(column, 'type', data_types['DATETIME']['pattern'],
+                                     data_types['DATETIME']['description']))
+    elif kind == 'INTEGER':
+        checks.append(_pattern_check(column, 'type', _INTEGER.pattern, 'an integer'))
+    elif kind == 'DECIMAL':
+        checks.append(_pattern_check(column, 'type', _NUMBER.pattern, 'a number'))
+    elif kind == 'BOOLEAN':
+        checks.append(_member_check(
+            column, 'type', f"must be one of {', '.join(boolean_format)}",
+            [value.lower() for value in boolean_format], str.lower))
+    elif kind == 'VARCHAR' and argument.isdigit():
+        checks.append(_length_check(column, 'type', None, int(argument)))
+    elif kind == 'ENUM' and props.get('values') and consistency.get('enum_value_validation', True):
+        allowed = list(props['values'])
+        checks.append(_member_check(
+            column, 'enum', f"must be one of {', '.join(allowed)}", allowed))
+
+    if 'min' in props or 'max' in props:
+        checks.append(_range_check(column, 'range', props.get('min'), props.get('max')))
+
+    data_format = props.get('format')
+    enabled = {'EMAIL': accuracy.get('email_format_validation', True),
+               'PHONE': accuracy.get('phone_format_validation', True)}
+    if data_format in data_types and enabled.get(data_format, True):
+        checks.append(_pattern_check(column, 'format', data_types[data_format]['pattern'],
+                                     data_types[data_format]['description']))
+
+    name = props.get('constraint')
+    constraint = constraints.get(name)
+    if constraint:
+        if 'pattern' in constraint:
+            checks.append(_pattern_check(column, name, constraint['pattern'],
+                                         constraint.get('description', name)))
+        if 'min_length' in constraint or 'max_length' in constraint:
+            checks.append(_length_check(column, name, constraint.get('min_length'),
+                                        constraint.get('max_length')))
+        if 'min_value' in constraint or 'max_value' in constraint:
+            checks.append(_range_check(column, name, constraint.get('min_value'),
+                                       constraint.get('max_value')))
+    return checks
+
+
+_TOKEN = re.compile(r"\s*(?:(?P<number>\d+(?:\.\d+)?)|'(?P<string>[^']*)'"
+                    r"|(?P<op>>=|<=|!=|==|=|>|<)|(?P<paren>[()])|(?P<word>[A-Za-z_]\w*))")
+
+
+class BusinessRule:
+    """A data_validation.json business rule compiled to vectorized checks
+
+    evaluate(chunk) returns a boolean array, True where a row breaks the
+    rule.
+    """
+
+    def __init__(self, name, rule, expression, column_types=None):
+        self.name = name
+        self.rule = rule
+        self.expression = expression
+        self.column_types = column_types or {}
+        self.columns = set()
+        self._tokens = self._tokenize(expression)
+        self._pos = 0
+        self._tree = self._or()
+        if self._pos != len(self._tokens):
+            raise RuleSyntaxError(f"Unexpected '{self._tokens[self._pos][1]}' in rule {name}")
+
+    def _tokenize(self, expression):
+        tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            match = _TOKEN.match(expression, pos)
+            if not match or match.end() == pos:
+                raise RuleSyntaxError(f"Cannot parse rule {self.name}: {expression!r}")
+            pos = match.end()
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == 'word' and value.upper() in ('AND', 'OR', 'NOT'):
+                kind, value = 'keyword', value.upper()
+            tokens.append((kind, value))
+        return tokens
+
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else (None, None)
+
+    def _take(self):
+        token = self._peek()
+        if token[0] is None:
+            raise RuleSyntaxError(f"Rule {self.name} ends too early")
+        self._pos += 1
+        return token
+
+    def _or(self):
+        node = self._and()
+        while self._peek() == ('keyword', 'OR'):
+            self._take()
+            node = ('or', node, self._and())
+        return node
+
+    def _and(self):
+        node = self._not()
+        while self._peek() == ('keyword', 'AND'):
+            self._take()
+            node = ('and', node, self._not())
+        return node
+
+    def _not(self):
+        if self._peek() == ('keyword', 'NOT'):
+            self._take()
+            return ('not', self._not())
+        if self._peek() == ('paren', '('):
+            self._take()
+            node = self._or()
+            if self._take() != ('paren', ')'):
+                raise RuleSyntaxError(f"Missing ')' in rule {self.name}")
+            return node
+        left = self._operand()
+        kind, op = self._take()
+        if kind != 'op':
+            raise RuleSyntaxError(f"Expected a comparison in rule {self.name}")
+        return ('compare', '==' if op == '=' else op, left, self._operand())
+
+    def _operand(self):
+        kind, value = self._take()
+        if kind == 'number':
+            return ('number', float(value))
+        if kind == 'string':
+            return ('string', value)
+        if kind == 'word':
+            if value == 'current_time':
+                return ('now', None)
+            self.columns.add(value)
+            return ('column', value)
+        raise RuleSyntaxError(f"Unexpected '{value}' in rule {self.name}")
+
+    def applies_to(self, columns):
+        """Check whether a table with these columns has every column the rule uses"""
+        return bool(self.columns) and self.columns <= set(columns)
+
+    def evaluate(self, chunk):
+        return ~self._holds(self._tree, chunk)
+
+    def _holds(self, node, chunk):
+        """Boolean array, True where the rule part holds or can't be decided"""
+        if node[0] == 'or':
+            return self._holds(node[1], chunk) | self._holds(node[2], chunk)
+        if node[0] == 'and':
+            return self._holds(node[1], chunk) & self._holds(node[2], chunk)
+        if node[0] == 'not':
+            return ~self._holds(node[1], chunk)
+
+        _, op, left, right = node
+        temporal = any(side[0] == 'now' or (side[0] == 'column' and
+                       _is_temporal(self.column_types.get(side[1]))) for side in (left, right))
+        numeric = not temporal and any(side[0] == 'number' or (side[0] == 'column' and
+                                       _is_numeric(self.column_types.get(side[1])))
+                                       for side in (left, right))
+        a = self._value(left, chunk, temporal, numeric)
+        b = self._value(right, chunk, temporal, numeric)
+        with np.errstate(invalid='ignore'):
+            result = {
+                '>': a > b, '>=': a >= b, '<': a < b, '<=': a <= b,
+                '==': a == b, '!=': a != b,
+            }[op]
+        result = np.asarray(result, dtype=bool)
+        return result | pd.isna(a) | pd.isna(b)
+
+    def _value(self, operand, chunk, temporal, numeric):
+        kind, value = operand
+        if kind == 'now':
+            return np.datetime64(datetime.now().replace(microsecond=0), 's')
+        if kind == 'number':
+            return value
+        if kind == 'string':
+            return value
+        column = chunk[value]
+        if temporal:
+            return pd.to_datetime(column, errors='coerce', format='ISO8601').to_numpy()
+        if numeric:
+            return pd.to_numeric(column, errors='coerce').to_numpy(dtype='float64')
+        return column.to_numpy(dtype=object)
+
+
+def business_rules(rules, column_types):
+    """BusinessRules for the business_rules section of the validation config"""
+    compiled = []
+    for name, spec in rules.get('business_rules', {}).items():
+        compiled.append(BusinessRule(name, spec.get('rule', name), spec['validation'],
+                                     column_types))
+    return compiled
+
+
+class TableValidator:
+    """Validates one table's CSV file in chunks against its schema and rules"""
+
+    def __init__(self, table_name, schema, validation, data_format=None):
+        self.table_name = table_name
+        self.schema = schema or {}
+        self.validation = validation or {}
+        self.data_format = data_format or {}
+        rules = self.validation.get('validation_rules', {})
+        handling = self.validation.get('error_handling', {})
+        self.rules = rules
+        self.quality = self.validation.get('data_quality_checks', {})
+        self.max_errors = handling.get('max_errors_per_file')
+        self.stop_on_critical = handling.get('stop_on_critical_error', False)
+
+        self.column_props = self.schema.get('columns', {})
+        self.required = [column for column, props in self.column_props.items()
+                         if props.get('required', False)]
+        for column in rules.get('required_fields', {}).get(table_name, []):
+            if column not in self.required:
+                self.required.append(column)
+        self.unique = [column for column, props in self.column_props.items()
+                       if props.get('unique', False)]
+        self.business_rules = business_rules(rules, {
+            column: props.get('type') for column, props in self.column_props.items()})
+
+    def validate(self, file_path, chunk_size=10000, log=None):
+        """Results of validating the CSV file at file_path
+
+        log, if given, is called with each error dict as it is found.
+        """
+        return self.merge(file_path, [self.scan(file_path, chunk_size, log=log)],
+                          chunk_size, log)
+
+    def scan(self, file_path, chunk_size=10000, byte_range=None, log=None):
+        """Partial results for the rows of file_path, or those in byte_range
+
+        byte_range is a (start, end) from split_ranges(); its rows are
+        numbered from 1, and only the first range reports missing columns.
+        Unless log is given, the errors found are kept in the results for
+        merge() to number, cap and log.
+        """
+        results = {
+            'table': self.table_name,
+            'total_records': 0,
+            'columns': [],
+            'null_counts': {},
+            'data_types': {},
+            'duplicates': 0,
+            'error_count': 0,
+            'errors': [],
+            'critical': False,
+            'stopped': False,
+            'rules': [],
+            'found': None if log is not None else [],
+            'row_hashes': [],
+            'unique_hashes': {},
+        }
+        state = {'results': results, 'log': log}
+        first = byte_range is None or byte_range[0] == _data_start(file_path)
+
+        try:
+            columns = None if byte_range is None else _header(file_path)
+            with warnings.catch_warnings(), \
+                    self._chunks(file_path, chunk_size, byte_range=byte_range,
+                                 names=columns) as reader:
+                # Rows with more fields than the header must not lose them quietly
+                warnings.simplefilter('error', pd.errors.ParserWarning)
+                checks = None
+                for chunk in reader:
+                    if checks is None:
+                        checks, rules = self._prepare(chunk.columns, state, first)
+                        if self._stopping(state):
+                            break
+
+                    first_row = results['total_records'] + 1
+                    results['total_records'] += len(chunk)
+                    nulls = chunk.isna()
+                    for column, count in nulls.sum().items():
+                        results['null_counts'][column] = results['null_counts'].get(column, 0) + int(count)
+
+                    # Rows can only repeat where the unique columns do, so
+                    # with one of those whole rows are hashed only if needed
+                    unique = [column for column in self.unique if column in chunk.columns]
+                    if not unique:
+                        results['row_hashes'].append(_hashes(chunk))
+                    for column in unique:
+                        results['unique_hashes'].setdefault(column, []).append(
+                            _hashes(chunk[column].dropna()))
+
+                    self._check_chunk(chunk, nulls, first_row, checks, rules, state)
+                    if self._stopping(state):
+                        break
+
+            if checks is None:
+                # No rows: still report missing required columns
+                self._prepare(columns if columns is not None else _header(file_path),
+                              state, first)
+        except (pd.errors.ParserError, pd.errors.ParserWarning, UnicodeDecodeError) as e:
+            self._error(state, None, None, 'parse', f"CSV could not be read: {e}", None,
+                        critical=True)
+        except pd.errors.EmptyDataError:
+            self._error(state, None, None, 'parse', 'CSV file is empty', None, critical=True)
+        return results
+
+    def merge(self, file_path, parts, chunk_size=10000, log=None):
+        """Results for the whole table from the scan() results of its ranges
+
+        Parts after one that stopped are left out, as a single scan would
+        not have read them.
+        """
+        results = {key: value for key, value in parts[0].items()
+                   if key in ('table', 'columns', 'data_types', 'rules')}
+        results.update({'total_records': 0, 'null_counts': {}, 'duplicates': 0,
+                        'error_count': 0, 'errors': [], 'critical': False, 'stopped': False})
+        state = {'results': results, 'log': log}
+        row_hashes = []
+        unique_hashes = {}
+
+        for part in parts:
+            if part['found'] is None:
+                # Already logged as it was scanned
+                results['error_count'] += part['error_count']
+                results['errors'].extend(part['errors'])
+                results['critical'] = results['critical'] or part['critical']
+            else:
+                for error in part['found']:
+                    if self._stopping(state):
+                        break
+                    row = error['row'] + results['total_records'] if error['row'] else None
+                    self._error(state, row, error['column'], error['check'], error['message'],
+                                error['value'], error['critical'])
+            results['total_records'] += part['total_records']
+            for column, count in part['null_counts'].items():
+                results['null_counts'][column] = results['null_counts'].get(column, 0) + count
+            row_hashes.extend(part['row_hashes'])
+            for column, hashes in part['unique_hashes'].items():
+                unique_hashes.setdefault(column, []).extend(hashes)
+            results['stopped'] = results['stopped'] or part['stopped']
+            if self._stopping(state):
+                break
+
+        repeats = {column: _repeats(np.concatenate(hashes))
+                   for column, hashes in unique_hashes.items()}
+        if row_hashes:
+            results['duplicates'] = _repeats(np.concatenate(row_hashes))
+        elif any(repeats.values()):
+            with self._chunks(file_path, chunk_size, nrows=results['total_records']) as reader:
+                results['duplicates'] = _repeats(np.concatenate(
+                    [_hashes(chunk) for chunk in reader]))
+        if not results['stopped']:
+            for column, count in repeats.items():
+                if count:
+                    self._error(state, None, column, 'unique',
+                                f"has {count} duplicate values", None)
+        return results
+
+    def _chunks(self, file_path, chunk_size, nrows=None, byte_range=None, names=None):
+        """Reader of the CSV in chunks of text values, nulls as NaN
+
+        With byte_range, only the rows in it are read, as columns names.
+        """
+        null_value = self.data_format.get('null_representation')
+        source = file_path if byte_range is None else io.BufferedReader(
+            _ByteRange(file_path, *byte_range))
+        return pd.read_csv(source, dtype=str, chunksize=chunk_size, nrows=nrows,
+                           header=None if names is not None else 'infer', names=names,
+                           index_col=False, keep_default_na=False,
+                           na_values=[''] + ([null_value] if null_value else []))
+
+    def _prepare(self, columns, state, report=True):
+        """(column checks, business rules) for a file with these columns
+
+        Missing required columns are reported unless report is false.
+        """
+        results = state['results']
+        results['columns'] = list(columns)
+        results['data_types'] = {
+            column: self.column_props.get(column, {}).get('type', 'unknown') for column in columns}
+        for column in self.required:
+            if report and column not in columns:
+                self._error(state, None, column, 'required', 'required column is missing', None,
+                            critical=True)
+
+        checks = []
+        for column in columns:
+            if column in self.column_props:
+                checks.extend(column_checks(column, self.column_props[column], self.rules,
+                                            self.quality, self.data_format.get(
+                                                'boolean_format', ['true', 'false'])))
+        rules = [rule for rule in self.business_rules if rule.applies_to(columns)]
+        results['rules'] = [rule.name for rule in rules]
+        return checks, rules
+
+    def _check_chunk(self, chunk, nulls, first_row, checks, rules, state):
+        rows = np.arange(first_row, first_row + len(chunk))
+        for column in self.required:
+            if column in chunk.columns:
+                missing = nulls[column].to_numpy()
+                if missing.any():
+                    self._errors(state, rows[missing], column, 'required',
+                                 'required value is missing', None)
+
+        # Each check looks at a column's distinct values once, not every row
+        distinct = {}
+        for check in checks:
+            if check.column not in distinct:
+                present = ~nulls[check.column].to_numpy()
+                codes, uniques = pd.factorize(chunk[check.column].to_numpy(dtype=object)[present])
+                distinct[check.column] = present, codes, np.asarray(uniques, dtype=object)
+            present, codes, uniques = distinct[check.column]
+            if not len(uniques):
+                continue
+            bad = np.asarray(check.test(uniques), dtype=bool)[codes]
+            if bad.any():
+                shown = None if _SECRET.search(check.column) else uniques[codes[bad]]
+                self._errors(state, rows[present][bad], check.column, check.name,
+                             check.message, shown)
+            if self._stopping(state):
+                return
+
+        for rule in rules:
+            bad = rule.evaluate(chunk)
+            if bad.any():
+                self._errors(state, rows[bad], None, rule.name,
+                             f"{rule.rule} ({rule.expression})", None)
+            if self._stopping(state):
+                return
+
+    def _stopping(self, state):
+        results = state['results']
+        if results['critical'] and self.stop_on_critical:
+            results['stopped'] = True
+        if self.max_errors is not None and results['error_count'] >= self.max_errors:
+            results['stopped'] = True
+        return results['stopped']
+
+    def _errors(self, state, rows, column, check, message, values):
+        """Record errors for rows, up to max_errors_per_file in all"""
+        room = len(rows)
+        if self.max_errors is not None:
+            room = max(0, min(room, self.max_errors - state['results']['error_count']))
+        for i in range(room):
+            self._error(state, int(rows[i]), column, check, message,
+                        values[i] if values is not None else None)
+
+    def _error(self, state, row, column, check, message, value, critical=False):
+        results = state['results']
+        error = {'table': self.table_name, 'row': row, 'column': column, 'check': check,
+                 'message': message, 'value': value, 'critical': critical}
+        results['error_count'] += 1
+        results['critical'] = results['critical'] or critical
+        if results.get('found') is not None:
+            # scan() without a log: merge() reports it
+            results['found'].append(error)
+            return
+        if len(results['errors']) < MAX_REPORTED_ERRORS:
+            results['errors'].append(format_error(error))
+        if state['log'] is not None:
+            state['log'](error)
+
+
+class _ByteRange(io.RawIOBase):
+    """Read-only view of bytes start to end of a file"""
+
+    def __init__(self, file_path, start, end):
+        self._file = open(file_path, 'rb')
+        self._file.seek(start)
+        self._left = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._left)
+        if size <= 0:
+            return 0
+        data = self._file.read(size)
+        buffer[:len(data)] = data
+        self._left -= len(data)
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def _header(file_path):
+    """Column names of a CSV file"""
+    return list(pd.read_csv(file_path, nrows=0, index_col=False).columns)
+
+
+def _record_end(f, pos, inside):
+    """Offset just past the record that pos is in, and whether that is quoted
+
+    inside says whether pos is within a quoted field. A newline ends a
+    record only outside quotes; "" escapes keep the count of quotes even.
+    """
+    while True:
+        f.seek(pos)
+        block = f.read(SCAN_BLOCK)
+        if not block:
+            return pos, inside
+        offset = 0
+        while True:
+            newline = block.find(b'\n', offset)
+            if newline < 0:
+                inside ^= block.count(b'"', offset) % 2 == 1
+                break
+            inside ^= block.count(b'"', offset, newline) % 2 == 1
+            if not inside:
+                return pos + newline + 1, False
+            offset = newline + 1
+        pos += len(block)
+
+
+def _quoted_at(f, start, end, inside):
+    """Whether offset end is within a quoted field, given the state at start"""
+    f.seek(start)
+    while start < end:
+        block = f.read(min(SCAN_BLOCK, end - start))
+        if not block:
+            break
+        inside ^= block.count(b'"') % 2 == 1
+        start += len(block)
+    return inside
+
+
+def _data_start(file_path):
+    with open(file_path, 'rb') as f:
+        return _record_end(f, 0, False)[0]
+
+
+def split_ranges(file_path, parts):
+    """Up to parts (start, end) byte ranges covering a CSV file's rows
+
+    The ranges are about equally long and cut at record boundaries, so
+    quoted fields with newlines stay whole.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        start, inside = _record_end(f, 0, False)
+        ranges = []
+        step = max(1, (size - start) // max(1, parts))
+        while start < size:
+            target = start + step
+            if len(ranges) == parts - 1 or target >= size:
+                ranges.append((start, size))
+                break
+            end, inside = _record_end(f, target, _quoted_at(f, start, target, False))
+            ranges.append((start, end))
+            start = end
+    return ranges or [(start, size)]
+
+
+def _hashes(data):
+    return pd.util.hash_pandas_object(data, index=False).to_numpy()
+
+
+def _repeats(hashes):
+    """Number of values that repeat an earlier one"""
+    hashes = np.sort(hashes)
+    return int(np.count_nonzero(hashes[1:] == hashes[:-1]))
+
+
+def format_error(error):
+    """One-line description of an error dict"""
+    where = []
+    if error['row'] is not None:
+        where.append(f"row {error['row']}")
+    if error['column'] is not None:
+        where.append(f"column '{error['column']}'")
+    text = f"{', '.join(where)}: " if where else ''
+    text += f"{error['message']} [{error['check']}]"
+    if error['value'] is not None:
+        text += f" (value {error['value']!r})"
+    if error['critical']:
+        text += ' CRITICAL'
+    return text
+
+
+class ErrorLog:
+    """Appends validation errors to the error_log_location file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __call__(self, error):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._file.write(f"{stamp} {error['table']} {format_error(error)}\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
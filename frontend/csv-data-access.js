@@ -6,6 +6,8 @@ class CSVDataAccess {
         this.databasePath = databasePath;
         this.backendURL = backendURL;
         this.cache = new Map();
+        this.findResults = new Map(); // query -> { etag, data } from /find
+        this.tableVersions = new Map(); // table -> change feed version of the cached rows
         this.schemas = null;
         this.useBackend = true; // Set to true to use backend API
     }
@@ -186,6 +188,7 @@ class CSVDataAccess {
             'notification_preferences': 'user_data/notification_preferences.csv',
             'user_insurance': 'user_data/user_insurance.csv',
             'adherence_summaries': 'analytics/adherence_summaries.csv',
+            'medication_adherence': 'analytics/medication_adherence.csv',
             'health_metrics': 'analytics/health_metrics.csv',
             'lifestyle_goals': 'analytics/lifestyle_goals.csv',
             'audit_logs': 'analytics/audit_logs.csv'
@@ -231,7 +234,8 @@ class CSVDataAccess {
                 dose_events: { primary_key: 'event_id' },
                 notification_preferences: { primary_key: 'preference_id' },
                 user_insurance: { primary_key: 'insurance_id' },
-                adherence_summaries: { primary_key: 'summary_id' },
+                adherence_summaries: { primary_key: 'user_id' },
+                medication_adherence: { primary_key: 'medication_id' },
                 health_metrics: { primary_key: 'metric_id' },
                 lifestyle_goals: { primary_key: 'goal_id' },
                 audit_logs: { primary_key: 'log_id' }
@@ -258,18 +262,32 @@ class CSVDataAccess {
     async findBy(tableName, criteria) {
         try {
             if (this.useBackend) {
-                // Use backend API
+                // Use backend API; browsers don't cache POST responses, so
+                // revalidate the last result for the same query by its ETag
+                const queryKey = `${tableName}:${JSON.stringify(criteria)}`;
+                const previous = this.findResults.get(queryKey);
+                const headers = {
+                    'Content-Type': 'application/json',
+                };
+                if (previous) {
+                    headers['If-None-Match'] = previous.etag;
+                }
                 const response = await fetch(`${this.backendURL}/api/tables/${tableName}/find`, {
                     method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
+                    headers: headers,
                     body: JSON.stringify(criteria)
                 });
                 
+                if (response.status === 304 && previous) {
+                    return previous.data;
+                }
                 if (response.ok) {
                     const result = await response.json();
                     if (result.success) {
+                        const etag = response.headers.get('ETag');
+                        if (etag) {
+                            this.findResults.set(queryKey, { etag: etag, data: result.data });
+                        }
                         return result.data;
                     }
                 }
@@ -296,6 +314,29 @@ class CSVDataAccess {
         }
     }
 
+    // Run a query on the backend, e.g.
+    // { where: { end_date: { gt: '2025-10-28' } }, order_by: '-end_date', limit: 20 }
+    // Operators: eq, ne, in, gt, gte, lt, lte, prefix. Resolves to { data, plan }.
+    async query(tableName, query) {
+        if (!this.useBackend) {
+            throw new Error('Queries need the backend API');
+        }
+
+        const response = await fetch(`${this.backendURL}/api/tables/${tableName}/find`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(query)
+        });
+
+        const result = await response.json();
+        if (!response.ok || !result.success) {
+            throw new Error(result.error || `Query on ${tableName} failed`);
+        }
+        return { data: result.data, plan: result.plan };
+    }
+
     // Get all records from table
     async getAll(tableName) {
         return await this.loadCSV(tableName);
@@ -324,6 +365,40 @@ class CSVDataAccess {
         return { ...user, profile };
     }
 
+    // Profile, active prescriptions (with drug_details), progress, lifestyle and
+    // adherence of a user in one request; falls back to one lookup per table
+    async getUserDashboard(userId) {
+        if (this.useBackend) {
+            try {
+                const response = await fetch(`${this.backendURL}/api/users/${encodeURIComponent(userId)}/dashboard`);
+                if (response.status === 404) {
+                    return null;
+                }
+                if (response.ok) {
+                    const result = await response.json();
+                    if (result.success) {
+                        return result.data;
+                    }
+                }
+            } catch (error) {
+                console.warn('Dashboard request failed, loading tables one by one:', error);
+            }
+        }
+
+        const tables = ['info', 'prescription', 'progress', 'lifestyle', 'adherence_summaries', 'medication_adherence'];
+        const [info, prescription, progress, lifestyle, adherenceSummaries, medicationAdherence] = await Promise.all(
+            tables.map(table => this.findBy(table, { user_id: userId }))
+        );
+        return {
+            info: info[0] || null,
+            prescription: prescription,
+            progress: progress[0] || null,
+            lifestyle: lifestyle[0] || null,
+            adherence_summaries: adherenceSummaries[0] || null,
+            medication_adherence: medicationAdherence
+        };
+    }
+
     // Get user medications with drug details
     async getUserMedicationsWithDetails(userId) {
         const medications = await this.loadCSV('user_medications');
@@ -360,6 +435,8 @@ class CSVDataAccess {
     // Clear cache
     clearCache() {
         this.cache.clear();
+        this.findResults.clear();
+        this.tableVersions.clear();
     }
 
     // Generate UUID (compatible with database format)
@@ -473,6 +550,138 @@ class CSVDataAccess {
         return true;
     }
 
+    // Ranked drug search by name, generic name, brand name or class
+    async searchDrugs(term, limit = 20) {
+        if (this.useBackend) {
+            try {
+                const params = new URLSearchParams({ q: term, limit: limit });
+                const response = await fetch(`${this.backendURL}/api/drugs/search?${params}`);
+                if (response.ok) {
+                    const result = await response.json();
+                    if (result.success) {
+                        return result.data;
+                    }
+                }
+            } catch (error) {
+                console.warn('Drug search backend unavailable, searching locally:', error);
+            }
+        }
+        
+        // Fallback: case-insensitive substring match on the loaded table
+        const needle = term.toLowerCase();
+        const drugs = await this.loadCSV('drugs_master');
+        return drugs.filter(drug => ['drug_name', 'generic_name', 'brand_names', 'drug_class']
+            .some(field => String(drug[field] || '').toLowerCase().includes(needle)))
+            .slice(0, limit);
+    }
+
+    // Interactions among a user's medications and the candidate drugs
+    // (drug ids or names), most severe first
+    async checkInteractions(userId, candidates = []) {
+        if (this.useBackend) {
+            try {
+                const params = new URLSearchParams();
+                candidates.filter(Boolean).forEach(candidate => params.append('candidate', candidate));
+                const response = await fetch(`${this.backendURL}/api/users/${encodeURIComponent(userId)}/interactions?${params}`);
+                if (response.ok) {
+                    const result = await response.json();
+                    if (result.success) {
+                        return result.data;
+                    }
+                }
+            } catch (error) {
+                console.warn('Interaction check backend unavailable, checking locally:', error);
+            }
+        }
+        
+        // Fallback: check the candidates against each other with a pair map
+        const interactions = await this.loadCSV('drug_interactions');
+        const drugs = await this.loadCSV('drugs_master');
+        const pairKey = (a, b) => (a < b ? `${a}|${b}` : `${b}|${a}`);
+        const pairs = new Map();
+        interactions.forEach(interaction => {
+            const key = pairKey(interaction.drug1_id, interaction.drug2_id);
+            if (!pairs.has(key)) pairs.set(key, []);
+            pairs.get(key).push(interaction);
+        });
+        const drugName = drugId => drugs.find(d => d.drug_id === drugId)?.drug_name || 'Unknown';
+        
+        const drugIds = [...new Set(candidates.filter(Boolean))];
+        const found = [];
+        for (let i = 0; i < drugIds.length; i++) {
+            for (let j = i + 1; j < drugIds.length; j++) {
+                (pairs.get(pairKey(drugIds[i], drugIds[j])) || []).forEach(interaction => {
+                    found.push({
+                        ...interaction,
+                        drug1_id: drugIds[i],
+                        drug1_name: drugName(drugIds[i]),
+                        drug2_id: drugIds[j],
+                        drug2_name: drugName(drugIds[j])
+                    });
+                });
+            }
+        }
+        return found;
+    }
+
+    // Apply many inserts/updates/upserts/deletes with one backend write
+    // operations: [{ op: 'insert' | 'update' | 'upsert' | 'delete', key, record }]
+    async batch(tableName, operations) {
+        if (!this.useBackend) {
+            throw new Error('Batch writes need the backend API');
+        }
+
+        const response = await fetch(`${this.backendURL}/api/tables/${tableName}/batch`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ operations })
+        });
+
+        const result = await response.json();
+        // Clear cache to force reload
+        this.cache.delete(tableName);
+        if (!response.ok) {
+            throw new Error(result.error || `Batch write to ${tableName} failed`);
+        }
+        return result;
+    }
+
+    // Bring a cached table up to date from the backend change feed, fetching
+    // only the rows changed since the last sync (the whole table the first time)
+    async syncTable(tableName) {
+        if (!this.useBackend) {
+            return this.loadCSV(tableName);
+        }
+
+        let since = this.cache.has(tableName) ? (this.tableVersions.get(tableName) || 0) : 0;
+        let data = since ? this.cache.get(tableName) : [];
+        let hasMore = true;
+        while (hasMore) {
+            const response = await fetch(`${this.backendURL}/api/tables/${tableName}/changes?since=${since}`);
+            const result = await response.json();
+            if (!response.ok || !result.success) {
+                throw new Error(result.error || `Syncing ${tableName} failed`);
+            }
+
+            if (result.reset) {
+                data = result.data;
+            } else if (result.data.length) {
+                // Each change carries every current row of its key
+                const changed = new Map(result.data.map(change => [String(change.key), change.rows]));
+                data = data.filter(record => !changed.has(String(record[result.key])));
+                changed.forEach(rows => data.push(...rows));
+            }
+            since = result.version;
+            hasMore = result.has_more;
+        }
+
+        this.cache.set(tableName, data);
+        this.tableVersions.set(tableName, since);
+        return data;
+    }
+
     // Fallback data when CSV files can't be loaded
     getFallbackData(tableName) {
         const fallbackData = {
@@ -625,6 +834,7 @@ class CSVDataAccess {
             notification_preferences: [],
             user_insurance: [],
             adherence_summaries: [],
+            medication_adherence: [],
             health_metrics: [],
             lifestyle_goals: [],
             audit_logs: []
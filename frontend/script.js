@@ -138,16 +138,16 @@ async function handleLogin(event) {
         
         const authUser = authUsers[0];
         
-        // Get user info from info table
-        const infoUsers = await csvDB.findBy('info', { user_id: authUser.user_id });
+        // Get the user's profile, prescriptions, progress and lifestyle in one go
+        const dashboard = await csvDB.getUserDashboard(authUser.user_id);
         
-        if (infoUsers.length === 0) {
+        if (!dashboard || !dashboard.info) {
             hideLoadingState();
             showNotification('User profile not found', 'error');
             return;
         }
         
-        const userInfo = infoUsers[0];
+        const userInfo = dashboard.info;
         
         // Create unified user object compatible with frontend
         currentUser = {
@@ -813,14 +813,13 @@ async function updateOverviewStats() {
             activeMedsStat.textContent = activeMeds.length;
         }
         
-        // Update adherence statistics
-        const adherenceData = await csvDB.findBy('adherence_summaries', { user_id: currentUser.user_id });
-        if (adherenceData.length > 0) {
-            const latestAdherence = adherenceData[adherenceData.length - 1];
-            
+        // Update adherence statistics from the joined dashboard request
+        const dashboard = await csvDB.getUserDashboard(currentUser.user_id);
+        const adherence = dashboard && dashboard.adherence_summaries;
+        if (adherence) {
             const adherenceStats = document.querySelectorAll('.stat-card .stat-number');
             if (adherenceStats[2]) { // Streak days
-                adherenceStats[2].textContent = latestAdherence.streak_days || 0;
+                adherenceStats[2].textContent = adherence.current_streak_days || 0;
             }
         }
         
@@ -1426,15 +1425,20 @@ async function deleteMedicationFromDB(medicationId) {
 }
 
 // Drug search functionality
+let drugSearchSequence = 0;
+
 async function searchDrugs() {
     const searchTerm = document.getElementById('drugSearchInput').value.trim();
+    const sequence = ++drugSearchSequence;
     if (!searchTerm) {
         clearDrugSearchResults();
         return;
     }
     
     try {
-        const drugs = await csvDB.findBy('drugs_master', { drug_name: searchTerm });
+        const drugs = await csvDB.searchDrugs(searchTerm);
+        // Typing fires a search per keystroke; only show the latest one
+        if (sequence !== drugSearchSequence) return;
         displayDrugSearchResults(drugs);
     } catch (error) {
         console.error('Drug search error:', error);
@@ -1552,32 +1556,20 @@ async function checkInteractions() {
     showLoadingState('Checking drug interactions...');
     
     try {
+        // Medications kept in the browser are checked alongside the user's
+        // prescriptions on the server
         const userMedications = await csvDB.getUserMedicationsWithDetails(currentUser.user_id);
-        const interactions = await csvDB.getAll('drug_interactions');
-        
-        const foundInteractions = [];
-        
-        // Check each pair of user medications for interactions
-        for (let i = 0; i < userMedications.length; i++) {
-            for (let j = i + 1; j < userMedications.length; j++) {
-                const med1 = userMedications[i];
-                const med2 = userMedications[j];
-                
-                const interaction = interactions.find(int => 
-                    (int.drug1_id === med1.drug_id && int.drug2_id === med2.drug_id) ||
-                    (int.drug1_id === med2.drug_id && int.drug2_id === med1.drug_id)
-                );
-                
-                if (interaction) {
-                    foundInteractions.push({
-                        drug1: med1.drug_details?.drug_name || 'Unknown',
-                        drug2: med2.drug_details?.drug_name || 'Unknown',
-                        severity: interaction.severity_level,
-                        description: interaction.interaction_description
-                    });
-                }
-            }
-        }
+        const interactions = await csvDB.checkInteractions(
+            currentUser.user_id,
+            userMedications.map(med => med.drug_id)
+        );
+        
+        const foundInteractions = interactions.map(interaction => ({
+            drug1: interaction.drug1_name || 'Unknown',
+            drug2: interaction.drug2_name || 'Unknown',
+            severity: interaction.severity_level,
+            description: interaction.interaction_description
+        }));
         
         hideLoadingState();
         
@@ -1623,9 +1615,12 @@ function displayInteractionResults(interactions) {
 }
 
 // Notification system
+let reminderStream = null;
+let localReminderTimer = null;
+
 async function initializeNotifications() {
-    // Set up periodic reminders
-    setInterval(checkMedicationReminders, 60000); // Check every minute
+    // Reminders are pushed by the backend as doses fall due
+    subscribeToReminders();
     
     // Request notification permission
     if ('Notification' in window && Notification.permission === 'default') {
@@ -1645,6 +1640,61 @@ async function initializeNotifications() {
     }
 }
 
+// Receive dose reminders from the backend over Server-Sent Events
+function subscribeToReminders() {
+    if (!currentUser || !currentUser.user_id) return;
+    if (reminderStream) {
+        reminderStream.close();
+        reminderStream = null;
+    }
+    
+    if (!csvDB.useBackend || !('EventSource' in window)) {
+        startLocalReminderChecks();
+        return;
+    }
+    
+    const stream = new EventSource(
+        `${csvDB.backendURL}/api/users/${encodeURIComponent(currentUser.user_id)}/reminders/stream`
+    );
+    let connected = false;
+    
+    stream.onopen = () => {
+        connected = true;
+        stopLocalReminderChecks();
+    };
+    stream.addEventListener('reminder', event => {
+        if (window.userNotificationPreferences && !window.userNotificationPreferences.dose_reminders_enabled) {
+            return;
+        }
+        const reminder = JSON.parse(event.data);
+        showMedicationReminder(reminder.medicine_name, reminder.dose);
+    });
+    stream.onerror = () => {
+        // The browser reconnects by itself once connected; if the backend
+        // was never reachable, check locally instead
+        if (!connected) {
+            stream.close();
+            reminderStream = null;
+            startLocalReminderChecks();
+        }
+    };
+    reminderStream = stream;
+}
+
+// Fallback when the backend is not available: check once a minute
+function startLocalReminderChecks() {
+    if (!localReminderTimer) {
+        localReminderTimer = setInterval(checkMedicationReminders, 60000);
+    }
+}
+
+function stopLocalReminderChecks() {
+    if (localReminderTimer) {
+        clearInterval(localReminderTimer);
+        localReminderTimer = null;
+    }
+}
+
 async function checkMedicationReminders() {
     if (!currentUser || !currentUser.user_id) return;
     